@@ -1,26 +1,260 @@
+from fnmatch import fnmatchcase
 from functools import wraps
-from .redis_config import cache_manager
+from itertools import count
+from .redis_config import cache_manager, async_cache_manager, NOT_FOUND, on_invalidate
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
 import hashlib
+import os
+import threading
+import time
 
-def cache_result(ttl_type: str = 'frequent_data', key_prefix: str = "spa_"):
-    """Decorator para cachear resultados de funciones específicas de tu dominio"""
+# Segundos que el resultado de un líder sigue registrado tras terminar, aunque no quede en L1
+# (temp_data, TTL de L1 corto): cubre a quienes leyeron Redis antes de que el líder guardara el valor.
+# Solo lo reciben las llamadas que empezaron antes de que el líder terminara.
+SINGLE_FLIGHT_GRACE_SECONDS = float(os.getenv('CACHE_SINGLE_FLIGHT_GRACE', 1.0))
+# Espera máxima de un seguidor síncrono; después calcula el valor por su cuenta
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('CACHE_SINGLE_FLIGHT_TIMEOUT', 10.0))
+
+# Orden de llegada/terminación: un resultado se comparte con quien llegó antes de que estuviera listo
+_ticket = count()
+
+
+class _LeaderCancelled(Exception):
+    """El líder se canceló (p. ej. el cliente se desconectó): los seguidores eligen un nuevo líder"""
+
+
+class _InFlightCall:
+    """Resultado compartido de una llamada síncrona en curso (single-flight)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.expires_at = float("inf")  # Hasta cuándo sigue registrado el resultado ya calculado
+        self.resolved_ticket = float("inf")
+
+    def shareable(self, now: float, joined: int) -> bool:
+        """En curso, o terminada con éxito después de que llegara quien pregunta"""
+        if not self.done.is_set():
+            return True
+        return self.error is None and now < self.expires_at and joined < self.resolved_ticket
+
+    def expired(self, now: float) -> bool:
+        return self.done.is_set() and (self.error is not None or now >= self.expires_at)
+
+
+def _build_cache_key(key_prefix: str, func_name: str, args, kwargs) -> str:
+    """Genera clave única basada en función y parámetros"""
+    args_str = str(args) + str(sorted(kwargs.items()))
+    key_hash = hashlib.md5(args_str.encode()).hexdigest()[:8]
+    return f"{key_prefix}:{func_name}:{key_hash}"
+
+
+def _from_cache(value: Any) -> Any:
+    """Las entradas negativas se devuelven al llamador como None"""
+    return None if value is NOT_FOUND else value
+
+
+def _invalidated_keys(keys: Iterable[str], cache_keys: Optional[List[str]], cache_pattern: Optional[str]) -> List[str]:
+    """Claves de cache_result afectadas por una invalidación (las del aviso van con el prefijo de datos)"""
+    if cache_keys is None and cache_pattern is None:
+        return list(keys)
+    matched = []
+    invalidated = set(cache_keys or ())
+    for key in keys:
+        full_key = cache_manager.get_cache_key("data", key)
+        if full_key in invalidated or (cache_pattern and fnmatchcase(full_key, cache_pattern)):
+            matched.append(key)
+    return matched
+
+
+def cache_result(ttl_type: str = 'frequent_data', key_prefix: str = "spa_", tags: Iterable[str] = None,
+                 cache_not_found: bool = False):
+    """
+    Decorator para cachear resultados de funciones específicas de tu dominio.
+    Soporta funciones síncronas y `async def`; los misses concurrentes de una
+    misma clave se agrupan en una sola llamada (evita estampidas al expirar).
+    Pasado el TTL soft del ttl_type se devuelve el valor stale y se refresca en segundo plano.
+    `tags` registra las claves para invalidarlas con invalidate_tag.
+    Con `cache_not_found` un resultado None se guarda como entrada negativa (negative_ttl).
+    """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            in_flight: Dict[str, asyncio.Future] = {}
+            resolved_tickets: Dict[asyncio.Future, int] = {}
+            background_refreshes: Set[asyncio.Task] = set()
+
+            def _register(cache_key: str) -> asyncio.Future:
+                future = asyncio.get_running_loop().create_future()
+                in_flight[cache_key] = future
+                return future
+
+            def _forget(cache_key: str, future: asyncio.Future):
+                resolved_tickets.pop(future, None)
+                if in_flight.get(cache_key) is future:
+                    del in_flight[cache_key]
+
+            def _drop_invalidated(cache_keys, cache_pattern):
+                # Tras invalidar, nadie debe recibir el resultado anterior ni unirse al cálculo previo
+                for key in _invalidated_keys(list(in_flight), cache_keys, cache_pattern):
+                    future = in_flight.pop(key, None)
+                    if future is not None:
+                        resolved_tickets.pop(future, None)
+            on_invalidate(_drop_invalidated)
+
+            async def _lead(cache_key: str, future: asyncio.Future, args, kwargs):
+                """Ejecuta la función como único 'líder' de la clave y guarda el resultado"""
+                try:
+                    result = await func(*args, **kwargs)
+                    if result is None and cache_not_found:
+                        await async_cache_manager.set_not_found(cache_key, tags)
+                    else:
+                        await async_cache_manager.set_cache(cache_key, result, ttl_type, tags)
+                except asyncio.CancelledError:
+                    # No se cancela el futuro compartido: los seguidores reintentan con otro líder
+                    _forget(cache_key, future)
+                    future.set_exception(_LeaderCancelled())
+                    future.exception()
+                    raise
+                except BaseException as e:
+                    _forget(cache_key, future)
+                    future.set_exception(e)
+                    future.exception()  # Evita el aviso si nadie más estaba esperando
+                    raise
+                resolved_tickets[future] = next(_ticket)
+                future.set_result(result)
+                # El resultado se sigue compartiendo un momento, independientemente de L1
+                asyncio.get_running_loop().call_later(SINGLE_FLIGHT_GRACE_SECONDS, _forget, cache_key, future)
+                return result
+
+            async def _refresh(cache_key: str, future: asyncio.Future, args, kwargs):
+                try:
+                    await _lead(cache_key, future, args, kwargs)
+                except Exception as e:
+                    print(f"Error refrescando cache {cache_key}: {e!r}")
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key = _build_cache_key(key_prefix, func.__name__, args, kwargs)
+                joined = next(_ticket)
+
+                while True:
+                    # Si otra corrutina ya está calculando esta clave, espera su resultado
+                    pending = in_flight.get(cache_key)
+                    if pending is not None and not pending.done():
+                        try:
+                            return await asyncio.shield(pending)
+                        except _LeaderCancelled:
+                            continue
+
+                    # Intenta obtener del cache
+                    cached_result, is_stale = await async_cache_manager.get_cache_with_state(cache_key, ttl_type)
+                    if cached_result is not None:
+                        # Pasado el TTL soft: se sirve el valor stale y se refresca en segundo plano
+                        # (salvo que un refresco recién terminado ya haya dejado el valor nuevo en L1)
+                        pending = in_flight.get(cache_key)
+                        refreshing = pending is not None and not pending.done()
+                        if is_stale and not refreshing and async_cache_manager.peek_local(cache_key) is None:
+                            task = asyncio.create_task(_refresh(cache_key, _register(cache_key), args, kwargs))
+                            background_refreshes.add(task)
+                            task.add_done_callback(background_refreshes.discard)
+                        return _from_cache(cached_result)
+
+                    # Mientras se consultaba Redis otra corrutina pudo tomar el cálculo (o terminarlo
+                    # después de que esta llegara: su resultado se comparte aunque no esté en L1)
+                    pending = in_flight.get(cache_key)
+                    if pending is not None and (not pending.done() or joined < resolved_tickets.get(pending, -1)):
+                        try:
+                            return await asyncio.shield(pending)
+                        except _LeaderCancelled:
+                            continue
+                    recent_result = async_cache_manager.peek_local(cache_key)
+                    if recent_result is not None:
+                        return _from_cache(recent_result)
+
+                    return await _lead(cache_key, _register(cache_key), args, kwargs)
+            return async_wrapper
+
+        in_flight_calls: Dict[str, _InFlightCall] = {}
+        in_flight_lock = threading.Lock()
+
+        def _drop_invalidated_calls(cache_keys, cache_pattern):
+            with in_flight_lock:
+                for key in _invalidated_keys(list(in_flight_calls), cache_keys, cache_pattern):
+                    del in_flight_calls[key]
+        on_invalidate(_drop_invalidated_calls)
+
+        def _try_register(cache_key: str, joined: int) -> Tuple[_InFlightCall, bool]:
+            """Devuelve la llamada en curso (o terminada después de `joined`) y si quien llama es el líder"""
+            now = time.monotonic()
+            with in_flight_lock:
+                call = in_flight_calls.get(cache_key)
+                if call is not None and call.shareable(now, joined):
+                    return call, False
+                # Se descartan los resultados cuyo periodo de gracia ya venció
+                for key in [key for key, other in in_flight_calls.items() if other.expired(now)]:
+                    del in_flight_calls[key]
+                call = in_flight_calls[cache_key] = _InFlightCall()
+                return call, True
+
+        def _lead(cache_key: str, call: _InFlightCall, args, kwargs):
+            try:
+                call.result = func(*args, **kwargs)
+                if call.result is None and cache_not_found:
+                    cache_manager.set_not_found(cache_key, tags)
+                else:
+                    cache_manager.set_cache(cache_key, call.result, ttl_type, tags)
+                return call.result
+            except BaseException as e:
+                call.error = e
+                with in_flight_lock:
+                    if in_flight_calls.get(cache_key) is call:
+                        del in_flight_calls[cache_key]
+                raise
+            finally:
+                # Con éxito la llamada queda registrada durante el periodo de gracia
+                call.expires_at = time.monotonic() + SINGLE_FLIGHT_GRACE_SECONDS
+                call.resolved_ticket = next(_ticket)
+                call.done.set()
+
+        def _refresh(cache_key: str, call: _InFlightCall, args, kwargs):
+            try:
+                _lead(cache_key, call, args, kwargs)
+            except Exception as e:
+                print(f"Error refrescando cache {cache_key}: {e!r}")
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Genera clave única basada en función y parámetros
-            func_name = func.__name__
-            args_str = str(args) + str(sorted(kwargs.items()))
-            key_hash = hashlib.md5(args_str.encode()).hexdigest()[:8]
-            cache_key = f"{key_prefix}:{func_name}:{key_hash}"
+            cache_key = _build_cache_key(key_prefix, func.__name__, args, kwargs)
+            joined = next(_ticket)
 
             # Intenta obtener del cache
-            cached_result = cache_manager.get_cache(cache_key)
+            cached_result, is_stale = cache_manager.get_cache_with_state(cache_key, ttl_type)
             if cached_result is not None:
-                return cached_result
+                if is_stale and cache_manager.peek_local(cache_key) is None:
+                    call, is_leader = _try_register(cache_key, joined)
+                    if is_leader:
+                        threading.Thread(target=_refresh, args=(cache_key, call, args, kwargs), daemon=True).start()
+                return _from_cache(cached_result)
+
+            recent_result = cache_manager.peek_local(cache_key)
+            if recent_result is not None:
+                return _from_cache(recent_result)
 
-            # Si no existe, ejecuta función y guarda resultado
-            result = func(*args, **kwargs)
-            cache_manager.set_cache(cache_key, result, ttl_type)
-            return result
+            while True:
+                call, is_leader = _try_register(cache_key, joined)
+                if is_leader:
+                    # Si no existe, ejecuta función y guarda resultado
+                    return _lead(cache_key, call, args, kwargs)
+                if call.done.wait(SINGLE_FLIGHT_WAIT_SECONDS):
+                    if call.error is not None:
+                        raise call.error
+                    return call.result
+                # El líder no responde: se le quita el registro y se calcula de nuevo
+                print(f"Single-flight {cache_key}: el líder no terminó en {SINGLE_FLIGHT_WAIT_SECONDS}s, se recalcula")
+                with in_flight_lock:
+                    if in_flight_calls.get(cache_key) is call:
+                        del in_flight_calls[cache_key]
         return wrapper
     return decorator
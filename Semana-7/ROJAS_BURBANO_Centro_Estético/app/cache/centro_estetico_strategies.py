@@ -1,18 +1,133 @@
 # app/cache/domain_specific_caching.py
-from .redis_config import cache_manager
+import asyncio
+import importlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from .cache_decorators import _build_cache_key
+from .redis_config import async_cache_manager
+
+
+def endpoint_cache_key(key_prefix: str, func_name: str, *args, **kwargs) -> str:
+    """Clave bajo la que @cache_result guarda la respuesta de un endpoint (misma construcción que el decorador)"""
+    return _build_cache_key(key_prefix, func_name, args, kwargs)
+
+
+# Router con los endpoints cacheados del centro estético. Se importa al hacer el warm-up (no al
+# cargar el módulo) y se llama a la función sin decorar: la misma consulta que hace el endpoint.
+ENDPOINT_MODULE = "app.routers.centro_estetico_optimized"
+
+
+def _resolve_endpoint(endpoint) -> Optional[Callable[[], Awaitable[Any]]]:
+    """Función sin decorar del endpoint (objeto o "modulo:funcion"); None si no se puede importar"""
+    if isinstance(endpoint, str):
+        module_name, _, func_name = endpoint.partition(":")
+        try:
+            endpoint = getattr(importlib.import_module(module_name), func_name)
+        except Exception as e:  # Router no disponible en este despliegue (p. ej. falta su servicio)
+            print(f"Endpoint {module_name}:{func_name} no disponible para el warm-up: {e!r}")
+            return None
+    return getattr(endpoint, "__wrapped__", endpoint)
+
 
 class DomainSpecificCaching:
 
+    # Claves calientes declaradas por dominio: clave -> (ttl_type, loader asíncrono)
+    hot_keys: Dict[str, Dict[str, Tuple[str, Callable[[], Awaitable[Any]]]]] = {
+        "spa_tratamientos": {}
+    }
+
+    # Endpoints cacheados a precargar por dominio: (endpoint, key_prefix, ttl_type). Su clave es
+    # la misma que arma @cache_result, así el primer request ya es un hit.
+    endpoint_hot_keys: Dict[str, List[Tuple[Any, str, str]]] = {
+        "spa_tratamientos": [
+            # Tratamientos populares (GET /spa/tratamientos/frecuentes)
+            (f"{ENDPOINT_MODULE}:get_tratamientos_frecuentes", 'spa_tratamientos_frecuentes', 'frequent_data'),
+            # Configuración estándar: horarios de atención, precios (GET /spa/configuracion)
+            (f"{ENDPOINT_MODULE}:get_configuracion_dominio", 'spa_config', 'stable_data'),
+            # Información de referencia: tipos de piel, equipos, etc. (GET /spa/catalogo)
+            (f"{ENDPOINT_MODULE}:get_catalogo_tratamientos", 'spa_catalogo_tratamientos', 'reference_data'),
+        ]
+    }
+
+    # Resultado del último warm-up por dominio (para readiness y monitoring)
+    last_warm_up: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def register_hot_key(cls, domain_prefix: str, key: str, loader: Callable[[], Awaitable[Any]],
+                         ttl_type: str = 'frequent_data'):
+        """Declara una clave a precargar en el arranque"""
+        cls.hot_keys.setdefault(domain_prefix, {})[key] = (ttl_type, loader)
+
+    @classmethod
+    def register_endpoint_hot_key(cls, domain_prefix: str, endpoint, key_prefix: str,
+                                  ttl_type: str = 'frequent_data'):
+        """Declara un endpoint con @cache_result (sin parámetros) a precargar en el arranque"""
+        cls.endpoint_hot_keys.setdefault(domain_prefix, []).append((endpoint, key_prefix, ttl_type))
+
+    @classmethod
+    def _declared_keys(cls, domain_prefix: str) -> Tuple[Dict[str, Tuple[str, Callable]], List[str]]:
+        """Claves a precargar del dominio y las de endpoints sin loader disponible (se omiten)"""
+        declared = dict(cls.hot_keys.get(domain_prefix, {}))
+        skipped = []
+        for endpoint, key_prefix, ttl_type in cls.endpoint_hot_keys.get(domain_prefix, []):
+            func_name = endpoint.rpartition(":")[2] if isinstance(endpoint, str) else endpoint.__name__
+            key = endpoint_cache_key(key_prefix, func_name)
+            loader = _resolve_endpoint(endpoint)
+            if loader is None:
+                skipped.append(key)
+            else:
+                declared[key] = (ttl_type, loader)
+        return declared, skipped
+
+    @staticmethod
+    async def warm_up(domain_prefix: str, concurrency: int = 4) -> Dict[str, Any]:
+        """
+        Precarga las claves calientes del dominio: ejecuta los loaders en paralelo
+        (como máximo `concurrency` a la vez) y escribe los resultados con set_many.
+        """
+        if domain_prefix not in DomainSpecificCaching.hot_keys and \
+                domain_prefix not in DomainSpecificCaching.endpoint_hot_keys:
+            raise ValueError(f"Tipo de dominio no reconocido: {domain_prefix}")
+        declared, skipped = DomainSpecificCaching._declared_keys(domain_prefix)
+
+        start_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        loaded: Dict[str, Dict[str, Any]] = {}
+        failed = []
+
+        async def _load(key: str, ttl_type: str, loader):
+            async with semaphore:
+                try:
+                    loaded.setdefault(ttl_type, {})[key] = await loader()
+                except Exception as e:
+                    failed.append(key)
+                    print(f"Error precargando {key}: {e!r}")
+
+        await asyncio.gather(*[_load(key, ttl_type, loader) for key, (ttl_type, loader) in declared.items()])
+
+        # Una escritura en pipeline por tipo de TTL
+        written = await asyncio.gather(*[
+            async_cache_manager.set_many(items, ttl_type) for ttl_type, items in loaded.items()
+        ])
+        keys_loaded = sum(len(items) for items, ok in zip(loaded.values(), written) if ok)
+        failed.extend(key for items, ok in zip(loaded.values(), written) if not ok for key in items)
+
+        report = {
+            "domain": domain_prefix,
+            "keys_loaded": keys_loaded,
+            "keys_failed": sorted(failed),
+            "keys_skipped": sorted(skipped),
+            "duration_seconds": round(time.perf_counter() - start_time, 4),
+            "completed_at": time.time(),
+        }
+        DomainSpecificCaching.last_warm_up[domain_prefix] = report
+        print(f"Warm-up de cache {domain_prefix}: {keys_loaded} claves en {report['duration_seconds']}s")
+        return report
+
     @staticmethod
     async def cache_for_domain_type_a():
         """Estrategias para dominios tipo A (alta frecuencia de consultas)"""
-        # Cache de tratamientos populares por usuario/cliente
-        cache_manager.set_cache('spa_tratamientos:frecuentes', ['Tratamiento Facial Rejuvenecedor', 'Masaje Relax', 'Limpieza Facial'])
-        # Cache de configuraciones estándar (horarios de atención, precios)
-        cache_manager.set_cache('spa_configuracion:horarios', 'Lunes a Viernes, 9am - 6pm')
-        cache_manager.set_cache('spa_configuracion:precio_base', 100)
-        # Cache de información de referencia (tipos de piel, etc.)
-        cache_manager.set_cache('spa_referencia:tipos_de_piel', ['Normal', 'Grasa', 'Mixta', 'Seca'])
+        return await DomainSpecificCaching.warm_up("spa_tratamientos")
 
     @staticmethod
     async def implement_domain_cache(domain_prefix: str):
@@ -21,6 +136,6 @@ class DomainSpecificCaching:
         Personalizado para el contexto del negocio del centro estético.
         """
         if domain_prefix == "spa_tratamientos":
-            await DomainSpecificCaching.cache_for_domain_type_a()  # Alta frecuencia de consultas (tratamientos populares, precios)
+            return await DomainSpecificCaching.cache_for_domain_type_a()  # Alta frecuencia de consultas (tratamientos populares, precios)
         else:
             raise ValueError(f"Tipo de dominio no reconocido: {domain_prefix}")
@@ -0,0 +1,98 @@
+# app/cache/l1_invalidation.py
+import logging
+import threading
+from typing import List, Optional
+
+import redis
+
+from .local_cache import LocalLRUCache
+
+logger = logging.getLogger("cache")
+
+# Mensajes del canal: claves Redis exactas, un patrón glob o todo el L1
+KEYS_PREFIX = b"keys:"
+PATTERN_PREFIX = b"pattern:"
+CLEAR_ALL = b"all"
+
+
+def keys_message(cache_keys: List[bytes]) -> bytes:
+    return KEYS_PREFIX + b"\n".join(cache_keys)
+
+
+def pattern_message(cache_pattern: Optional[str]) -> bytes:
+    return PATTERN_PREFIX + cache_pattern.encode() if cache_pattern else CLEAR_ALL
+
+
+class L1InvalidationListener:
+    """
+    Propaga las invalidaciones del L1 entre workers: cada proceso se suscribe al canal
+    del dominio en un hilo propio y descarta de su L1 lo que otro worker invalidó en Redis.
+    Si la suscripción se corta se vacía el L1 al reconectar (pudo perderse algún mensaje).
+    """
+
+    def __init__(self, redis_client: redis.Redis, local_cache: LocalLRUCache, channel: str,
+                 poll_timeout: float = 0.25, retry_seconds: float = 1.0):
+        self.redis_client = redis_client
+        self.local_cache = local_cache
+        self.channel = channel
+        self.poll_timeout = poll_timeout  # Menor que socket_timeout del pool
+        self.retry_seconds = retry_seconds
+        self.received = 0
+        self.subscribed = threading.Event()
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="l1-invalidation-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.subscribed.clear()
+
+    def _run(self):
+        reconnecting = False
+        while not self._stop.is_set():
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                if reconnecting:
+                    self.local_cache.clear()
+                self.subscribed.set()
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=self.poll_timeout)
+                    if message is not None:
+                        self._handle_safely(message["data"])
+            except redis.RedisError as e:
+                print(f"Suscripción de invalidación L1 interrumpida: {e!r}")
+            finally:
+                self.subscribed.clear()
+                pubsub.close()
+            reconnecting = True
+            self._stop.wait(self.retry_seconds)
+
+    def _handle_safely(self, data: bytes):
+        """Un mensaje inválido no detiene la suscripción; se vacía el L1 por si era una invalidación"""
+        try:
+            self.handle(data)
+        except Exception:
+            logger.exception("Mensaje de invalidación L1 inválido en %s: %r", self.channel, data)
+            self.local_cache.clear()
+
+    def handle(self, data: bytes):
+        """Aplica un mensaje del canal sobre el L1 local"""
+        self.received += 1
+        if data.startswith(KEYS_PREFIX):
+            for cache_key in data[len(KEYS_PREFIX):].split(b"\n"):
+                self.local_cache.delete(cache_key.decode())
+        elif data.startswith(PATTERN_PREFIX):
+            self.local_cache.invalidate_pattern(data[len(PATTERN_PREFIX):].decode())
+        else:
+            self.local_cache.clear()
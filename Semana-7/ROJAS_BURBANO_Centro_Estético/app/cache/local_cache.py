@@ -0,0 +1,92 @@
+# app/cache/local_cache.py
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_MISSING = object()
+
+
+class LocalLRUCache:
+    """
+    Cache L1 en memoria del proceso, delante de Redis (L2).
+    LRU acotado por número de entradas y con TTL por entrada.
+    Los valores se guardan ya deserializados: quien los lee no debe mutarlos.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()  # El backend síncrono puede usarse desde el threadpool
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.on_evict: Optional[Callable[[], None]] = None  # Hook para métricas
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        """Devuelve el valor si existe y no ha expirado (lo marca como usado recientemente)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        """Como get, pero sin contar en las estadísticas ni alterar el orden LRU"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """Guarda un valor con TTL en segundos; ttl <= 0 no cachea en L1"""
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_pattern(self, pattern: str) -> int:
+        """Elimina las claves que coinciden con un patrón glob (misma sintaxis que Redis)"""
+        with self._lock:
+            matched = [key for key in self._entries if fnmatchcase(key, pattern)]
+            for key in matched:
+                del self._entries[key]
+        return len(matched)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas de aciertos del L1"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,68 +1,83 @@
-# app/routers/centro_estetico.py
-from fastapi import APIRouter, HTTPException
-from ..cache.cache_decorators import cache_result
-from ..cache.redis_config import cache_manager
-from ..cache.metrics import CacheMetrics
-from ..services import tu_servicio_dominio
-
-# Definimos el router para el Centro Estético
-router = APIRouter(prefix="/spa", tags=["Centro Estético: Servicios y Equipos"])
-
-# Endpoint para obtener los tratamientos más frecuentes
-@router.get("/tratamientos/frecuentes")
-@cache_result(ttl_type='frequent_data', key_prefix='spa_tratamientos_frecuentes')
-async def get_tratamientos_frecuentes():
-    """
-    Obtiene los tratamientos más consultados o más populares del centro estético.
-    """
-    try:
-        # Lógica para obtener los tratamientos más populares
-        tratamientos_frecuentes = await tu_servicio_dominio.get_tratamientos_populares()
-        
-        # Registra el cache hit o miss
-        CacheMetrics.track_cache_hit("spa_tratamientos_frecuentes")  # Si la caché existe
-        return tratamientos_frecuentes
-    except Exception as e:
-        # Registra el cache miss si hay un error o no se encuentra en caché
-        CacheMetrics.track_cache_miss("spa_tratamientos_frecuentes")
-        raise HTTPException(status_code=500, detail=f"Error al obtener tratamientos frecuentes: {str(e)}")
-
-# Endpoint para obtener la configuración del centro estético
-@router.get("/configuracion")
-@cache_result(ttl_type='stable_data', key_prefix='spa_config')
-async def get_configuracion_dominio():
-    """
-    Obtiene la configuración específica del centro estético (horarios, precios, etc.).
-    Datos que cambian raramente.
-    """
-    try:
-        # Lógica para obtener la configuración del centro estético
-        configuracion = await tu_servicio_dominio.get_configuracion_estetica()
-        
-        # Registra el cache hit o miss
-        CacheMetrics.track_cache_hit("spa_config")  # Si la caché existe
-        return configuracion
-    except Exception as e:
-        # Registra el cache miss si hay un error o no se encuentra en caché
-        CacheMetrics.track_cache_miss("spa_config")
-        raise HTTPException(status_code=500, detail=f"Error al obtener configuración: {str(e)}")
-
-# Endpoint para obtener el catálogo de tratamientos y equipos
-@router.get("/catalogo")
-@cache_result(ttl_type='reference_data', key_prefix='spa_catalogo_tratamientos')
-async def get_catalogo_tratamientos():
+# app/cache/metrics.py
+from prometheus_client import Counter, Histogram, REGISTRY, CollectorRegistry
+
+
+def key_prefix_label(key: str) -> str:
+    """Etiqueta de prefijo: primer segmento de la clave (p. ej. 'spa_config' en 'spa_config:get:ab12')"""
+    return key.split(":", 1)[0]
+
+
+class CacheMetrics:
     """
-    Obtiene el catálogo de tratamientos y equipos utilizados en el centro estético.
-    Ejemplo: Tipos de tratamientos faciales, productos cosméticos, equipos de estética, etc.
+    Métricas Prometheus del cache, registradas desde la propia capa de cache
+    (DomainCacheConfig / AsyncDomainCacheConfig) para que reflejen aciertos reales.
+    Hits/misses/errores se etiquetan por ttl_type y prefijo; latencias y tamaños
+    solo por operación y ttl_type para acotar la cardinalidad de los histogramas.
     """
-    try:
-        # Lógica para obtener el catálogo de tratamientos y equipos
-        catalogo_tratamientos = await tu_servicio_dominio.get_catalogo_tratamientos_y_equipos()
-        
-        # Registra el cache hit o miss
-        CacheMetrics.track_cache_hit("spa_catalogo_tratamientos")  # Si la caché existe
-        return catalogo_tratamientos
-    except Exception as e:
-        # Registra el cache miss si hay un error o no se encuentra en caché
-        CacheMetrics.track_cache_miss("spa_catalogo_tratamientos")
-        raise HTTPException(status_code=500, detail=f"Error al obtener catálogo de tratamientos: {str(e)}")
+
+    def __init__(self, domain: str, registry: CollectorRegistry = REGISTRY):
+        self.domain = domain
+
+        self.hits = Counter(
+            f'{domain}_cache_hits_total',
+            'Aciertos de cache por capa (l1 proceso / l2 Redis)',
+            ['layer', 'ttl_type', 'prefix'],
+            registry=registry
+        )
+
+        self.misses = Counter(
+            f'{domain}_cache_misses_total',
+            'Fallos de cache (no encontrado en L1 ni en Redis)',
+            ['ttl_type', 'prefix'],
+            registry=registry
+        )
+
+        self.operation_duration = Histogram(
+            f'{domain}_cache_operation_duration_seconds',
+            'Latencia de operaciones de cache',
+            ['operation', 'ttl_type'],
+            buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25],
+            registry=registry
+        )
+
+        self.payload_bytes = Histogram(
+            f'{domain}_cache_payload_bytes',
+            'Tamaño de los valores leídos/escritos en Redis',
+            ['operation', 'ttl_type'],
+            buckets=[128, 512, 1024, 4096, 16384, 65536, 262144, 1048576],
+            registry=registry
+        )
+
+        self.evictions = Counter(
+            f'{domain}_cache_evictions_total',
+            'Entradas expulsadas del cache por límite de tamaño',
+            ['layer'],
+            registry=registry
+        )
+
+        self.errors = Counter(
+            f'{domain}_cache_errors_total',
+            'Errores de operaciones de cache (timeouts, conexión, serialización)',
+            ['operation', 'ttl_type', 'prefix'],
+            registry=registry
+        )
+
+    def track_cache_hit(self, key: str, ttl_type: str = None, layer: str = "l2"):
+        self.hits.labels(layer=layer, ttl_type=ttl_type or "unknown", prefix=key_prefix_label(key)).inc()
+
+    def track_cache_miss(self, key: str, ttl_type: str = None):
+        self.misses.labels(ttl_type=ttl_type or "unknown", prefix=key_prefix_label(key)).inc()
+
+    def observe_operation(self, operation: str, ttl_type: str, duration: float):
+        self.operation_duration.labels(operation=operation, ttl_type=ttl_type or "unknown").observe(duration)
+
+    def observe_payload(self, operation: str, ttl_type: str, size: int):
+        self.payload_bytes.labels(operation=operation, ttl_type=ttl_type or "unknown").observe(size)
+
+    def track_eviction(self, layer: str = "l1"):
+        self.evictions.labels(layer=layer).inc()
+
+    def track_error(self, operation: str, key: str = "", ttl_type: str = None):
+        self.errors.labels(
+            operation=operation, ttl_type=ttl_type or "unknown", prefix=key_prefix_label(key) if key else "none"
+        ).inc()
@@ -1,18 +1,67 @@
 # app/cache/redis_config.py
 import redis
-import json
+import redis.asyncio as aioredis
+import asyncio
 import os
-from typing import Optional, Any
+import time
+import weakref
+from typing import Optional, Any, Callable, Dict, Iterable, List, Tuple
+from .local_cache import LocalLRUCache, _MISSING
+from .l1_invalidation import L1InvalidationListener, keys_message, pattern_message
+from .serializers import CacheCodec, default_codec
+from .metrics import CacheMetrics
 
-class DomainCacheConfig:
-    def __init__(self, domain_prefix: str = "spa_"):  # Valor por defecto
+# Marcador guardado en Redis para búsquedas sin resultado (negative caching).
+# No colisiona con la cabecera del codec (b"\x00C") ni con JSON sin cabecera.
+NEGATIVE_MARKER = b"\x00N"
+
+
+class _NotFound:
+    """Valor devuelto por el cache cuando hay una entrada negativa (se sabe que no existe)"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "NOT_FOUND"
+
+
+NOT_FOUND = _NotFound()
+
+# Callbacks avisados en cada invalidación local (p. ej. el single-flight de cache_result),
+# con las claves Redis invalidadas o un patrón glob (None: todo el dominio)
+_invalidation_callbacks: List[Callable[[Optional[List[str]], Optional[str]], None]] = []
+
+
+def on_invalidate(callback: Callable[[Optional[List[str]], Optional[str]], None]):
+    """Registra un callback(claves, patrón) que se ejecuta al invalidar por tag o por patrón"""
+    _invalidation_callbacks.append(callback)
+
+
+def _redis_pool_settings() -> dict:
+    """Parámetros comunes del pool de conexiones (configurables por entorno)"""
+    # Los valores se guardan como bytes (cabecera de codec + payload, quizá comprimido)
+    return {
+        'host': os.getenv('REDIS_HOST', 'localhost'),
+        'port': int(os.getenv('REDIS_PORT', 6379)),
+        'db': 0,
+        'decode_responses': False,
+        'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 20)),
+        'timeout': float(os.getenv('REDIS_POOL_TIMEOUT', 2.0)),          # Espera máxima por una conexión libre
+        'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.5)),
+        'socket_connect_timeout': float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.5)),
+    }
+
+
+class BaseDomainCache:
+    """Lógica común (claves, TTLs y cache L1) compartida por los backends síncrono y asíncrono"""
+
+    def __init__(self, domain_prefix: str = "spa_", local_cache: LocalLRUCache = None,
+                 codec: CacheCodec = None):
         self.domain_prefix = domain_prefix  # Tu prefijo específico (spa_, edu_, etc.)
-        self.redis_client = redis.Redis(
-            host=os.getenv('REDIS_HOST', 'localhost'),
-            port=int(os.getenv('REDIS_PORT', 6379)),
-            db=0,
-            decode_responses=True
-        )
+        # Serialización intercambiable (json/orjson/msgpack) con compresión por umbral
+        self.codec = codec or default_codec()
 
         # TTLs específicos por tipo de dato de tu dominio (en segundos)
         self.cache_ttl = {
@@ -22,48 +71,659 @@ class DomainCacheConfig:
             'temp_data': 60           # 1 minuto
         }
 
+        # Stale-while-revalidate: tras el TTL anterior (soft) el valor se sigue
+        # sirviendo como "stale" durante esta ventana extra mientras se refresca
+        # en segundo plano. En Redis la clave vive cache_ttl + stale_ttl (hard).
+        self.stale_ttl = {
+            'frequent_data': 60,      # 1 minuto
+            'stable_data': 600,       # 10 minutos
+            'reference_data': 3600,   # 1 hora
+            'temp_data': 0            # Sin ventana stale
+        }
+
+        # Cache L1 en proceso delante de Redis (L2). Las invalidaciones llegan a los
+        # demás workers por pub/sub (L1InvalidationListener); el TTL solo acota cuánto
+        # tiempo otro worker puede servir un valor invalidado si se pierde un mensaje.
+        self.local_cache = local_cache if local_cache is not None else LocalLRUCache(
+            max_entries=int(os.getenv('CACHE_L1_MAX_ENTRIES', 1024))
+        )
+        self.l1_ttl = {
+            'frequent_data': 30,      # 30 segundos
+            'stable_data': 300,       # 5 minutos
+            'reference_data': 600,    # 10 minutos
+            'temp_data': 0            # No se guarda en L1
+        }
+        self.l1_default_ttl = 30      # Lecturas sin ttl_type conocido
+
+        # TTL de las entradas negativas (búsquedas sin resultado): corto y sin ventana stale
+        self.negative_ttl = int(os.getenv('CACHE_NEGATIVE_TTL', 30))
+
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.metrics: Optional[CacheMetrics] = None  # Se activa con instrument()
+
+        # Tags asignados automáticamente según el contenido de la clave
+        # (sustituyen a los patrones comodín que usaba DomainCacheInvalidation)
+        self.auto_tags = {
+            'config': ('config',),
+            'catalog': ('catalog',),
+            'frequent_queries': ('frequent_queries', 'frecuentes'),
+        }
+        # Los sets de tags viven al menos tanto como la entrada más duradera
+        self.tag_ttl = max(self._hard_ttl(ttl_type) for ttl_type in self.cache_ttl)
+        self.scan_batch_size = 500  # Claves por página de SCAN / por UNLINK
+        # Canal pub/sub por el que se avisa a los demás workers qué descartar de su L1
+        self.invalidation_channel = self.get_cache_key("l1", "invalidate")
+
     def get_cache_key(self, category: str, identifier: str) -> str:
         """Genera claves de cache específicas para tu dominio"""
         return f"{self.domain_prefix}:{category}:{identifier}"
 
-    def set_cache(self, key: str, value: Any, ttl_type: str = 'frequent_data') -> bool:
-        """Almacena datos en cache con TTL específico"""
-        try:
+    @staticmethod
+    def entity_tag(entity_type: str, entity_id: Any) -> str:
+        """Tag que agrupa las entradas derivadas de una entidad concreta"""
+        return f"entity:{entity_type}:{entity_id}"
+
+    def get_tag_key(self, tag: str) -> str:
+        return self.get_cache_key("tag", tag)
+
+    def _tag_keys_for(self, key: str, tags: Iterable[str] = None) -> List[str]:
+        """Sets de Redis donde se registra la clave: tags explícitos + automáticos"""
+        all_tags = set(tags or ())
+        for tag, markers in self.auto_tags.items():
+            if any(marker in key for marker in markers):
+                all_tags.add(tag)
+        return [self.get_tag_key(tag) for tag in sorted(all_tags)]
+
+    def _chunks(self, keys: List[str]) -> Iterable[List[str]]:
+        for start in range(0, len(keys), self.scan_batch_size):
+            yield keys[start:start + self.scan_batch_size]
+
+    def _hard_ttl(self, ttl_type: str) -> int:
+        """TTL real en Redis: frescura (soft) + ventana stale"""
+        return self.cache_ttl.get(ttl_type, 300) + self.stale_ttl.get(ttl_type, 0)
+
+    def _fresh_seconds(self, ttl_type: str, pttl_ms: int) -> float:
+        """Segundos de frescura que le quedan a una clave según su PTTL (<= 0 significa stale)"""
+        if pttl_ms is None or pttl_ms < 0:
+            return float('inf')  # Clave sin expiración
+        return pttl_ms / 1000 - self.stale_ttl.get(ttl_type, 0)
+
+    def _soft_expired(self, value: Any, ttl_type: str, pttl_ms: int) -> bool:
+        """True si la entrada ya está en su ventana stale (solo get_cache_with_state la sirve)"""
+        return value is not NOT_FOUND and self._fresh_seconds(ttl_type, pttl_ms) <= 0
+
+    def _l1_ttl_for(self, ttl_type: Optional[str]) -> float:
+        """TTL en L1: nunca mayor que el TTL de Redis para ese tipo de dato"""
+        if ttl_type is None:
+            return self.l1_default_ttl
+        return min(self.l1_ttl.get(ttl_type, self.l1_default_ttl), self.cache_ttl.get(ttl_type, 300))
+
+    def _local_ttl(self, value: Any, ttl_type: Optional[str], pttl_ms: int = None) -> float:
+        """
+        TTL en L1 para un valor leído: las entradas negativas nunca duran más que negative_ttl
+        y las demás no pasan de la frescura que les queda en Redis
+        """
+        if value is NOT_FOUND:
+            return min(self._l1_ttl_for(ttl_type), self.negative_ttl)
+        if pttl_ms is None:
+            return self._l1_ttl_for(ttl_type)
+        return min(self._l1_ttl_for(ttl_type), self._fresh_seconds(ttl_type, pttl_ms))
+
+    def _decode(self, raw: bytes) -> Any:
+        return NOT_FOUND if raw == NEGATIVE_MARKER else self.codec.decode(raw)
+
+    def instrument(self, metrics: CacheMetrics):
+        """Conecta las métricas Prometheus (hits, misses, latencias, tamaños, evictions, errores)"""
+        self.metrics = metrics
+        self.local_cache.on_evict = lambda: metrics.track_eviction("l1")
+
+    def _record_hit(self, key: str, ttl_type: Optional[str], layer: str, raw: bytes = None):
+        if layer == "l2":
+            self.l2_hits += 1
+        if self.metrics:
+            self.metrics.track_cache_hit(key, ttl_type, layer)
+            if raw is not None:
+                self.metrics.observe_payload("get", ttl_type, len(raw))
+
+    def _record_miss(self, key: str, ttl_type: Optional[str]):
+        self.l2_misses += 1
+        if self.metrics:
+            self.metrics.track_cache_miss(key, ttl_type)
+
+    def _record_op(self, operation: str, ttl_type: Optional[str], started: float):
+        if self.metrics:
+            self.metrics.observe_operation(operation, ttl_type, time.perf_counter() - started)
+
+    def _record_error(self, operation: str, key: str = "", ttl_type: Optional[str] = None):
+        if self.metrics:
+            self.metrics.track_error(operation, key, ttl_type)
+
+    def peek_local(self, key: str) -> Optional[Any]:
+        """Valor vigente en L1 (sin ir a Redis), o None"""
+        return self.local_cache.peek(self.get_cache_key("data", key))
+
+    def _invalidate_local(self, pattern: str = None) -> bytes:
+        """Descarta del L1 las entradas que coinciden con el patrón (o todas); devuelve el aviso para otros workers"""
+        cache_pattern = self.get_cache_key("data", pattern) if pattern else None
+        if cache_pattern:
+            self.local_cache.invalidate_pattern(cache_pattern)
+        else:
+            self.local_cache.clear()
+        self._notify_invalidated(None, cache_pattern)
+        return pattern_message(cache_pattern)
+
+    def _invalidate_local_keys(self, members: List[bytes]):
+        cache_keys = [cache_key.decode() for cache_key in members]
+        for cache_key in cache_keys:
+            self.local_cache.delete(cache_key)
+        self._notify_invalidated(cache_keys, None)
+
+    @staticmethod
+    def _notify_invalidated(cache_keys: Optional[List[str]], cache_pattern: Optional[str]):
+        for callback in _invalidation_callbacks:
+            try:
+                callback(cache_keys, cache_pattern)
+            except Exception as e:
+                print(f"Error en callback de invalidación: {e!r}")
+
+    def _queue_set(self, pipe, key: str, value: Any, ttl_type: str, tags: Iterable[str] = None) -> str:
+        """Encola en el pipeline el SET con TTL y el registro en tags; devuelve la clave Redis"""
+        cache_key = self.get_cache_key("data", key)
+        serialized_value = self.codec.encode(value)
+        if self.metrics:
+            self.metrics.observe_payload("set", ttl_type, len(serialized_value))
+        pipe.set(cache_key, serialized_value, ex=self._hard_ttl(ttl_type))
+        self._queue_tags(pipe, key, cache_key, tags)
+        return cache_key
+
+    def _queue_not_found(self, pipe, key: str, tags: Iterable[str] = None) -> str:
+        """Encola una entrada negativa con negative_ttl; un set_cache posterior la sobrescribe"""
+        cache_key = self.get_cache_key("data", key)
+        pipe.set(cache_key, NEGATIVE_MARKER, ex=self.negative_ttl)
+        self._queue_tags(pipe, key, cache_key, tags)
+        return cache_key
+
+    def _queue_tags(self, pipe, key: str, cache_key: str, tags: Iterable[str] = None):
+        for tag_key in self._tag_keys_for(key, tags):
+            pipe.sadd(tag_key, cache_key)
+            pipe.expire(tag_key, self.tag_ttl)
+
+    def _split_local(self, keys: Iterable[str]) -> Tuple[Dict[str, Any], List[Tuple[str, str]]]:
+        """Resuelve desde L1 lo posible; devuelve (encontrados, [(clave, clave_redis) pendientes])"""
+        found: Dict[str, Any] = {}
+        pending: List[Tuple[str, str]] = []
+        for key in keys:
             cache_key = self.get_cache_key("data", key)
-            serialized_value = json.dumps(value)
-            ttl = self.cache_ttl.get(ttl_type, 300)
-            return self.redis_client.setex(cache_key, ttl, serialized_value)
+            local_value = self.local_cache.get(cache_key)
+            if local_value is _MISSING:
+                pending.append((key, cache_key))
+            else:
+                found[key] = local_value
+        return found, pending
+
+    def _local_hits(self, found: Dict[str, Any], ttl_type: Optional[str]):
+        for key in found:
+            self._record_hit(key, ttl_type, "l1")
+
+    @staticmethod
+    def _queue_get_many(pipe, pending: List[Tuple[str, str]]):
+        """MGET de las claves pendientes + su PTTL, en el mismo round trip"""
+        pipe.mget([cache_key for _, cache_key in pending])
+        for _, cache_key in pending:
+            pipe.pttl(cache_key)
+
+    def _merge_remote(self, found: Dict[str, Any], pending: List[Tuple[str, str]],
+                      results: List[Any], ttl_type: str):
+        """Decodifica la respuesta de MGET + PTTL, añade a `found` lo vigente y lo guarda en L1"""
+        raw_values, pttls = results[0], results[1:]
+        for (key, cache_key), raw, pttl_ms in zip(pending, raw_values, pttls):
+            value = self._decode(raw) if raw else None
+            if not raw or self._soft_expired(value, ttl_type, pttl_ms):
+                self._record_miss(key, ttl_type)
+                continue
+            self._record_hit(key, ttl_type, "l2", raw)
+            found[key] = value
+            self.local_cache.set(cache_key, value, self._local_ttl(value, ttl_type, pttl_ms))
+
+    def _read_remote(self, key: str, cache_key: str, raw: Optional[bytes], pttl_ms: int,
+                     ttl_type: str) -> Optional[Any]:
+        """Valor vigente leído de Redis (GET + PTTL), o None si no existe o ya es stale"""
+        value = self._decode(raw) if raw else None
+        if not raw or self._soft_expired(value, ttl_type, pttl_ms):
+            self._record_miss(key, ttl_type)
+            return None
+        self._record_hit(key, ttl_type, "l2", raw)
+        self.local_cache.set(cache_key, value, self._local_ttl(value, ttl_type, pttl_ms))
+        return value
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Ratios de acierto separados para L1 (proceso) y L2 (Redis)"""
+        l2_lookups = self.l2_hits + self.l2_misses
+        return {
+            "l1": self.local_cache.get_stats(),
+            "l2": {
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "hit_ratio": round(self.l2_hits / l2_lookups, 4) if l2_lookups else 0.0,
+            },
+        }
+
+
+class DomainCacheConfig(BaseDomainCache):
+    def __init__(self, domain_prefix: str = "spa_", local_cache: LocalLRUCache = None,
+                 codec: CacheCodec = None):  # Valor por defecto
+        super().__init__(domain_prefix, local_cache, codec)
+        # Pool acotado: si se agotan las conexiones se espera `timeout` en lugar de abrir más
+        self.redis_client = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool(**_redis_pool_settings())
+        )
+
+    def set_cache(self, key: str, value: Any, ttl_type: str = 'frequent_data',
+                  tags: Iterable[str] = None) -> bool:
+        """Almacena datos en cache con TTL específico y registra la clave en sus tags"""
+        started = time.perf_counter()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_key = self._queue_set(pipe, key, value, ttl_type, tags)
+            stored = pipe.execute()[0]
+            self.local_cache.set(cache_key, value, self._l1_ttl_for(ttl_type))
+            return stored
         except Exception as e:
+            self._record_error("set", key, ttl_type)
             print(f"Error setting cache: {e}")
             return False
+        finally:
+            self._record_op("set", ttl_type, started)
 
-    def get_cache(self, key: str) -> Optional[Any]:
-        """Recupera datos del cache"""
+    def set_not_found(self, key: str, tags: Iterable[str] = None) -> bool:
+        """
+        Cachea que `key` no tiene resultado (negative caching) durante negative_ttl.
+        Las lecturas devuelven NOT_FOUND; se descarta al escribir la clave o invalidar sus tags.
+        """
         try:
-            cache_key = self.get_cache_key("data", key)
-            cached_value = self.redis_client.get(cache_key)
-            if cached_value:
-                return json.loads(cached_value)
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_key = self._queue_not_found(pipe, key, tags)
+            stored = pipe.execute()[0]
+            self.local_cache.set(cache_key, NOT_FOUND, self._local_ttl(NOT_FOUND, None))
+            return stored
+        except Exception as e:
+            self._record_error("set_not_found", key)
+            print(f"Error setting cache: {e}")
+            return False
+
+    def set_many(self, items: Dict[str, Any], ttl_type: str = 'frequent_data',
+                 tags: Iterable[str] = None) -> bool:
+        """Almacena varias entradas en un solo round trip (pipeline)"""
+        if not items:
+            return True
+        started = time.perf_counter()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_keys = {key: self._queue_set(pipe, key, value, ttl_type, tags) for key, value in items.items()}
+            pipe.execute()
+            l1_ttl = self._l1_ttl_for(ttl_type)
+            for key, cache_key in cache_keys.items():
+                self.local_cache.set(cache_key, items[key], l1_ttl)
+            return True
+        except Exception as e:
+            self._record_error("set_many", ttl_type=ttl_type)
+            print(f"Error setting cache: {e}")
+            return False
+        finally:
+            self._record_op("set_many", ttl_type, started)
+
+    def get_many(self, keys: Iterable[str], ttl_type: str = 'frequent_data') -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Recupera varias entradas con un solo MGET (lo que no esté ya en L1).
+        Devuelve (encontrados, claves_faltantes) para rellenar los huecos en bloque.
+        Las entradas negativas aparecen en encontrados con valor NOT_FOUND; las que pasaron
+        el TTL soft de `ttl_type` (el usado al escribirlas) cuentan como faltantes.
+        """
+        started = time.perf_counter()
+        keys = list(keys)
+        found, pending = self._split_local(keys)
+        self._local_hits(found, ttl_type)
+        if pending:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                self._queue_get_many(pipe, pending)
+                self._merge_remote(found, pending, pipe.execute(), ttl_type)
+            except Exception as e:
+                self._record_error("get_many", ttl_type=ttl_type)
+                print(f"Error getting cache: {e}")
+        self._record_op("get_many", ttl_type, started)
+        return found, [key for key in keys if key not in found]
+
+    def get_cache(self, key: str, ttl_type: str = 'frequent_data') -> Optional[Any]:
+        """
+        Recupera datos del cache (primero L1 en proceso, luego Redis); NOT_FOUND si es una entrada negativa.
+        Pasado el TTL soft de `ttl_type` (el usado al escribir) es un miss: el valor stale solo
+        lo devuelve get_cache_with_state.
+        """
+        started = time.perf_counter()
+        cache_key = self.get_cache_key("data", key)
+        local_value = self.local_cache.get(cache_key)
+        if local_value is not _MISSING:
+            self._record_hit(key, ttl_type, "l1")
+            self._record_op("get", ttl_type, started)
+            return local_value
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(cache_key)
+            pipe.pttl(cache_key)
+            return self._read_remote(key, cache_key, *pipe.execute(), ttl_type)
+        except Exception as e:
+            self._record_error("get", key, ttl_type)
+            print(f"Error getting cache: {e}")
             return None
+        finally:
+            self._record_op("get", ttl_type, started)
+
+    def get_cache_with_state(self, key: str, ttl_type: str = 'frequent_data') -> Tuple[Optional[Any], bool]:
+        """Recupera datos del cache indicando si ya pasaron su TTL soft: (valor, es_stale)"""
+        started = time.perf_counter()
+        cache_key = self.get_cache_key("data", key)
+        local_value = self.local_cache.get(cache_key)
+        if local_value is not _MISSING:
+            self._record_hit(key, ttl_type, "l1")
+            self._record_op("get", ttl_type, started)
+            return local_value, False  # El L1 nunca guarda más allá del TTL soft
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(cache_key)
+            pipe.pttl(cache_key)
+            cached_value, pttl_ms = pipe.execute()
+            if not cached_value:
+                self._record_miss(key, ttl_type)
+                return None, False
+            self._record_hit(key, ttl_type, "l2", cached_value)
+            value = self._decode(cached_value)
+            if value is NOT_FOUND:
+                self.local_cache.set(cache_key, value, self._local_ttl(value, ttl_type))
+                return value, False  # Las entradas negativas no tienen ventana stale
+            fresh_seconds = self._fresh_seconds(ttl_type, pttl_ms)
+            if fresh_seconds <= 0:
+                return value, True
+            self.local_cache.set(cache_key, value, min(self._l1_ttl_for(ttl_type), fresh_seconds))
+            return value, False
         except Exception as e:
+            self._record_error("get", key, ttl_type)
             print(f"Error getting cache: {e}")
+            return None, False
+        finally:
+            self._record_op("get", ttl_type, started)
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Invalida exactamente las claves registradas en un tag (coste proporcional a sus miembros)"""
+        try:
+            tag_key = self.get_tag_key(tag)
+            # Leer y borrar el set en la misma transacción: las claves añadidas
+            # después van a un set nuevo y no se pierden
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.smembers(tag_key)
+            pipe.unlink(tag_key)
+            members = list(pipe.execute()[0])
+            self._invalidate_local_keys(members)
+            for chunk in self._chunks(members):
+                self.redis_client.unlink(*chunk)
+                self.redis_client.publish(self.invalidation_channel, keys_message(chunk))
+            return len(members)
+        except Exception as e:
+            self._record_error("invalidate_tag")
+            print(f"Error invalidating tag: {e}")
+            return 0
+
+    def invalidate_cache(self, pattern: str = None) -> int:
+        """Invalida cache específico o por patrón (SCAN incremental, no bloquea Redis)"""
+        notice = self._invalidate_local(pattern)
+        try:
+            # Sin patrón invalida todo el cache de tu dominio
+            cache_pattern = self.get_cache_key("data", pattern) if pattern else f"{self.domain_prefix}:*"
+            deleted = 0
+            batch = []
+            for key in self.redis_client.scan_iter(match=cache_pattern, count=self.scan_batch_size):
+                batch.append(key)
+                if len(batch) >= self.scan_batch_size:
+                    deleted += self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.unlink(*batch)
+            # Se avisa después de borrar: otro worker no puede volver a leer el valor viejo
+            self.redis_client.publish(self.invalidation_channel, notice)
+            return deleted
+        except Exception as e:
+            self._record_error("invalidate")
+            print(f"Error invalidating cache: {e}")
+            return 0
+
+
+class AsyncDomainCacheConfig(BaseDomainCache):
+    """
+    Backend asyncio para los endpoints `async def`: misma API que DomainCacheConfig
+    (get/set/invalidate) pero sin bloquear el event loop.
+    Cada operación tiene un timeout propio; si Redis tarda, se trata como fallo de cache.
+    """
+
+    def __init__(self, domain_prefix: str = "spa_", call_timeout: float = None,
+                 local_cache: LocalLRUCache = None, codec: CacheCodec = None):
+        super().__init__(domain_prefix, local_cache, codec)
+        self.call_timeout = call_timeout or float(os.getenv('REDIS_CALL_TIMEOUT', 0.25))
+        # Un cliente (con su pool) por event loop: las conexiones de redis.asyncio no sirven en otro loop
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = \
+            weakref.WeakKeyDictionary()
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        """Cliente asíncrono ligado al event loop actual"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            # Los pools de loops ya cerrados no se pueden cerrar con await: se sueltan para que
+            # el GC libere sus conexiones en lugar de acumular uno por cada loop nuevo
+            for closed_loop in [other for other in self._clients if other.is_closed()]:
+                del self._clients[closed_loop]
+            client = self._clients[loop] = aioredis.Redis(
+                connection_pool=aioredis.BlockingConnectionPool(**_redis_pool_settings())
+            )
+        return client
+
+    async def _call(self, awaitable):
+        """Ejecuta un comando de Redis respetando el timeout por llamada"""
+        return await asyncio.wait_for(awaitable, timeout=self.call_timeout)
+
+    async def set_cache(self, key: str, value: Any, ttl_type: str = 'frequent_data',
+                        tags: Iterable[str] = None) -> bool:
+        """Almacena datos en cache con TTL específico y registra la clave en sus tags"""
+        started = time.perf_counter()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_key = self._queue_set(pipe, key, value, ttl_type, tags)
+            stored = bool((await self._call(pipe.execute()))[0])
+            self.local_cache.set(cache_key, value, self._l1_ttl_for(ttl_type))
+            return stored
+        except Exception as e:
+            self._record_error("set", key, ttl_type)
+            print(f"Error setting cache: {e!r}")
+            return False
+        finally:
+            self._record_op("set", ttl_type, started)
+
+    async def set_not_found(self, key: str, tags: Iterable[str] = None) -> bool:
+        """
+        Cachea que `key` no tiene resultado (negative caching) durante negative_ttl.
+        Las lecturas devuelven NOT_FOUND; se descarta al escribir la clave o invalidar sus tags.
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_key = self._queue_not_found(pipe, key, tags)
+            stored = bool((await self._call(pipe.execute()))[0])
+            self.local_cache.set(cache_key, NOT_FOUND, self._local_ttl(NOT_FOUND, None))
+            return stored
+        except Exception as e:
+            self._record_error("set_not_found", key)
+            print(f"Error setting cache: {e!r}")
+            return False
+
+    async def set_many(self, items: Dict[str, Any], ttl_type: str = 'frequent_data',
+                       tags: Iterable[str] = None) -> bool:
+        """Almacena varias entradas en un solo round trip (pipeline)"""
+        if not items:
+            return True
+        started = time.perf_counter()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            cache_keys = {key: self._queue_set(pipe, key, value, ttl_type, tags) for key, value in items.items()}
+            await self._call(pipe.execute())
+            l1_ttl = self._l1_ttl_for(ttl_type)
+            for key, cache_key in cache_keys.items():
+                self.local_cache.set(cache_key, items[key], l1_ttl)
+            return True
+        except Exception as e:
+            self._record_error("set_many", ttl_type=ttl_type)
+            print(f"Error setting cache: {e!r}")
+            return False
+        finally:
+            self._record_op("set_many", ttl_type, started)
+
+    async def get_many(self, keys: Iterable[str], ttl_type: str = 'frequent_data') -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Recupera varias entradas con un solo MGET (lo que no esté ya en L1).
+        Devuelve (encontrados, claves_faltantes) para rellenar los huecos en bloque.
+        Las entradas negativas aparecen en encontrados con valor NOT_FOUND; las que pasaron
+        el TTL soft de `ttl_type` (el usado al escribirlas) cuentan como faltantes.
+        """
+        started = time.perf_counter()
+        keys = list(keys)
+        found, pending = self._split_local(keys)
+        self._local_hits(found, ttl_type)
+        if pending:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                self._queue_get_many(pipe, pending)
+                self._merge_remote(found, pending, await self._call(pipe.execute()), ttl_type)
+            except Exception as e:
+                self._record_error("get_many", ttl_type=ttl_type)
+                print(f"Error getting cache: {e!r}")
+        self._record_op("get_many", ttl_type, started)
+        return found, [key for key in keys if key not in found]
+
+    async def get_cache(self, key: str, ttl_type: str = 'frequent_data') -> Optional[Any]:
+        """
+        Recupera datos del cache (primero L1 en proceso, luego Redis); NOT_FOUND si es una entrada negativa.
+        Pasado el TTL soft de `ttl_type` (el usado al escribir) es un miss: el valor stale solo
+        lo devuelve get_cache_with_state.
+        """
+        started = time.perf_counter()
+        cache_key = self.get_cache_key("data", key)
+        local_value = self.local_cache.get(cache_key)
+        if local_value is not _MISSING:
+            self._record_hit(key, ttl_type, "l1")
+            self._record_op("get", ttl_type, started)
+            return local_value
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(cache_key)
+            pipe.pttl(cache_key)
+            return self._read_remote(key, cache_key, *(await self._call(pipe.execute())), ttl_type)
+        except Exception as e:
+            self._record_error("get", key, ttl_type)
+            print(f"Error getting cache: {e!r}")
             return None
+        finally:
+            self._record_op("get", ttl_type, started)
+
+    async def get_cache_with_state(self, key: str, ttl_type: str = 'frequent_data') -> Tuple[Optional[Any], bool]:
+        """Recupera datos del cache indicando si ya pasaron su TTL soft: (valor, es_stale)"""
+        started = time.perf_counter()
+        cache_key = self.get_cache_key("data", key)
+        local_value = self.local_cache.get(cache_key)
+        if local_value is not _MISSING:
+            self._record_hit(key, ttl_type, "l1")
+            self._record_op("get", ttl_type, started)
+            return local_value, False  # El L1 nunca guarda más allá del TTL soft
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(cache_key)
+            pipe.pttl(cache_key)
+            cached_value, pttl_ms = await self._call(pipe.execute())
+            if not cached_value:
+                self._record_miss(key, ttl_type)
+                return None, False
+            self._record_hit(key, ttl_type, "l2", cached_value)
+            value = self._decode(cached_value)
+            if value is NOT_FOUND:
+                self.local_cache.set(cache_key, value, self._local_ttl(value, ttl_type))
+                return value, False  # Las entradas negativas no tienen ventana stale
+            fresh_seconds = self._fresh_seconds(ttl_type, pttl_ms)
+            if fresh_seconds <= 0:
+                return value, True
+            self.local_cache.set(cache_key, value, min(self._l1_ttl_for(ttl_type), fresh_seconds))
+            return value, False
+        except Exception as e:
+            self._record_error("get", key, ttl_type)
+            print(f"Error getting cache: {e!r}")
+            return None, False
+        finally:
+            self._record_op("get", ttl_type, started)
+
+    async def invalidate_tag(self, tag: str) -> int:
+        """Invalida exactamente las claves registradas en un tag (coste proporcional a sus miembros)"""
+        try:
+            tag_key = self.get_tag_key(tag)
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.smembers(tag_key)
+            pipe.unlink(tag_key)
+            members = list((await self._call(pipe.execute()))[0])
+            self._invalidate_local_keys(members)
+            for chunk in self._chunks(members):
+                await self._call(self.redis_client.unlink(*chunk))
+                await self._call(self.redis_client.publish(self.invalidation_channel, keys_message(chunk)))
+            return len(members)
+        except Exception as e:
+            self._record_error("invalidate_tag")
+            print(f"Error invalidating tag: {e!r}")
+            return 0
 
-    def invalidate_cache(self, pattern: str = None):
-        """Invalida cache específico o por patrón"""
+    async def invalidate_cache(self, pattern: str = None) -> int:
+        """Invalida cache específico o por patrón (SCAN incremental, no bloquea Redis)"""
+        notice = self._invalidate_local(pattern)
         try:
-            if pattern:
-                cache_pattern = self.get_cache_key("data", pattern)
-                keys = self.redis_client.keys(cache_pattern)
+            cache_pattern = self.get_cache_key("data", pattern) if pattern else f"{self.domain_prefix}:*"
+            deleted = 0
+            cursor = 0
+            while True:
+                # Cada página de SCAN es una llamada corta con su propio timeout
+                cursor, keys = await self._call(
+                    self.redis_client.scan(cursor=cursor, match=cache_pattern, count=self.scan_batch_size)
+                )
                 if keys:
-                    self.redis_client.delete(*keys)
-            else:
-                # Invalida todo el cache de tu dominio
-                domain_keys = self.redis_client.keys(f"{self.domain_prefix}:*")
-                if domain_keys:
-                    self.redis_client.delete(*domain_keys)
+                    deleted += await self._call(self.redis_client.unlink(*keys))
+                if cursor == 0:
+                    await self._call(self.redis_client.publish(self.invalidation_channel, notice))
+                    return deleted
         except Exception as e:
-            print(f"Error invalidating cache: {e}")
+            self._record_error("invalidate")
+            print(f"Error invalidating cache: {e!r}")
+            return 0
+
+    async def close(self):
+        """Libera el pool de conexiones del loop actual (apagado de la aplicación)"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+# Cache L1 compartido: una invalidación en cualquiera de los dos backends lo limpia
+local_cache = LocalLRUCache(max_entries=int(os.getenv('CACHE_L1_MAX_ENTRIES', 1024)))
 
 # Instancia global de cache_manager
-cache_manager = DomainCacheConfig(domain_prefix="spa_")
+cache_manager = DomainCacheConfig(domain_prefix="spa_", local_cache=local_cache)
+
+# Instancia global para endpoints asíncronos (comparte prefijo, TTLs y L1)
+async_cache_manager = AsyncDomainCacheConfig(domain_prefix="spa_", local_cache=local_cache)
+
+# Suscripción a las invalidaciones de otros workers (se arranca en el startup de la app)
+l1_invalidation_listener = L1InvalidationListener(
+    cache_manager.redis_client, local_cache, cache_manager.invalidation_channel
+)
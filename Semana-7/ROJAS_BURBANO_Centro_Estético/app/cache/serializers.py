@@ -0,0 +1,177 @@
+# app/cache/serializers.py
+import json
+import logging
+import os
+import zlib
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # Dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # Dependencia opcional
+    lz4_frame = None
+
+logger = logging.getLogger("cache")
+
+
+# Cabecera de los valores guardados: MAGIC + id de codec + id de compresión.
+# El JSON de texto plano (formato anterior) nunca empieza por un byte nulo,
+# así que las entradas antiguas se siguen leyendo sin cabecera.
+HEADER_MAGIC = b"\x00C"
+HEADER_SIZE = len(HEADER_MAGIC) + 2
+
+
+def _to_primitive(value: Any) -> Any:
+    """Convierte tipos que los codecs no soportan (datetime, Pydantic, Decimal, sets)"""
+    if hasattr(value, "model_dump"):  # Modelos Pydantic v2
+        return value.model_dump(mode="json")
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable en cache: {type(value).__name__}")
+
+
+class CacheSerializer(ABC):
+    """Interfaz de serialización para los valores del cache"""
+    codec_id: int = 0
+    name: str = ""
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        ...
+
+
+class JsonSerializer(CacheSerializer):
+    codec_id = 1
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, default=_to_primitive, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(CacheSerializer):
+    codec_id = 2
+    name = "orjson"
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value, default=_to_primitive, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackSerializer(CacheSerializer):
+    codec_id = 3
+    name = "msgpack"
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=_to_primitive, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+SERIALIZERS: Dict[str, type] = {
+    JsonSerializer.name: JsonSerializer,
+    OrjsonSerializer.name: OrjsonSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+}
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB, "lz4": COMPRESSION_LZ4}
+
+
+def _available(name: str) -> bool:
+    return {"orjson": orjson, "msgpack": msgpack, "lz4": lz4_frame}.get(name, True) is not None
+
+
+class CacheCodec:
+    """
+    Serializa + comprime (por encima de un umbral) y antepone una cabecera con
+    el codec usado. Al leer se usa el codec de la cabecera, no el configurado:
+    cambiar de serializador no invalida las entradas ya guardadas.
+    """
+
+    def __init__(self, serializer: CacheSerializer = None, compression: str = "zlib",
+                 compression_threshold: int = 1024):
+        self.serializer = serializer or default_serializer()
+        if compression not in COMPRESSIONS:
+            logger.warning("Compresión de cache desconocida %r (opciones: %s), se guarda sin comprimir",
+                           compression, ", ".join(COMPRESSIONS))
+            compression = "none"
+        elif not _available(compression):
+            compression = "zlib"
+        self.compression = COMPRESSIONS[compression]
+        self.compression_threshold = compression_threshold
+        self._decoders: Dict[int, CacheSerializer] = {self.serializer.codec_id: self.serializer}
+
+    def _decoder(self, codec_id: int) -> CacheSerializer:
+        decoder = self._decoders.get(codec_id)
+        if decoder is None:
+            for serializer_cls in SERIALIZERS.values():
+                if serializer_cls.codec_id == codec_id:
+                    decoder = self._decoders[codec_id] = serializer_cls()
+                    break
+            else:
+                raise ValueError(f"Codec de cache desconocido: {codec_id}")
+        return decoder
+
+    def encode(self, value: Any) -> bytes:
+        payload = self.serializer.dumps(value)
+        compression = COMPRESSION_NONE
+        if self.compression != COMPRESSION_NONE and len(payload) >= self.compression_threshold:
+            compression = self.compression
+            payload = zlib.compress(payload, 1) if compression == COMPRESSION_ZLIB else lz4_frame.compress(payload)
+        return HEADER_MAGIC + bytes((self.serializer.codec_id, compression)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        if isinstance(data, str):
+            data = data.encode()
+        if not data.startswith(HEADER_MAGIC):
+            return json.loads(data)  # Entrada en el formato anterior (JSON sin cabecera)
+        codec_id, compression = data[len(HEADER_MAGIC)], data[len(HEADER_MAGIC) + 1]
+        payload = data[HEADER_SIZE:]
+        if compression == COMPRESSION_ZLIB:
+            payload = zlib.decompress(payload)
+        elif compression == COMPRESSION_LZ4:
+            payload = lz4_frame.decompress(payload)
+        return self._decoder(codec_id).loads(payload)
+
+
+def default_serializer(name: Optional[str] = None) -> CacheSerializer:
+    """Serializador configurado (CACHE_SERIALIZER); orjson si está instalado, si no json"""
+    name = name or os.getenv("CACHE_SERIALIZER") or ("orjson" if orjson is not None else "json")
+    if name not in SERIALIZERS or not _available(name):
+        name = "json"
+    return SERIALIZERS[name]()
+
+
+def default_codec() -> CacheCodec:
+    return CacheCodec(
+        compression=os.getenv("CACHE_COMPRESSION", "zlib"),
+        compression_threshold=int(os.getenv("CACHE_COMPRESSION_THRESHOLD", 1024)),
+    )
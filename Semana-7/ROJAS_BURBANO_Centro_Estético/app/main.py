@@ -1,10 +1,19 @@
 # main.py - Integración con tu API existente
 from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
-from app.monitoring.metrics import APIMetrics, monitor_performance
-from app.monitoring.profiler import APIProfiler
+from app.monitoring.metrics import APIMetrics, monitor_performance, route_template
+from app.monitoring.profiler import APIProfiler, RequestProfilerMiddleware
+from app.monitoring.system_sampler import SystemMetricsSampler
+from app.monitoring.loop_monitor import EventLoopMonitor
 from app.monitoring.alerts import AlertManager, AlertRule, email_alert
+from app.cache.redis_config import cache_manager, async_cache_manager, l1_invalidation_listener
+from app.cache.centro_estetico_strategies import DomainSpecificCaching
+from app.cache.invalidation import DomainCacheInvalidation
+from app.services.accion_log_writer import BufferedAppendWriter
+from app.middleware.centro_estetico_rate_limiter import DomainRateLimiter
 import asyncio
+import os
 import time
 
 # Configuración según tu dominio asignado
@@ -14,29 +23,49 @@ DOMAIN_CONFIG = {
     "entity": "tratamiento"
 }
 
+# Warm-up de cache en el arranque (evita el pico de misses tras un deploy o reinicio de Redis)
+CACHE_WARMUP_CONFIG = {
+    "domain": "spa_tratamientos",
+    "concurrency": int(os.getenv("CACHE_WARMUP_CONCURRENCY", 4)),
+    # Si es True, /ready responde 503 hasta que termine el warm-up
+    "hold_readiness": os.getenv("CACHE_WARMUP_HOLD_READINESS", "false").lower() == "true"
+}
+
+# Log de acciones: un único archivo abierto, escrito por lotes fuera del request
+ACCION_LOG_CONFIG = {
+    "path": "logs/spa_domain.log",
+    "flush_bytes": int(os.getenv("ACCION_LOG_FLUSH_BYTES", 64 * 1024)),
+    "flush_interval": float(os.getenv("ACCION_LOG_FLUSH_INTERVAL", 1.0)),
+    "max_bytes": int(os.getenv("ACCION_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    "rotate_interval": float(os.getenv("ACCION_LOG_ROTATE_SECONDS", 0)) or None,
+    "backup_count": int(os.getenv("ACCION_LOG_BACKUPS", 5)),
+    "queue_size": int(os.getenv("ACCION_LOG_QUEUE_SIZE", 10000))
+}
+
 app = FastAPI(title="API Centro Estético")
 
-# Endpoints mínimos para los tests de middleware
+accion_log_writer = BufferedAppendWriter(**ACCION_LOG_CONFIG)
+
+# Rate limiting por cliente y ventana, con el estado en Redis (consistente entre workers).
+# /spa/reservas cae en la categoría "booking" del dominio.
+app.add_middleware(
+    DomainRateLimiter,
+    domain_prefix=DOMAIN_CONFIG["domain"],
+    redis_client=lambda: async_cache_manager.redis_client  # Cliente asyncio del loop actual
+)
 
-# Simulación de rate limiting para test
-rate_limit_counter = 0
+# Endpoints mínimos para los tests de middleware
 
 @app.post("/spa/reservas")
 async def crear_reserva(reserva: dict):
-    global rate_limit_counter
-    rate_limit_counter += 1
-    # Simula rate limiting: responde 429 si se hacen más de 100 requests
-    if rate_limit_counter > 100:
-        return Response(status_code=status.HTTP_429_TOO_MANY_REQUESTS)
     return {"msg": "Reserva creada"}
 
 
 @app.post("/spa/accion-log")
 async def accion_log(data: dict):
-    import os
-    os.makedirs("logs", exist_ok=True)
-    with open("logs/spa_domain.log", "a") as f:
-        f.write(f"Acción: {data.get('accion')} Empleado: {data.get('empleado_id')}\n")
+    # Solo encola la línea: el flush y la rotación ocurren en el hilo del writer
+    if not accion_log_writer.write(f"Acción: {data.get('accion')} Empleado: {data.get('empleado_id')}\n"):
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     return {"msg": "Acción registrada"}
 
 @app.get("/spa/cliente-protegido")
@@ -58,9 +87,14 @@ metrics = APIMetrics(
     app_name=DOMAIN_CONFIG["app_name"],
     domain=DOMAIN_CONFIG["domain"]
 )
+cache_manager.instrument(metrics.cache_metrics)
+async_cache_manager.instrument(metrics.cache_metrics)
 
 profiler = APIProfiler(domain=DOMAIN_CONFIG["domain"])
 
+# Profiling bajo demanda de un request con cabecera X-Profile firmada (requiere PROFILER_SECRET)
+app.add_middleware(RequestProfilerMiddleware, profiler=profiler)
+
 alert_manager = AlertManager(domain=DOMAIN_CONFIG["domain"])
 
 # Configurar Prometheus
@@ -95,9 +129,10 @@ async def metrics_middleware(request: Request, call_next):
 
     duration = time.time() - start_time
 
+    # Plantilla de la ruta (el router la deja en el scope): un solo label por endpoint, sin IDs
     metrics.record_request(
         method=request.method,
-        endpoint=str(request.url.path),
+        endpoint=route_template(request.scope),
         status=response.status_code,
         duration=duration
     )
@@ -105,16 +140,55 @@ async def metrics_middleware(request: Request, call_next):
     return response
 
 
-# Tarea en background para métricas del sistema
-async def update_system_metrics():
-    while True:
-        metrics.update_system_metrics()
-        await asyncio.sleep(30)  # Cada 30 segundos
+# Métricas del proceso muestreadas en un hilo propio (SYSTEM_METRICS_INTERVAL, por defecto 15 s)
+system_sampler = SystemMetricsSampler(metrics)
+
+# Detector de bloqueos del event loop (LOOP_MONITOR_INTERVAL, LOOP_MONITOR_SLOW_SECONDS)
+loop_monitor = EventLoopMonitor(DOMAIN_CONFIG["domain"])
+
+# Warm-up de cache en background; su estado lo consulta /ready
+async def warm_up_cache():
+    try:
+        await DomainSpecificCaching.warm_up(
+            CACHE_WARMUP_CONFIG["domain"],
+            concurrency=CACHE_WARMUP_CONFIG["concurrency"]
+        )
+    except Exception as e:
+        print(f"Error en warm-up de cache: {e!r}")
+    finally:
+        app.state.cache_warm = True
 
 # Lanzar la tarea en el evento de startup de FastAPI
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(update_system_metrics())
+    accion_log_writer.start()
+    l1_invalidation_listener.start()
+    system_sampler.start(asyncio.get_running_loop())
+    loop_monitor.start()
+    # Arranca el muestreo sobre el hilo del event loop si PROFILER_MODE=sampling
+    profiler.set_mode(profiler.mode)
+    app.state.cache_warm = False
+    app.state.cache_warm_up_task = asyncio.create_task(warm_up_cache())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Cierra el pool de conexiones asíncronas a Redis
+    await async_cache_manager.close()
+    await asyncio.to_thread(l1_invalidation_listener.stop)
+    # Escribe las acciones pendientes antes de salir
+    await asyncio.to_thread(accion_log_writer.stop)
+    await asyncio.to_thread(system_sampler.stop)
+    await loop_monitor.stop()
+    await asyncio.to_thread(profiler.sampler.stop)
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: opcionalmente espera a que el cache esté precargado"""
+    cache_warm = getattr(app.state, "cache_warm", False)
+    warm_up = DomainSpecificCaching.last_warm_up.get(CACHE_WARMUP_CONFIG["domain"])
+    if CACHE_WARMUP_CONFIG["hold_readiness"] and not cache_warm:
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ready", "cache_warm": cache_warm, "warm_up": warm_up}
 
 # Endpoint para métricas personalizadas
 @app.get("/metrics-dashboard")
@@ -124,9 +198,36 @@ async def get_metrics_dashboard():
         "domain": DOMAIN_CONFIG["domain"],
         "entity": DOMAIN_CONFIG["entity"],
         "profiles": profiler.get_profile_report(),
+        "sampling_profile": profiler.get_sampling_report(),
+        "cache": {
+            "sync": cache_manager.get_cache_stats(),
+            "async": async_cache_manager.get_cache_stats(),
+            "warm_up": DomainSpecificCaching.last_warm_up
+        },
+        "event_loop_stalls": loop_monitor.recent_stalls(),
         "system_status": "healthy"
     }
 
+# Cambia el modo de profiling en caliente: {"mode": "sampling" | "cprofile" | "off", "rate_hz": 100}
+# Requiere X-Profile firmado para "POST /profiler/mode" con el mismo PROFILER_SECRET (sin secreto: deshabilitado)
+@app.post("/profiler/mode")
+async def set_profiler_mode(config: dict, request: Request):
+    if not profiler.verify_profile_token(request.headers.get("X-Profile", ""), request.method, request.url.path):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        profiler.set_mode(config.get("mode", "sampling"), rate_hz=config.get("rate_hz"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return profiler.get_sampling_report(limit=0)
+
+# Reporte de un request perfilado (ID devuelto en la cabecera X-Profile-Id)
+@app.get("/profiler/requests/{profile_id}")
+async def get_request_profile(profile_id: str):
+    report = profiler.request_profiles.get(profile_id)
+    if report is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    return report
+
 # Ejemplo de uso en endpoints existentes
 @app.post("/tratamiento/")
 @profiler.profile_function("create_tratamiento")
@@ -134,5 +235,9 @@ async def get_metrics_dashboard():
 async def create_tratamiento(tratamiento_data: dict):
     """Crear nuevo tratamiento con monitoring"""
     # Aquí iría la lógica real de creación de tratamiento
+    tratamiento_id = tratamiento_data.get("id")
+    if tratamiento_id is not None:
+        # El ID pudo consultarse antes de existir: se descarta su "no existe" cacheado
+        await DomainCacheInvalidation.on_entity_create(str(tratamiento_id), DOMAIN_CONFIG["entity"])
     metrics.record_business_event('tratamientos_creados')
-    return {"message": "Tratamiento creado exitosamente"}
\ No newline at end of file
+    return {"message": "Tratamiento creado exitosamente", "id": tratamiento_id}
\ No newline at end of file
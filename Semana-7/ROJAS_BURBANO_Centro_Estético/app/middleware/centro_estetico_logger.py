@@ -1,74 +1,226 @@
 # app/middleware/domain_logger.py
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import json
+import random
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from .centro_estetico_route_matcher import DomainRouteMatcher
 
-class DomainLogger(BaseHTTPMiddleware):
-    def __init__(self, app, domain_prefix: str):
-        super().__init__(app)
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler con cola acotada. Con la cola llena descarta el registro ("drop")
+    o espera hasta `block_timeout` segundos a que haya hueco ("block").
+    No formatea en el hilo que loggea: eso lo hace el listener.
+    """
+
+    def __init__(self, log_queue: queue.Queue, full_policy: str = "drop", block_timeout: float = 1.0):
+        super().__init__(log_queue)
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.dropped_records = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record  # Los mensajes ya llegan serializados y sin args
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.full_policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler que escribe sin flush por registro; el listener hace flush por lotes"""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Escribe en el hilo del listener y hace flush cada `batch_size` registros o al vaciarse la cola"""
+
+    def __init__(self, log_queue: queue.Queue, *handlers, batch_size: int = 100):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self._unflushed = 0
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        self._unflushed += 1
+        if self._unflushed >= self.batch_size or self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+            self._unflushed = 0
+
+
+# Un pipeline (cola + listener) por logger de dominio, compartido por todas las instancias
+_listeners: Dict[str, BatchingQueueListener] = {}
+
+
+def _queued_domain_logger(name: str, log_file: str) -> logging.Logger:
+    """
+    Logger cuyo único handler encola; el disco solo se toca desde el hilo del listener.
+    Un nombre ya configurado con otro archivo es un error (el logger es global al proceso).
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    listener = _listeners.get(name)
+    if listener is not None:
+        current_file = listener.handlers[0].baseFilename
+        if current_file != os.path.abspath(log_file):
+            raise ValueError(f"El logger {name} ya escribe en {current_file}, no en {log_file}")
+        return logger
+
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = BufferedFileHandler(log_file)
+    file_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    logger.addHandler(BoundedQueueHandler(
+        log_queue,
+        full_policy=os.getenv("LOG_QUEUE_FULL_POLICY", "drop"),
+        block_timeout=float(os.getenv("LOG_QUEUE_BLOCK_TIMEOUT", 1.0))
+    ))
+    logger.propagate = False
+    listener = _listeners[name] = BatchingQueueListener(
+        log_queue, file_handler, batch_size=int(os.getenv("LOG_BATCH_SIZE", 100))
+    )
+    listener.start()
+    atexit.register(listener.stop)  # Vacía la cola al salir
+    return logger
+
+
+class LogSampler:
+    """
+    Muestreo de las líneas de request. `rates` da la fracción a loggear por nivel de
+    la ruta y clase de status ("2xx", "4xx"...); lo no configurado se loggea siempre.
+    La decisión se toma al inicio (head sampling) y al final solo se añaden las
+    clases de status con más tasa (p. ej. errores). En modo adaptativo las tasas < 1
+    se escalan para no superar ~`target_per_second` líneas muestreadas por segundo.
+    Los requests omitidos se resumen en una línea cada `summary_interval` segundos.
+    """
+
+    def __init__(self, rates: Dict[str, Dict[str, float]], adaptive: bool = False,
+                 target_per_second: float = 50, summary_interval: float = 10.0, rng=random.random):
+        self.rates = rates
+        self.adaptive = adaptive
+        self.target_per_second = target_per_second
+        self.summary_interval = summary_interval
+        self.rng = rng
+        self.scale = 1.0  # Factor adaptativo aplicado a las tasas < 1
+
+        self._window_start = time.monotonic()
+        self._expected_lines = 0.0
+        self._summary_start = time.monotonic()
+        self._skipped: Dict[int, int] = {}
+        self._skipped_time = 0.0
+
+    def _rate(self, log_level: str, status_class: str) -> float:
+        rate = self.rates.get(log_level, {}).get(status_class, 1.0)
+        return rate if rate >= 1.0 else rate * self.scale
+
+    def head(self, log_level: str, now: float) -> bool:
+        """Decide al inicio del request si se loggea completo (START + END)"""
+        base_rate = self.rates.get(log_level, {}).get("2xx", 1.0)
+        if self.adaptive and base_rate < 1.0:
+            elapsed = now - self._window_start
+            if elapsed >= 1.0:
+                expected_per_second = self._expected_lines / elapsed
+                self.scale = min(1.0, self.target_per_second / expected_per_second) if expected_per_second else 1.0
+                self._window_start, self._expected_lines = now, 0.0
+            self._expected_lines += base_rate
+        return self.rng() < self._rate(log_level, "2xx")
+
+    def keep(self, log_level: str, status_code: int, head_sampled: bool) -> bool:
+        """Al final: se loggea si entró en la muestra o si su clase de status tiene más tasa"""
+        if head_sampled:
+            return True
+        status_rate = self._rate(log_level, f"{status_code // 100}xx")
+        return status_rate >= 1.0 or (status_rate > self._rate(log_level, "2xx") and self.rng() < status_rate)
+
+    def record_skipped(self, status_code: int, process_time: float):
+        self._skipped[status_code] = self._skipped.get(status_code, 0) + 1
+        self._skipped_time += process_time
+
+    def take_summary(self, now: float, force: bool = False) -> Optional[Dict[str, Any]]:
+        """Resumen de los requests omitidos si pasó el intervalo, o ya con `force` (y hubo alguno)"""
+        elapsed = now - self._summary_start
+        if (elapsed < self.summary_interval and not force) or not self._skipped:
+            return None
+        skipped = sum(self._skipped.values())
+        summary = {
+            "window_seconds": round(elapsed, 1),
+            "skipped": skipped,
+            "by_status": {str(code): count for code, count in sorted(self._skipped.items())},
+            "avg_process_time": round(self._skipped_time / skipped, 4),
+            "sample_scale": round(self.scale, 4),
+        }
+        self._summary_start, self._skipped, self._skipped_time = now, {}, 0.0
+        return summary
+
+
+class DomainLogger:
+    """Middleware ASGI puro: sin tarea extra ni re-empaquetado del body por request (streaming intacto)"""
+
+    def __init__(self, app: ASGIApp, domain_prefix: str, log_file: str = None, sampler: LogSampler = None):
+        self.app = app
         self.domain_prefix = domain_prefix
+        self.path_prefix = f"/{domain_prefix.rstrip('_')}"
+        self.routes = DomainRouteMatcher.for_domain(domain_prefix)
 
-        # Configurar logger específico para el dominio
-        self.logger = logging.getLogger(f"{domain_prefix}domain_logger")
-        self.logger.setLevel(logging.INFO)
+        # Configurar logger específico para el dominio: escritura en disco fuera del event loop
+        self.logger = _queued_domain_logger(
+            f"{domain_prefix}domain_logger",
+            log_file or f"logs/{domain_prefix}domain.log"
+        )
 
-        # Handler específico para archivos del dominio
-        handler = logging.FileHandler(f"logs/{domain_prefix}domain.log")
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        # Muestreo: en pico la mayoría de líneas serían 2xx idénticos
+        self.sampler = sampler or LogSampler(
+            self._get_sampling_rates(),
+            adaptive=os.getenv("LOG_SAMPLING_ADAPTIVE", "false").lower() == "true",
+            target_per_second=float(os.getenv("LOG_SAMPLING_TARGET_PER_SECOND", 50)),
+            summary_interval=float(os.getenv("LOG_SUMMARY_INTERVAL", 10))
         )
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
 
         # Configurar qué endpoints loggear por dominio
         self.logged_endpoints = self._get_logged_endpoints(domain_prefix)
 
     def _get_logged_endpoints(self, domain_prefix: str) -> Dict[str, str]:
-        """Define qué endpoints requieren logging específico por dominio"""
-
-        logging_configs = {
-            "vet_": {
-                "/historial": "CRITICAL",  # Acceso a historiales médicos
-                "/emergency": "CRITICAL",  # Emergencias veterinarias
-                "/update": "WARNING",      # Modificaciones importantes
-                "/delete": "CRITICAL",     # Eliminaciones críticas
-            },
-            "edu_": {
-                "/booking": "INFO",        # Reservas de aulas
-                "/schedule": "INFO",       # Cambios en horarios
-                "/enrollment": "WARNING",  # Inscripciones/cancelaciones
-                "/admin": "WARNING",       # Acciones administrativas
-            },
-            "gym_": {
-                "/checkin": "INFO",        # Check-ins de miembros
-                "/equipment": "INFO",      # Uso de equipos
-                "/membership": "WARNING",  # Cambios en membresías
-                "/access": "INFO",         # Acceso a instalaciones
-            },
-            "pharma_": {
-                "/inventory": "INFO",      # Consultas de inventario
-                "/sales": "WARNING",       # Ventas realizadas
-                "/price": "INFO",          # Consultas de precios
-                "/admin": "CRITICAL",      # Cambios administrativos
-            }
-        }
+        """Define qué endpoints requieren logging específico por dominio (ver DOMAIN_ROUTE_RULES)"""
+        return dict(self.routes.log_levels)
 
-        return logging_configs.get(domain_prefix, {
-            "/create": "INFO",
-            "/update": "WARNING",
-            "/delete": "CRITICAL",
-            "/admin": "WARNING"
-        })
+    def _get_sampling_rates(self) -> Dict[str, Dict[str, float]]:
+        """Fracción de requests a loggear por nivel de ruta y clase de status (4xx/5xx siempre)"""
+        info_rate = float(os.getenv("LOG_SAMPLE_RATE_INFO", 0.01))
+        return {
+            "INFO": {"2xx": info_rate, "3xx": info_rate, "4xx": 1.0, "5xx": 1.0},
+            "WARNING": {"2xx": 1.0, "3xx": 1.0, "4xx": 1.0, "5xx": 1.0},
+            "CRITICAL": {"2xx": 1.0, "3xx": 1.0, "4xx": 1.0, "5xx": 1.0},
+        }
 
     def _should_log_endpoint(self, path: str) -> tuple[bool, str]:
         """Determina si el endpoint debe ser loggeado y su nivel"""
-        for endpoint_pattern, level in self.logged_endpoints.items():
-            if endpoint_pattern in path:
-                return True, level
-        return False, "INFO"
+        log_level = self.routes.match(path).log_level
+        return log_level is not None, log_level or "INFO"
 
     def _extract_domain_specific_data(self, request: Request, path: str) -> Dict[str, Any]:
         """Extrae datos específicos del dominio para logging"""
@@ -76,7 +228,7 @@ class DomainLogger(BaseHTTPMiddleware):
             "domain": self.domain_prefix,
             "path": path,
             "method": request.method,
-            "client_ip": request.client.host,
+            "client_ip": request.client.host if request.client else "unknown",
             "user_agent": request.headers.get("user-agent", "unknown")
         }
 
@@ -111,53 +263,122 @@ class DomainLogger(BaseHTTPMiddleware):
 
         return data
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, self._flushing_on_shutdown(receive), send)
+            return
+        # Solo procesar endpoints del dominio
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        started = self._log_start(Request(scope))
+        if started is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500  # Si la app falla antes de responder
+
+        async def send_capturing_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_capturing_status)
+        finally:
+            self._log_end(started, status_code)
+
+    def _flushing_on_shutdown(self, receive: Receive) -> Receive:
+        """receive del lifespan que escribe el resumen pendiente al apagar la app"""
+        async def receive_flushing() -> Message:
+            message = await receive()
+            if message["type"] == "lifespan.shutdown":
+                self.flush_summary(force=True)
+            return message
+        return receive_flushing
+
+    def flush_summary(self, force: bool = False):
+        """Escribe REQUEST_SUMMARY si toca (o ya, con `force`) y hay requests omitidos"""
+        summary = self.sampler.take_summary(time.monotonic(), force)
+        if summary is not None:
+            self._emit(logging.INFO, f"REQUEST_SUMMARY: {json.dumps({'domain': self.domain_prefix, **summary})}")
+
+    def _emit(self, level: int, message: str):
+        """Ruta rápida: crea el LogRecord directamente (sin findCaller) y lo encola"""
+        if self.logger.isEnabledFor(level):
+            self.logger.handle(self.logger.makeRecord(self.logger.name, level, __name__, 0, message, None, None))
+
+    def _request_json(self, request: Request) -> str:
+        """Datos del request serializados una sola vez (REQUEST_END reutiliza el JSON)"""
+        return json.dumps(self._extract_domain_specific_data(request, request.url.path))
+
+    def _log_start(self, request: Request) -> Optional[Tuple[Request, Optional[str], str, float, bool]]:
+        """Loggea REQUEST_START si el endpoint lo requiere y entra en la muestra; devuelve el contexto para _log_end"""
         start_time = time.time()
-        path = request.url.path
 
-        # Solo procesar endpoints del dominio
-        if not path.startswith(f"/{self.domain_prefix.rstrip('_')}"):
-            return await call_next(request)
+        # Verificar si debe ser loggeado (resultado compartido con las demás capas vía scope)
+        log_level = self.routes.match_scope(request.scope).log_level
+        if log_level is None:
+            return None
 
-        # Verificar si debe ser loggeado
-        should_log, log_level = self._should_log_endpoint(path)
+        # Fuera de la muestra no se extrae nada: solo se necesita si al final se loggea (p. ej. un 5xx)
+        if not self.sampler.head(log_level, time.monotonic()):
+            return request, None, log_level, start_time, False
 
-        if should_log:
-            # Datos del request
-            request_data = self._extract_domain_specific_data(request, path)
+        request_json = self._request_json(request)
 
-            # Loggear inicio del request
-            self.logger.log(
-                getattr(logging, log_level),
-                f"REQUEST_START: {json.dumps(request_data)}"
-            )
+        # Loggear inicio del request
+        self._emit(getattr(logging, log_level), f"REQUEST_START: {request_json}")
+        return request, request_json, log_level, start_time, True
 
-        # Procesar request
-        response = await call_next(request)
+    def _log_end(self, started: Tuple[Request, Optional[str], str, float, bool], status_code: int):
+        request, request_json, log_level, start_time, head_sampled = started
 
-        if should_log:
-            # Calcular tiempo de respuesta
-            process_time = time.time() - start_time
-
-            # Datos de la respuesta
-            response_data = {
-                **request_data,
-                "status_code": response.status_code,
-                "process_time": round(process_time, 3)
-            }
-
-            # Determinar nivel según status code
-            if response.status_code >= 500:
-                response_level = "CRITICAL"
-            elif response.status_code >= 400:
-                response_level = "WARNING"
-            else:
-                response_level = log_level
+        # Calcular tiempo de respuesta
+        process_time = time.time() - start_time
+
+        if not self.sampler.keep(log_level, status_code, head_sampled):
+            self.sampler.record_skipped(status_code, process_time)
+            self.flush_summary()
+            return
+        if request_json is None:
+            request_json = self._request_json(request)
+
+        # Determinar nivel según status code
+        if status_code >= 500:
+            response_level = "CRITICAL"
+        elif status_code >= 400:
+            response_level = "WARNING"
+        else:
+            response_level = log_level
+
+        # Loggear respuesta: mismo JSON que json.dumps({**request_data, status_code, process_time})
+        self._emit(
+            getattr(logging, response_level),
+            f'REQUEST_END: {request_json[:-1]}, "status_code": {status_code}, "process_time": {round(process_time, 3)}}}'
+        )
 
-            # Loggear respuesta
-            self.logger.log(
-                getattr(logging, response_level),
-                f"REQUEST_END: {json.dumps(response_data)}"
-            )
 
+class BaseHTTPDomainLogger(BaseHTTPMiddleware):
+    """Versión anterior sobre BaseHTTPMiddleware (misma configuración); se conserva para comparar"""
+
+    def __init__(self, app: ASGIApp, **config):
+        super().__init__(app)
+        self.domain_logger = DomainLogger(app, **config)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":  # Mismo resumen al apagar que la versión ASGI
+            await self.domain_logger(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+    async def dispatch(self, request: Request, call_next):
+        if not request.url.path.startswith(self.domain_logger.path_prefix):
+            return await call_next(request)
+        started = self.domain_logger._log_start(request)
+        response = await call_next(request)
+        if started is not None:
+            self.domain_logger._log_end(started, response.status_code)
         return response
\ No newline at end of file
@@ -1,158 +1,515 @@
-from fastapi import Request, HTTPException
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import asyncio
 import redis
+import redis.asyncio as aioredis
+import os
+import threading
 import time
 import json
-from typing import Dict, Optional
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from .centro_estetico_route_matcher import DomainRouteMatcher
 
-class DomainRateLimiter(BaseHTTPMiddleware):
-    def __init__(self, app, domain_prefix: str, redis_client: redis.Redis):
-        super().__init__(app)
+# Ventana deslizante atómica en un solo round trip: recorta, cuenta, añade y fija la expiración.
+# KEYS[1] = clave del cliente; ARGV = ahora (ms), ventana (ms), límite, miembro único,
+# requests ya admitidos por el tier local pendientes de registrar (se anotan antes de decidir).
+# Devuelve {permitido (1/0), cupo restante, ms hasta que se libera el hueco más antiguo}.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local batched = tonumber(ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+for i = 1, math.min(batched, limit - count) do
+    redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+    count = count + 1
+end
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    count = count + 1
+    allowed = 1
+end
+redis.call('PEXPIRE', KEYS[1], window)
+local reset_ms = window
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset_ms = tonumber(oldest[2]) + window - now
+end
+return {allowed, limit - count, reset_ms}
+"""
+
+
+# GCRA (token bucket sin temporizador): una sola clave con el "theoretical arrival time".
+# Memoria O(1) por cliente. ARGV = ahora (ms), intervalo de emisión (ms), ráfaga (límite),
+# requests ya admitidos por el tier local pendientes de registrar.
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local batched = tonumber(ARGV[4])
+tat = math.min(tat + interval * batched, now + interval * burst)
+local new_tat = tat + interval
+local allow_at = new_tat - interval * burst
+if allow_at > now then
+    -- El actual se rechaza, pero los admitidos en local sí consumieron cupo
+    if batched > 0 then
+        redis.call('SET', KEYS[1], string.format('%.3f', tat), 'PX', math.ceil(tat - now))
+    end
+    return {0, 0, math.ceil(allow_at - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at) / interval), math.ceil(new_tat - now)}
+"""
+
+# Ventana fija: un contador por ventana (la clave ya incluye el número de ventana).
+# ARGV = ventana (ms), requests a sumar (el actual más los pendientes del tier local).
+FIXED_WINDOW_SCRIPT = """
+local count = redis.call('INCRBY', KEYS[1], ARGV[2])
+if count == tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    reset_after: float  # Segundos hasta que vuelve a haber cupo
+
+
+class RateLimitAlgorithm(ABC):
+    """Algoritmo de rate limiting ejecutado en Redis en un solo round trip"""
+    name: str = ""
+    script: str = ""
+
+    def __init__(self, redis_client: aioredis.Redis):
+        # EVALSHA con recarga automática del script si Redis lo ha olvidado (NOSCRIPT)
+        self._script = redis_client.register_script(self.script)
+
+    @abstractmethod
+    async def check(self, key: str, config: Dict, now_ms: int, batched: int = 0) -> RateLimitResult:
+        """Registra `batched` requests ya admitidos en local y decide sobre el actual"""
+
+
+class SlidingWindowLog(RateLimitAlgorithm):
+    """Registro exacto en un sorted set: memoria proporcional al límite"""
+    name = "sliding_window"
+    script = SLIDING_WINDOW_SCRIPT
+
+    async def check(self, key: str, config: Dict, now_ms: int, batched: int = 0) -> RateLimitResult:
+        # Miembro único: varios requests en el mismo milisegundo no se colapsan en uno
+        member = f"{now_ms}-{uuid.uuid4().hex[:12]}"
+        allowed, remaining, reset_ms = await self._script(
+            keys=[key],
+            args=[now_ms, config["window"] * 1000, config["requests"], member, batched]
+        )
+        return RateLimitResult(bool(allowed), int(remaining), int(reset_ms) / 1000)
+
+
+class GCRA(RateLimitAlgorithm):
+    """Token bucket vía GCRA: admite ráfagas de `requests` y repone uno cada window/requests"""
+    name = "gcra"
+    script = GCRA_SCRIPT
+
+    async def check(self, key: str, config: Dict, now_ms: int, batched: int = 0) -> RateLimitResult:
+        interval_ms = config["window"] * 1000 / config["requests"]
+        allowed, remaining, reset_ms = await self._script(
+            keys=[f"{key}:gcra"],
+            args=[now_ms, interval_ms, config["requests"], batched]
+        )
+        return RateLimitResult(bool(allowed), int(remaining), int(reset_ms) / 1000)
+
+
+class FixedWindowCounter(RateLimitAlgorithm):
+    """Contador por ventana fija: el más barato, pero admite hasta 2x el límite en el cambio de ventana"""
+    name = "fixed_window"
+    script = FIXED_WINDOW_SCRIPT
+
+    async def check(self, key: str, config: Dict, now_ms: int, batched: int = 0) -> RateLimitResult:
+        window_ms = config["window"] * 1000
+        window_id = now_ms // window_ms
+        count = int(await self._script(keys=[f"{key}:fw:{window_id}"], args=[window_ms, batched + 1]))
+        reset_after = ((window_id + 1) * window_ms - now_ms) / 1000
+        return RateLimitResult(count <= config["requests"], max(config["requests"] - count, 0), reset_after)
+
+
+RATE_LIMIT_ALGORITHMS: Dict[str, type] = {
+    SlidingWindowLog.name: SlidingWindowLog,
+    GCRA.name: GCRA,
+    FixedWindowCounter.name: FixedWindowCounter,
+}
+DEFAULT_ALGORITHM = SlidingWindowLog.name
+
+
+class _Lease:
+    __slots__ = ("credits", "pending", "remaining", "expires_at", "reset_at", "config")
+
+    def __init__(self, credits: int, remaining: int, expires_at: float, reset_at: float,
+                 config: Optional[Dict] = None, pending: int = 0):
+        self.credits = credits        # Requests que aún se pueden admitir sin ir a Redis
+        self.pending = pending        # Admitidos en local, pendientes de registrar en Redis
+        self.remaining = remaining    # Cupo restante según la última respuesta de Redis
+        self.expires_at = expires_at
+        self.reset_at = reset_at
+        self.config = config          # Límite de la categoría (para registrar los pendientes)
+
+
+class LocalPreCheck:
+    """
+    Tier local (por worker) delante de Redis. Tras cada consulta a Redis concede al
+    cliente una fracción `share` de su cupo restante como créditos locales, válidos
+    durante `lease_seconds`. Mientras queden, los requests se admiten sin round trip y
+    se registran en Redis en lote con la siguiente consulta. Cerca del límite la
+    fracción no llega a un crédito y cada request vuelve a consultar Redis.
+    Con N workers se admiten como mucho N * share del cupo restante sin consultar Redis.
+    Los pendientes de concesiones vencidas o desalojadas del LRU no se pierden: take_stale
+    los entrega para registrarlos aunque el cliente no vuelva.
+    """
+
+    def __init__(self, share: float = 0.1, lease_seconds: float = 1.0, max_clients: int = 10000):
+        self.share = share
+        self.lease_seconds = lease_seconds
+        self.max_clients = max_clients
+        self._leases: "OrderedDict[str, _Lease]" = OrderedDict()
+        self._evicted: List[Tuple[str, int, Dict]] = []  # Pendientes de concesiones desalojadas
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, now: float) -> Optional[RateLimitResult]:
+        """Admite el request con un crédito local, o None si hay que consultar Redis"""
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease.credits <= 0 or lease.expires_at <= now:
+                return None
+            lease.credits -= 1
+            lease.pending += 1
+            return RateLimitResult(True, lease.remaining - lease.pending, max(lease.reset_at - now, 0))
+
+    def take_pending(self, key: str) -> int:
+        """Retira la concesión y devuelve los admitidos en local que faltan por registrar"""
+        with self._lock:
+            lease = self._leases.pop(key, None)
+        return lease.pending if lease else 0
+
+    def restore_pending(self, key: str, pending: int, config: Dict, now: float):
+        """Devuelve pendientes retirados que no llegaron a Redis: se registran con la próxima consulta"""
+        if pending <= 0:
+            return
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None:
+                # Sin créditos: el siguiente request del cliente consulta Redis y se los lleva
+                self._leases[key] = _Lease(0, 0, expires_at=now, reset_at=now, config=config, pending=pending)
+            else:
+                lease.pending += pending
+
+    def grant(self, key: str, result: RateLimitResult, now: float, config: Optional[Dict] = None):
+        """Concede créditos según la respuesta de Redis (ninguno si el cliente está cerca del límite)"""
+        credits = int(result.remaining * self.share) if result.allowed else 0
+        if credits <= 0:
+            return
+        with self._lock:
+            previous = self._leases.get(key)  # Pendientes devueltos mientras se consultaba Redis
+            self._leases[key] = _Lease(
+                credits, result.remaining,
+                expires_at=now + min(self.lease_seconds, result.reset_after),
+                reset_at=now + result.reset_after,
+                config=config, pending=previous.pending if previous else 0
+            )
+            self._leases.move_to_end(key)
+            while len(self._leases) > self.max_clients:
+                evicted_key, evicted = self._leases.popitem(last=False)
+                if evicted.pending and evicted.config is not None:
+                    self._evicted.append((evicted_key, evicted.pending, evicted.config))
+
+    def take_stale(self, now: float) -> List[Tuple[str, int, Dict]]:
+        """Retira los pendientes de concesiones vencidas o desalojadas: [(clave, pendientes, config)]"""
+        with self._lock:
+            stale, self._evicted = self._evicted, []
+            for key in [key for key, lease in self._leases.items() if lease.expires_at <= now]:
+                lease = self._leases.pop(key)
+                if lease.pending and lease.config is not None:
+                    stale.append((key, lease.pending, lease.config))
+        return stale
+
+
+class DomainRateLimiter:
+    """
+    Middleware ASGI puro: sin tarea extra ni re-empaquetado del body por request (streaming intacto).
+    Usa el cliente asyncio de Redis: el script se espera sin bloquear el event loop.
+    `redis_client` puede ser un cliente o una función que devuelva el del loop actual
+    (p. ej. `lambda: async_cache_manager.redis_client`).
+    """
+
+    def __init__(self, app: ASGIApp, domain_prefix: str,
+                 redis_client: Union[aioredis.Redis, Callable[[], aioredis.Redis]],
+                 fail_open: Optional[bool] = None, local_tier: Optional[LocalPreCheck] = None):
+        self.app = app
         self.domain_prefix = domain_prefix
-        self.redis = redis_client
+        self.path_prefix = f"/{domain_prefix.rstrip('_')}"
+        self.routes = DomainRouteMatcher.for_domain(domain_prefix)
+        if isinstance(redis_client, aioredis.Redis):
+            client = redis_client
+            redis_client = lambda: client
+        self._redis_source = redis_client
+        self._algorithms_client = None
+        self._algorithms: Dict[str, RateLimitAlgorithm] = {}
+        # Tiempo máximo por consulta a Redis; si se supera cuenta como Redis caído
+        self.redis_timeout = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", 0.5))
+
+        # Sin Redis: True deja pasar los requests (fail open), False responde 503 (fail closed)
+        if fail_open is None:
+            fail_open = os.getenv("RATE_LIMIT_FAIL_OPEN", "true").lower() == "true"
+        self.fail_open = fail_open
+        # Circuit breaker: tras N fallos seguidos de Redis no se vuelve a intentar durante unos
+        # segundos (cada intento bloquea); un error aislado no corta las consultas
+        self.redis_failure_threshold = int(os.getenv("RATE_LIMIT_REDIS_FAILURE_THRESHOLD", 3))
+        self.redis_retry_seconds = float(os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", 5))
+        self._redis_failures = 0
+        self._redis_down_until = 0.0
+        self.local_tier = local_tier or LocalPreCheck(
+            share=float(os.getenv("RATE_LIMIT_LOCAL_SHARE", 0.1)),
+            lease_seconds=float(os.getenv("RATE_LIMIT_LOCAL_LEASE_SECONDS", 1.0))
+        )
+        # Barrido periódico (con el propio tráfico) de los pendientes de clientes inactivos
+        self._next_flush_at = 0.0
+        self._flush_tasks: Set[asyncio.Task] = set()
 
         # Configuración específica por dominio
         self.rate_limits = self._get_domain_rate_limits(domain_prefix)
 
     def _get_domain_rate_limits(self, domain_prefix: str) -> Dict[str, Dict]:
-        """Configuración de límites específicos por dominio"""
+        """
+        Configuración de límites específicos por dominio.
+        `algorithm`: sliding_window (exacto, memoria O(límite)), gcra (token bucket,
+        una clave por cliente) o fixed_window (un contador por ventana).
+        """
 
         rate_configs = {
             "vet_": {
                 # Tipo A - límites altos para operaciones críticas
-                "critical": {"requests": 200, "window": 60},      # 200 req/min críticas
-                "routine": {"requests": 100, "window": 60},       # 100 req/min rutinarias
-                "general": {"requests": 150, "window": 60},       # 150 req/min general
-                "admin": {"requests": 50, "window": 60}           # 50 req/min admin
+                "critical": {"requests": 200, "window": 60, "algorithm": "gcra"},            # 200 req/min críticas
+                "routine": {"requests": 100, "window": 60, "algorithm": "sliding_window"},   # 100 req/min rutinarias
+                "general": {"requests": 150, "window": 60, "algorithm": "sliding_window"},   # 150 req/min general
+                "admin": {"requests": 50, "window": 60, "algorithm": "fixed_window"}         # 50 req/min admin
             },
             "edu_": {
                 # Tipo B - límites medios para reservas
-                "booking": {"requests": 80, "window": 60},        # 80 req/min reservas
-                "schedule": {"requests": 200, "window": 60},      # 200 req/min horarios
-                "general": {"requests": 120, "window": 60},       # 120 req/min general
-                "admin": {"requests": 40, "window": 60}           # 40 req/min admin
+                "booking": {"requests": 80, "window": 60, "algorithm": "sliding_window"},    # 80 req/min reservas
+                "schedule": {"requests": 200, "window": 60, "algorithm": "gcra"},            # 200 req/min horarios
+                "general": {"requests": 120, "window": 60, "algorithm": "sliding_window"},   # 120 req/min general
+                "admin": {"requests": 40, "window": 60, "algorithm": "fixed_window"}         # 40 req/min admin
             },
             "gym_": {
                 # Tipo C - límites altos para accesos frecuentes
-                "access": {"requests": 300, "window": 60},        # 300 req/min accesos
-                "equipment": {"requests": 150, "window": 60},     # 150 req/min equipos
-                "routine": {"requests": 100, "window": 60},       # 100 req/min rutinas
-                "general": {"requests": 180, "window": 60},       # 180 req/min general
-                "admin": {"requests": 60, "window": 60}           # 60 req/min admin
+                "access": {"requests": 300, "window": 60, "algorithm": "gcra"},              # 300 req/min accesos
+                "equipment": {"requests": 150, "window": 60, "algorithm": "sliding_window"}, # 150 req/min equipos
+                "routine": {"requests": 100, "window": 60, "algorithm": "sliding_window"},   # 100 req/min rutinas
+                "general": {"requests": 180, "window": 60, "algorithm": "gcra"},             # 180 req/min general
+                "admin": {"requests": 60, "window": 60, "algorithm": "fixed_window"}         # 60 req/min admin
             },
             "pharma_": {
                 # Tipo D - límites altos para inventario
-                "inventory": {"requests": 400, "window": 60},     # 400 req/min inventario
-                "sales": {"requests": 200, "window": 60},         # 200 req/min ventas
-                "search": {"requests": 300, "window": 60},        # 300 req/min búsquedas
-                "general": {"requests": 250, "window": 60},       # 250 req/min general
-                "admin": {"requests": 80, "window": 60}           # 80 req/min admin
+                "inventory": {"requests": 400, "window": 60, "algorithm": "gcra"},           # 400 req/min inventario
+                "sales": {"requests": 200, "window": 60, "algorithm": "sliding_window"},     # 200 req/min ventas
+                "search": {"requests": 300, "window": 60, "algorithm": "gcra"},              # 300 req/min búsquedas
+                "general": {"requests": 250, "window": 60, "algorithm": "gcra"},             # 250 req/min general
+                "admin": {"requests": 80, "window": 60, "algorithm": "fixed_window"}         # 80 req/min admin
+            },
+            "spa_": {
+                # Centro estético - cupo por cliente para reservas
+                "booking": {"requests": 100, "window": 60, "algorithm": "sliding_window"},   # 100 req/min reservas
+                "general": {"requests": 120, "window": 60, "algorithm": "sliding_window"},   # 120 req/min general
+                "admin": {"requests": 30, "window": 60, "algorithm": "fixed_window"}         # 30 req/min admin
             }
         }
 
         # Configuración por defecto para otros dominios
         default_config = {
-            "high_priority": {"requests": 200, "window": 60},
-            "medium_priority": {"requests": 100, "window": 60},
-            "low_priority": {"requests": 50, "window": 60},
-            "general": {"requests": 120, "window": 60},
-            "admin": {"requests": 30, "window": 60}
+            "high_priority": {"requests": 200, "window": 60, "algorithm": "gcra"},
+            "medium_priority": {"requests": 100, "window": 60, "algorithm": "sliding_window"},
+            "low_priority": {"requests": 50, "window": 60, "algorithm": "sliding_window"},
+            "general": {"requests": 120, "window": 60, "algorithm": "sliding_window"},
+            "admin": {"requests": 30, "window": 60, "algorithm": "fixed_window"}
         }
 
         return rate_configs.get(domain_prefix, default_config)
 
-    def _get_rate_limit_category(self, path: str, method: str) -> str:
-        """Determina la categoría de rate limit según el endpoint"""
-
-        # Patrones específicos por dominio
-        if self.domain_prefix == "vet_":
-            if "/emergency" in path or "/urgente" in path:
-                return "emergency"
-            elif "/consultation" in path or "/consulta" in path:
-                return "consultation"
-            elif "/admin" in path:
-                return "admin"
-
-        elif self.domain_prefix == "edu_":
-            if "/booking" in path or "/reserva" in path:
-                return "booking"
-            elif "/schedule" in path or "/horario" in path:
-                return "schedule"
-            elif "/admin" in path:
-                return "admin"
-
-        elif self.domain_prefix == "gym_":
-            if "/checkin" in path or "/entrada" in path:
-                return "checkin"
-            elif "/equipment" in path or "/equipo" in path:
-                return "equipment"
-            elif "/routine" in path or "/rutina" in path:
-                return "routine"
-            elif "/admin" in path:
-                return "admin"
-
-        elif self.domain_prefix == "pharma_":
-            if "/inventory" in path or "/inventario" in path:
-                return "inventory"
-            elif "/sales" in path or "/venta" in path:
-                return "sales"
-            elif "/search" in path or "/buscar" in path:
-                return "search"
-            elif "/admin" in path:
-                return "admin"
-
-        return "general"
+    @property
+    def redis(self) -> aioredis.Redis:
+        return self._redis_source()
 
-    async def dispatch(self, request: Request, call_next):
-        # Obtener información del request
-        client_ip = request.client.host
-        path = request.url.path
-        method = request.method
+    @property
+    def algorithms(self) -> Dict[str, RateLimitAlgorithm]:
+        """Scripts registrados sobre el cliente actual (se registran de nuevo si el cliente cambia)"""
+        client = self.redis
+        if client is not self._algorithms_client:
+            self._algorithms = {name: algorithm(client) for name, algorithm in RATE_LIMIT_ALGORITHMS.items()}
+            self._algorithms_client = client
+        return self._algorithms
+
+    def _get_rate_limit_category(self, path: str, method: str) -> str:
+        """Determina la categoría de rate limit según el endpoint (matcher precompilado del dominio)"""
+        return self.routes.match(path).category
 
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Solo aplicar rate limiting a endpoints de tu dominio
-        if not path.startswith(f"/{self.domain_prefix.rstrip('_')}"):
-            return await call_next(request)
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        rejection, headers = await self._evaluate(Request(scope))
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        # Continuar con el request
+        await self.app(scope, receive, send_with_headers)
 
-        # Determinar categoría de rate limit
-        category = self._get_rate_limit_category(path, method)
+    async def _evaluate(self, request: Request) -> Tuple[Optional[Response], Dict[str, str]]:
+        """Aplica el límite: (respuesta de rechazo o None, cabeceras X-RateLimit-* a añadir)"""
+        # Obtener información del request
+        client_ip = request.client.host if request.client else "unknown"
+
+        # Determinar categoría de rate limit (compartida con las demás capas vía scope)
+        category = self.routes.match_scope(request.scope).category
         rate_config = self.rate_limits.get(category, self.rate_limits["general"])
 
         # Verificar rate limit
-        if not self._check_rate_limit(client_ip, category, rate_config):
-            raise HTTPException(
+        try:
+            result = await self._check_rate_limit(client_ip, category, rate_config)
+        except (redis.RedisError, asyncio.TimeoutError) as e:
+            print(f"Rate limiter sin Redis ({'fail open' if self.fail_open else 'fail closed'}): {e!r}")
+            if self.fail_open:
+                return None, {}
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "1"},
+                content={"detail": {"error": "Rate limiter unavailable", "domain": self.domain_prefix}}
+            ), {}
+        headers = {
+            "X-RateLimit-Limit": str(rate_config["requests"]),
+            "X-RateLimit-Remaining": str(result.remaining),
+            "X-RateLimit-Reset": str(int(result.reset_after + 0.999)),
+        }
+        if not result.allowed:
+            headers["Retry-After"] = headers["X-RateLimit-Reset"]
+            return JSONResponse(
                 status_code=429,
-                detail={
-                    "error": "Rate limit exceeded",
-                    "category": category,
-                    "limit": rate_config["requests"],
-                    "window": rate_config["window"],
-                    "domain": self.domain_prefix
+                headers=headers,
+                content={
+                    "detail": {
+                        "error": "Rate limit exceeded",
+                        "category": category,
+                        "limit": rate_config["requests"],
+                        "window": rate_config["window"],
+                        "domain": self.domain_prefix
+                    }
                 }
-            )
+            ), headers
+        return None, headers
 
-        # Continuar con el request
-        response = await call_next(request)
-        return response
+    async def _check_rate_limit(self, client_ip: str, category: str, config: Dict) -> RateLimitResult:
+        """
+        Verifica y registra el request: primero contra los créditos locales y, si no
+        quedan, con el algoritmo de la categoría en Redis (un solo EVALSHA atómico).
+        """
+        # Clave específica para el dominio y categoría (cada algoritmo le añade su sufijo)
+        key = f"{self.domain_prefix}:rate_limit:{category}:{client_ip}"
+        now = time.monotonic()
+        self._schedule_flush(now)
+        local_result = self.local_tier.try_acquire(key, now)
+        if local_result is not None:
+            return local_result
 
-    def _check_rate_limit(self, client_ip: str, category: str, config: Dict) -> bool:
-        """Verifica si el cliente excede el rate limit"""
-        current_time = int(time.time())
-        window_start = current_time - config["window"]
+        if now < self._redis_down_until:
+            raise redis.ConnectionError("Redis no disponible (reintento pendiente)")
+        algorithm = self.algorithms[config.get("algorithm", DEFAULT_ALGORITHM)]
+        batched = self.local_tier.take_pending(key)
+        try:
+            result = await asyncio.wait_for(
+                algorithm.check(key, config, int(time.time() * 1000), batched), timeout=self.redis_timeout
+            )
+        except (redis.RedisError, asyncio.TimeoutError):
+            # Los admitidos en local siguen contando: se registran en la próxima consulta
+            self.local_tier.restore_pending(key, batched, config, now)
+            self._record_redis_failure(now)
+            raise
+        self._redis_failures = 0
+        self.local_tier.grant(key, result, now, config)
+        return result
 
-        # Clave específica para el dominio y categoría
-        key = f"{self.domain_prefix}:rate_limit:{category}:{client_ip}"
+    def _record_redis_failure(self, now: float):
+        """Abre el circuito al llegar a `redis_failure_threshold` fallos seguidos"""
+        self._redis_failures += 1
+        if self._redis_failures >= self.redis_failure_threshold:
+            self._redis_down_until = now + self.redis_retry_seconds
 
-        # Obtener requests en la ventana actual
-        requests = self.redis.zrangebyscore(key, window_start, current_time)
+    def _schedule_flush(self, now: float):
+        """Lanza en segundo plano, como mucho una vez por concesión, el registro de pendientes vencidos"""
+        if now < self._next_flush_at or now < self._redis_down_until:
+            return
+        self._next_flush_at = now + self.local_tier.lease_seconds
+        task = asyncio.get_running_loop().create_task(self.flush_pending())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
 
-        if len(requests) >= config["requests"]:
-            return False
+    async def flush_pending(self) -> int:
+        """
+        Registra en Redis los admitidos en local de concesiones vencidas o desalojadas
+        (clientes que no volvieron a consultar). Devuelve cuántos requests se registraron.
+        """
+        now = time.monotonic()
+        stale = self.local_tier.take_stale(now)
+        flushed = 0
+        for index, (key, pending, config) in enumerate(stale):
+            algorithm = self.algorithms[config.get("algorithm", DEFAULT_ALGORITHM)]
+            try:
+                # El último pendiente ocupa el lugar del request "actual" del script
+                await asyncio.wait_for(
+                    algorithm.check(key, config, int(time.time() * 1000), pending - 1), timeout=self.redis_timeout
+                )
+            except (redis.RedisError, asyncio.TimeoutError) as e:
+                print(f"No se pudieron registrar requests admitidos en local: {e!r}")
+                for key, pending, config in stale[index:]:
+                    self.local_tier.restore_pending(key, pending, config, now)
+                self._record_redis_failure(now)
+                break
+            flushed += pending
+        return flushed
 
-        # Añadir request actual
-        self.redis.zadd(key, {str(current_time): current_time})
-        self.redis.expire(key, config["window"])
 
-        # Limpiar requests antiguos
-        self.redis.zremrangebyscore(key, 0, window_start)
+class BaseHTTPDomainRateLimiter(BaseHTTPMiddleware):
+    """Versión anterior sobre BaseHTTPMiddleware (misma configuración); se conserva para comparar"""
+
+    def __init__(self, app: ASGIApp, **config):
+        super().__init__(app)
+        self.limiter = DomainRateLimiter(app, **config)
 
-        return True
\ No newline at end of file
+    async def dispatch(self, request: Request, call_next):
+        if not request.url.path.startswith(self.limiter.path_prefix):
+            return await call_next(request)
+        rejection, headers = await self.limiter._evaluate(request)
+        if rejection is not None:
+            return rejection
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
@@ -0,0 +1,170 @@
+# app/middleware/centro_estetico_route_matcher.py
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+# Reglas por ruta de cada dominio, compartidas por logger, validador y rate limiter.
+# Los patrones se buscan como subcadena del path; en cada lista gana el primero que aparece.
+DOMAIN_ROUTE_RULES: Dict[str, Dict] = {
+    "vet_": {
+        "categories": [
+            (("/emergency", "/urgente"), "emergency"),
+            (("/consultation", "/consulta"), "consultation"),
+            (("/admin",), "admin"),
+        ],
+        "log_levels": [
+            ("/historial", "CRITICAL"),   # Acceso a historiales médicos
+            ("/emergency", "CRITICAL"),   # Emergencias veterinarias
+            ("/update", "WARNING"),       # Modificaciones importantes
+            ("/delete", "CRITICAL"),      # Eliminaciones críticas
+        ],
+        "validations": [
+            (("/emergency",), "business_hours_exempt"),  # Emergencias veterinarias 24/7
+        ],
+    },
+    "edu_": {
+        "categories": [
+            (("/booking", "/reserva"), "booking"),
+            (("/schedule", "/horario"), "schedule"),
+            (("/admin",), "admin"),
+        ],
+        "log_levels": [
+            ("/booking", "INFO"),         # Reservas de aulas
+            ("/schedule", "INFO"),        # Cambios en horarios
+            ("/enrollment", "WARNING"),   # Inscripciones/cancelaciones
+            ("/admin", "WARNING"),        # Acciones administrativas
+        ],
+        "validations": [
+            (("booking",), "weekend_restricted"),  # Reservas no disponibles en fin de semana
+        ],
+    },
+    "gym_": {
+        "categories": [
+            (("/checkin", "/entrada"), "checkin"),
+            (("/equipment", "/equipo"), "equipment"),
+            (("/routine", "/rutina"), "routine"),
+            (("/admin",), "admin"),
+        ],
+        "log_levels": [
+            ("/checkin", "INFO"),         # Check-ins de miembros
+            ("/equipment", "INFO"),       # Uso de equipos
+            ("/membership", "WARNING"),   # Cambios en membresías
+            ("/access", "INFO"),          # Acceso a instalaciones
+        ],
+        "validations": [
+            (("/checkin",), "capacity_limits"),  # Límites de capacidad
+        ],
+    },
+    "pharma_": {
+        "categories": [
+            (("/inventory", "/inventario"), "inventory"),
+            (("/sales", "/venta"), "sales"),
+            (("/search", "/buscar"), "search"),
+            (("/admin",), "admin"),
+        ],
+        "log_levels": [
+            ("/inventory", "INFO"),       # Consultas de inventario
+            ("/sales", "WARNING"),        # Ventas realizadas
+            ("/price", "INFO"),           # Consultas de precios
+            ("/admin", "CRITICAL"),       # Cambios administrativos
+        ],
+        "validations": [
+            (("/emergency",), "business_hours_exempt"),    # Farmacia de emergencias
+            (("controlled",), "prescription_required"),    # Medicamentos controlados
+        ],
+    },
+    "spa_": {
+        "categories": [
+            (("/reservas", "/booking"), "booking"),
+            (("/admin",), "admin"),
+        ],
+        "log_levels": [
+            ("/create", "INFO"),
+            ("/update", "WARNING"),
+            ("/delete", "CRITICAL"),
+            ("/admin", "WARNING"),
+        ],
+        "validations": [],
+    },
+}
+
+# Reglas para otros dominios
+DEFAULT_ROUTE_RULES: Dict = {
+    "categories": [],
+    "log_levels": [
+        ("/create", "INFO"),
+        ("/update", "WARNING"),
+        ("/delete", "CRITICAL"),
+        ("/admin", "WARNING"),
+    ],
+    "validations": [],
+}
+
+# Clave del scope ASGI donde se guarda el resultado para las siguientes capas
+SCOPE_KEY = "domain_route_match"
+
+
+class RouteMatch(NamedTuple):
+    domain_prefix: str
+    path: str
+    category: str                 # Categoría de rate limit
+    log_level: Optional[str]      # None si el endpoint no se loggea
+    validations: FrozenSet[str]   # Reglas de validación que aplican a la ruta
+
+
+class DomainRouteMatcher:
+    """
+    Reglas por ruta del dominio compiladas una sola vez en una regex combinada.
+    Un solo recorrido del path devuelve categoría, nivel de log y validaciones;
+    los resultados se memorizan por path y se comparten entre middlewares vía scope.
+    """
+
+    _instances: Dict[str, "DomainRouteMatcher"] = {}
+
+    def __init__(self, domain_prefix: str, rules: Dict = None, cache_size: int = 4096):
+        self.domain_prefix = domain_prefix
+        rules = rules if rules is not None else DOMAIN_ROUTE_RULES.get(domain_prefix, DEFAULT_ROUTE_RULES)
+        self.categories: List[Tuple[FrozenSet[str], str]] = [
+            (frozenset(patterns), category) for patterns, category in rules["categories"]
+        ]
+        self.log_levels: List[Tuple[str, str]] = list(rules["log_levels"])
+        self.validations: List[Tuple[FrozenSet[str], str]] = [
+            (frozenset(patterns), rule) for patterns, rule in rules["validations"]
+        ]
+
+        patterns = {pattern for group, _ in self.categories + self.validations for pattern in group}
+        patterns.update(pattern for pattern, _ in self.log_levels)
+        # Lookahead: encuentra coincidencias solapadas; en cada posición la más larga primero.
+        # Los patrones que son prefijo de la coincidencia también aparecen en el path.
+        self._regex = re.compile(
+            "(?=(" + "|".join(re.escape(p) for p in sorted(patterns, key=len, reverse=True)) + "))"
+        ) if patterns else None
+        self._implied = {p: frozenset(q for q in patterns if p.startswith(q)) for p in patterns}
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def for_domain(cls, domain_prefix: str) -> "DomainRouteMatcher":
+        """Matcher compartido por todos los middlewares del dominio"""
+        matcher = cls._instances.get(domain_prefix)
+        if matcher is None:
+            matcher = cls._instances[domain_prefix] = cls(domain_prefix)
+        return matcher
+
+    def _match(self, path: str) -> RouteMatch:
+        found = set()
+        if self._regex is not None:
+            for found_match in self._regex.finditer(path):
+                found |= self._implied[found_match.group(1)]
+
+        category = next((category for group, category in self.categories if group & found), "general")
+        log_level = next((level for pattern, level in self.log_levels if pattern in found), None)
+        validations = frozenset(rule for group, rule in self.validations if group & found)
+        return RouteMatch(self.domain_prefix, path, category, log_level, validations)
+
+    def match_scope(self, scope: Dict) -> RouteMatch:
+        """Resultado del request, calculado por la primera capa que lo pide y reutilizado por el resto"""
+        cached = scope.get(SCOPE_KEY)
+        if cached is not None and cached.domain_prefix == self.domain_prefix and cached.path == scope["path"]:
+            return cached
+        route_match = scope[SCOPE_KEY] = self.match(scope["path"])
+        return route_match
@@ -0,0 +1,94 @@
+# app/middleware/centro_estetico_schedule.py
+import os
+import time
+from datetime import date, datetime, timedelta, tzinfo
+from typing import Callable, Iterable, Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def load_timezone(name: Optional[str]) -> Optional[tzinfo]:
+    """Zona horaria IANA (p. ej. 'America/Guayaquil'); None usa la hora local del servidor"""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        print(f"Zona horaria desconocida {name!r}, se usa la hora local: {e!r}")
+        return None
+
+
+def parse_holidays(value: str) -> Tuple[date, ...]:
+    """Feriados en formato ISO separados por coma: '2025-12-25,2026-01-01'"""
+    holidays = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            holidays.append(date.fromisoformat(item))
+        except ValueError:
+            print(f"Feriado con formato inválido ignorado: {item!r}")
+    return tuple(holidays)
+
+
+class BusinessSchedule:
+    """
+    Horario abierto/cerrado precalculado de un dominio.
+    La decisión vigente se guarda junto con el timestamp del próximo cambio (apertura,
+    cierre o medianoche), así que cada consulta es una sola comparación numérica y la
+    fecha solo se vuelve a calcular al cruzar ese límite (el reloj se asume creciente). Los feriados y los días en
+    `closed_weekdays` (0 = lunes) se consideran cerrados todo el día.
+    La hora de cierre es inclusiva, como la validación anterior: (8, 20) admite hasta las 20:59.
+    """
+
+    def __init__(self, open_hour: int = 0, close_hour: int = 24, tz: Union[str, tzinfo, None] = None,
+                 holidays: Iterable[date] = (), closed_weekdays: Iterable[int] = (),
+                 clock: Callable[[], float] = time.time):
+        self.open_hour = open_hour
+        self.close_hour = min(close_hour + 1, 24)
+        self.tz = load_timezone(tz) if isinstance(tz, str) else tz
+        self.holidays = frozenset(holidays)
+        self.closed_weekdays = frozenset(closed_weekdays)
+        self.clock = clock
+        # (abierto, timestamp del próximo límite); se reemplaza en bloque para lectores concurrentes
+        self._state: Tuple[bool, float] = (False, float("-inf"))
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = self.clock()
+        is_open, next_boundary = self._state
+        if now >= next_boundary:
+            is_open, next_boundary = self._state = self._compute(now)
+        return is_open
+
+    def _at(self, day: date, hour: int) -> float:
+        if hour >= 24:
+            day, hour = day + timedelta(days=1), 0
+        return datetime(day.year, day.month, day.day, hour, tzinfo=self.tz).timestamp()
+
+    def _compute(self, now: float) -> Tuple[bool, float]:
+        """Estado en `now` y el instante en que puede cambiar"""
+        local = datetime.fromtimestamp(now, self.tz)
+        today = local.date()
+        midnight = self._at(today, 24)
+        if today in self.holidays or today.weekday() in self.closed_weekdays:
+            return False, midnight
+
+        opens_at = self._at(today, self.open_hour)
+        closes_at = self._at(today, self.close_hour)
+        if now < opens_at:
+            return False, opens_at
+        if now < closes_at:
+            return True, closes_at
+        return False, midnight
+
+
+def schedule_settings(domain_prefix: str) -> Tuple[Optional[str], Tuple[date, ...]]:
+    """
+    Zona horaria y feriados del dominio: SPA_BUSINESS_TIMEZONE / SPA_BUSINESS_HOLIDAYS,
+    o los comunes BUSINESS_TIMEZONE / BUSINESS_HOLIDAYS si el dominio no define los suyos.
+    """
+    env_prefix = domain_prefix.upper()
+    timezone = os.getenv(f"{env_prefix}BUSINESS_TIMEZONE") or os.getenv("BUSINESS_TIMEZONE")
+    holidays = os.getenv(f"{env_prefix}BUSINESS_HOLIDAYS", os.getenv("BUSINESS_HOLIDAYS", ""))
+    return timezone or None, parse_holidays(holidays)
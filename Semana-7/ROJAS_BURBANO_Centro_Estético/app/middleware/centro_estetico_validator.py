@@ -1,16 +1,31 @@
-from fastapi import Request, HTTPException
+from fastapi import Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 import json
 from typing import Dict, Any, Optional
+from .centro_estetico_route_matcher import DomainRouteMatcher, RouteMatch
+from .centro_estetico_schedule import BusinessSchedule, schedule_settings
 
-class DomainValidator(BaseHTTPMiddleware):
-    def __init__(self, app, domain_prefix: str):
-        super().__init__(app)
+class DomainValidator:
+    """Middleware ASGI puro: sin tarea extra ni re-empaquetado del body por request (streaming intacto)"""
+
+    def __init__(self, app: ASGIApp, domain_prefix: str):
+        self.app = app
         self.domain_prefix = domain_prefix
+        self.path_prefix = f"/{domain_prefix.rstrip('_')}"
+        self.routes = DomainRouteMatcher.for_domain(domain_prefix)
         self.validators = self._get_domain_validators(domain_prefix)
 
+        # Horarios precalculados: cada request compara contra el próximo cambio de estado
+        timezone, holidays = schedule_settings(domain_prefix)
+        start_hour, end_hour = self.validators.get("business_hours", (0, 24))
+        self.business_schedule = BusinessSchedule(start_hour, end_hour, tz=timezone, holidays=holidays)
+        self.weekday_schedule = BusinessSchedule(tz=self.business_schedule.tz, closed_weekdays=(5, 6))
+
     def _get_domain_validators(self, domain_prefix: str) -> Dict[str, Any]:
-        """Validadores específicos por dominio"""
+        """Validadores específicos por dominio (las rutas a las que aplican están en DOMAIN_ROUTE_RULES)"""
 
         validators = {
             "vet_": {
@@ -21,7 +36,7 @@ class DomainValidator(BaseHTTPMiddleware):
             "edu_": {
                 "required_headers": ["X-Institution-ID"], # ID institución
                 "business_hours": (6, 22),               # 6 AM a 10 PM
-                "weekend_restricted": ["booking"]        # Restricciones fin de semana
+                "weekend_restricted": True               # Restricciones fin de semana
             },
             "gym_": {
                 "required_headers": ["X-Gym-Membership"], # Membresía del gimnasio
@@ -31,7 +46,7 @@ class DomainValidator(BaseHTTPMiddleware):
             "pharma_": {
                 "required_headers": ["X-Pharmacy-License"], # Licencia farmacia
                 "business_hours": (7, 21),                 # 7 AM a 9 PM
-                "prescription_required": ["controlled"]     # Medicamentos controlados
+                "prescription_required": True               # Medicamentos controlados
             }
         }
 
@@ -41,21 +56,13 @@ class DomainValidator(BaseHTTPMiddleware):
             "special_validations": []
         })
 
-    def _validate_business_hours(self, path: str) -> bool:
+    def _validate_business_hours(self, route_match: RouteMatch) -> bool:
         """Valida horarios de atención según el dominio"""
-        from datetime import datetime
-
-        current_hour = datetime.now().hour
-        start_hour, end_hour = self.validators.get("business_hours", (0, 24))
+        # Excepciones por dominio (emergencias veterinarias 24/7, farmacia de emergencias)
+        if "business_hours_exempt" in route_match.validations:
+            return True
 
-        # Excepciones por dominio
-        if self.domain_prefix == "vet_" and "/emergency" in path:
-            return True  # Emergencias veterinarias 24/7
-
-        if self.domain_prefix == "pharma_" and "/emergency" in path:
-            return True  # Farmacia de emergencias
-
-        return start_hour <= current_hour <= end_hour
+        return self.business_schedule.is_open()
 
     def _validate_required_headers(self, request: Request) -> bool:
         """Valida headers requeridos por dominio"""
@@ -67,69 +74,91 @@ class DomainValidator(BaseHTTPMiddleware):
 
         return True
 
-    def _validate_domain_specific_rules(self, request: Request, path: str) -> tuple[bool, Optional[str]]:
-        """Validaciones específicas del dominio"""
-
-        if self.domain_prefix == "edu_":
-            # Academia: restricciones de fin de semana para reservas
-            weekend_restricted = self.validators.get("weekend_restricted", [])
-            if any(restriction in path for restriction in weekend_restricted):
-                from datetime import datetime
-                if datetime.now().weekday() >= 5:  # Sábado o Domingo
-                    return False, "Reservas no disponibles en fin de semana"
-
-        elif self.domain_prefix == "gym_":
-            # Gimnasio: verificar límites de capacidad
-            if "/checkin" in path and self.validators.get("capacity_limits"):
-                # Aquí implementarías la lógica de verificación de capacidad
-                # Por simplicidad, siempre retornamos True
-                pass
-
-        elif self.domain_prefix == "pharma_":
-            # Farmacia: medicamentos controlados requieren prescripción
-            if any(controlled in path for controlled in self.validators.get("prescription_required", [])):
-                if "X-Prescription-ID" not in request.headers:
-                    return False, "Medicamento controlado requiere prescripción"
+    def _validate_domain_specific_rules(self, request: Request, route_match: RouteMatch) -> tuple[bool, Optional[str]]:
+        """Validaciones específicas del dominio (solo las que el matcher asoció a la ruta)"""
+        rules = route_match.validations
 
-        return True, None
+        # Academia: restricciones de fin de semana para reservas
+        if "weekend_restricted" in rules and self.validators.get("weekend_restricted"):
+            if not self.weekday_schedule.is_open():  # Sábado o Domingo
+                return False, "Reservas no disponibles en fin de semana"
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+        # Gimnasio: verificar límites de capacidad
+        if "capacity_limits" in rules and self.validators.get("capacity_limits"):
+            # Aquí implementarías la lógica de verificación de capacidad
+            # Por simplicidad, siempre retornamos True
+            pass
+
+        # Farmacia: medicamentos controlados requieren prescripción
+        if "prescription_required" in rules and self.validators.get("prescription_required"):
+            if "X-Prescription-ID" not in request.headers:
+                return False, "Medicamento controlado requiere prescripción"
 
+        return True, None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Solo validar endpoints del dominio
-        if not path.startswith(f"/{self.domain_prefix.rstrip('_')}"):
-            return await call_next(request)
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        rejection = self._evaluate(Request(scope))
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _evaluate(self, request: Request) -> Optional[Response]:
+        """Respuesta de error si el request no cumple las reglas del dominio, o None"""
+        # Reglas de la ruta (compartidas con las demás capas vía scope)
+        route_match = self.routes.match_scope(request.scope)
 
         # Validar horarios de atención
-        if not self._validate_business_hours(path):
-            raise HTTPException(
+        if not self._validate_business_hours(route_match):
+            return JSONResponse(
                 status_code=403,
-                detail={
+                content={"detail": {
                     "error": "Fuera de horario de atención",
                     "domain": self.domain_prefix,
                     "business_hours": self.validators["business_hours"]
-                }
+                }}
             )
 
         # Validar headers requeridos
         if not self._validate_required_headers(request):
-            raise HTTPException(
+            return JSONResponse(
                 status_code=400,
-                detail={
+                content={"detail": {
                     "error": "Headers requeridos faltantes",
                     "required_headers": self.validators["required_headers"]
-                }
+                }}
             )
 
         # Validaciones específicas del dominio
-        is_valid, error_message = self._validate_domain_specific_rules(request, path)
+        is_valid, error_message = self._validate_domain_specific_rules(request, route_match)
         if not is_valid:
-            raise HTTPException(
+            return JSONResponse(
                 status_code=422,
-                detail={
+                content={"detail": {
                     "error": error_message,
                     "domain": self.domain_prefix
-                }
+                }}
             )
 
+        return None
+
+
+class BaseHTTPDomainValidator(BaseHTTPMiddleware):
+    """Versión anterior sobre BaseHTTPMiddleware (misma configuración); se conserva para comparar"""
+
+    def __init__(self, app: ASGIApp, **config):
+        super().__init__(app)
+        self.validator = DomainValidator(app, **config)
+
+    async def dispatch(self, request: Request, call_next):
+        if not request.url.path.startswith(self.validator.path_prefix):
+            return await call_next(request)
+        rejection = self.validator._evaluate(request)
+        if rejection is not None:
+            return rejection
         return await call_next(request)
\ No newline at end of file
@@ -0,0 +1,125 @@
+# monitoring/loop_monitor.py
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Histogram, REGISTRY, CollectorRegistry
+
+
+def _request_path(frame) -> Optional[str]:
+    """Path del request en curso: el primer `scope` ASGI que aparezca subiendo por la pila"""
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and "path" in scope:
+            return scope["path"]
+        frame = frame.f_back
+    return None
+
+
+class EventLoopMonitor:
+    """
+    Detecta bloqueos del event loop.
+    Una tarea heartbeat duerme `interval` segundos y registra cuánto tarde despierta
+    (histograma de lag). Un hilo watchdog vigila el último latido: si el loop lleva más
+    de `threshold` segundos sin latir, captura la pila del hilo del loop y el path del
+    request en curso, así se ve qué handler congeló el worker (Redis o SQLAlchemy
+    síncronos, escrituras a archivo...).
+    """
+
+    def __init__(self, domain: str, interval: float = None, threshold: float = None,
+                 max_stalls: int = 50, registry: CollectorRegistry = REGISTRY):
+        self.domain = domain
+        self.interval = interval if interval is not None else float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+        self.threshold = threshold if threshold is not None else float(os.getenv("LOOP_MONITOR_SLOW_SECONDS", 0.25))
+        self.stalls: "deque[Dict]" = deque(maxlen=max_stalls)
+
+        self.lag = Histogram(
+            f'{domain}_event_loop_heartbeat_lag_seconds',
+            'Retraso del heartbeat del event loop respecto a lo programado',
+            buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+            registry=registry
+        )
+        self.stall_counter = Counter(
+            f'{domain}_event_loop_stalls_total',
+            'Bloqueos del event loop por encima del umbral',
+            registry=registry
+        )
+
+        self._last_beat = time.monotonic()
+        self._beat = 0
+        self._reported_beat = -1
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """Arranca heartbeat y watchdog; se llama desde el event loop a vigilar"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join, 1.0)
+            self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self.lag.observe(lag)
+            if self._reported_beat == self._beat and self.stalls:
+                self.stalls[-1]["blocked_for"] = round(lag, 4)  # Duración final del bloqueo capturado
+            self._last_beat = now
+            self._beat += 1
+
+    def _watch(self):
+        check_every = min(self.interval, self.threshold / 2)
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            blocked_for = time.monotonic() - self._last_beat - self.interval
+            if blocked_for >= self.threshold and self._reported_beat != beat:
+                self._reported_beat = beat
+                self._capture(blocked_for)
+
+    def _capture(self, blocked_for: float):
+        """Guarda la pila del hilo del loop mientras sigue bloqueado"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)
+        path = _request_path(frame)
+        self.stalls.append({
+            "timestamp": time.time(),
+            "blocked_for": round(blocked_for, 4),
+            "path": path,
+            "stack": stack,
+        })
+        self.stall_counter.inc()
+        print(f"⚠️ Event loop bloqueado {blocked_for:.3f}s (request: {path or 'desconocido'})\n"
+              + "".join(stack[-5:]))
+
+    def recent_stalls(self) -> List[Dict]:
+        """Últimos bloqueos capturados (más reciente al final)"""
+        return list(self.stalls)
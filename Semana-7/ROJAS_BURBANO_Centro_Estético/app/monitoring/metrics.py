@@ -1,15 +1,50 @@
 # monitoring/metrics.py
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_client import Counter, Histogram, Gauge, Info
-import psutil
+from starlette.routing import Match
+import os
+import threading
 import time
 from functools import wraps
+from typing import Dict, Optional
+from app.cache.metrics import CacheMetrics
+
+# Etiquetas de endpoint fuera de las rutas conocidas
+UNMATCHED_ENDPOINT = "__unmatched__"   # Path sin ruta (404, escaneos, etc.)
+OVERFLOW_ENDPOINT = "__overflow__"     # Endpoint nuevo con el límite de series alcanzado
+
+
+def _match_route(scope):
+    """Ruta de la app que corresponde al path, para respuestas que no llegaron al router (429/503)"""
+    router = getattr(scope.get("app"), "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def route_template(scope) -> str:
+    """Plantilla de la ruta resuelta por el router (/spa/tratamientos/{id}); nunca el path con IDs"""
+    route = scope.get("route") or _match_route(scope)
+    return getattr(route, "path", None) or UNMATCHED_ENDPOINT
 
 class APIMetrics:
-    def __init__(self, app_name: str, domain: str):
+    def __init__(self, app_name: str, domain: str, max_endpoints: int = None):
         self.app_name = app_name
         self.domain = domain
 
+        # Límite duro de valores distintos de `endpoint` (cada uno crea series en counter e histograma)
+        if max_endpoints is None:
+            max_endpoints = int(os.getenv("METRICS_MAX_ENDPOINTS", 200))
+        self.max_endpoints = max_endpoints
+        self._endpoints = set()
+        self._endpoints_lock = threading.Lock()
+        self.endpoint_overflow = Counter(
+            f'{domain}_metrics_endpoint_overflow_total',
+            'Requests agrupados en __overflow__ por superar el límite de endpoints'
+        )
+
         # Métricas personalizadas por dominio
         self.request_counter = Counter(
             f'{domain}_requests_total',
@@ -29,15 +64,25 @@ class APIMetrics:
             'Conexiones activas'
         )
 
+        # Métricas del proceso; las actualiza SystemMetricsSampler desde su propio hilo
         self.system_metrics = {
-            'cpu_usage': Gauge(f'{domain}_cpu_usage_percent', 'Uso de CPU'),
-            'memory_usage': Gauge(f'{domain}_memory_usage_bytes', 'Uso de memoria'),
-            'disk_usage': Gauge(f'{domain}_disk_usage_percent', 'Uso de disco')
+            'cpu_usage': Gauge(f'{domain}_cpu_usage_percent', 'Uso de CPU del proceso'),
+            'cpu_seconds': Gauge(f'{domain}_cpu_seconds', 'Tiempo de CPU acumulado del proceso (user + system)'),
+            'memory_usage': Gauge(f'{domain}_memory_usage_bytes', 'Memoria residente (RSS) del proceso'),
+            'open_fds': Gauge(f'{domain}_open_fds', 'Descriptores de archivo abiertos por el proceso'),
+            'disk_usage': Gauge(f'{domain}_disk_usage_percent', 'Uso de disco'),
+            'event_loop_lag': Gauge(f'{domain}_event_loop_lag_seconds', 'Retraso del event loop en la última muestra'),
+            'gc_collections': Gauge(f'{domain}_gc_collections', 'Recolecciones del GC en el último intervalo'),
+            'gc_pause_total_seconds': Gauge(f'{domain}_gc_pause_total_seconds', 'Pausa total del GC en el último intervalo'),
+            'gc_pause_max_seconds': Gauge(f'{domain}_gc_pause_max_seconds', 'Pausa máxima del GC en el último intervalo')
         }
 
         # Métricas específicas del dominio
         self.business_metrics = self._create_business_metrics()
 
+        # Métricas del cache (las registra la propia capa de cache vía instrument())
+        self.cache_metrics = CacheMetrics(domain)
+
     def _create_business_metrics(self):
         """Crea métricas específicas según el dominio"""
         return {
@@ -56,8 +101,20 @@ class APIMetrics:
             )
         }
 
+    def _endpoint_label(self, endpoint: str) -> str:
+        """Admite endpoints nuevos hasta max_endpoints; después se agrupan en __overflow__"""
+        if endpoint in self._endpoints or endpoint in (UNMATCHED_ENDPOINT, OVERFLOW_ENDPOINT):
+            return endpoint
+        with self._endpoints_lock:
+            if len(self._endpoints) < self.max_endpoints:
+                self._endpoints.add(endpoint)
+                return endpoint
+        self.endpoint_overflow.inc()
+        return OVERFLOW_ENDPOINT
+
     def record_request(self, method: str, endpoint: str, status: int, duration: float):
-        """Registra métricas de request"""
+        """Registra métricas de request (endpoint: plantilla de ruta, no el path con IDs)"""
+        endpoint = self._endpoint_label(endpoint)
         self.request_counter.labels(
             method=method,
             endpoint=endpoint,
@@ -69,11 +126,12 @@ class APIMetrics:
             endpoint=endpoint
         ).observe(duration)
 
-    def update_system_metrics(self):
-        """Actualiza métricas del sistema"""
-        self.system_metrics['cpu_usage'].set(psutil.cpu_percent())
-        self.system_metrics['memory_usage'].set(psutil.virtual_memory().used)
-        self.system_metrics['disk_usage'].set(psutil.disk_usage('/').percent)
+    def update_system_metrics(self, sample: Dict[str, Optional[float]]):
+        """Vuelca una muestra de SystemMetricsSampler en los gauges (los None se omiten)"""
+        for name, value in sample.items():
+            gauge = self.system_metrics.get(name)
+            if gauge is not None and value is not None:
+                gauge.set(value)
 
     def record_business_event(self, event_type: str, **kwargs):
         """Registra eventos de negocio específicos del dominio"""
@@ -1,25 +1,164 @@
 # monitoring/profiler.py
 import cProfile
+import hashlib
+import hmac
 import pstats
 import io
+import math
+import os
+import sys
+import threading
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict, deque
 from memory_profiler import profile
 from functools import wraps
 import asyncio
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILER_MODES = ("sampling", "cprofile", "off")
+# Por encima de esto el hilo de muestreo apenas duerme y compite por el GIL con el event loop
+MAX_SAMPLE_RATE_HZ = 1000.0
+
+
+class SamplingProfiler:
+    """
+    Profiler estadístico: un hilo toma la pila del hilo vigilado `rate_hz` veces por
+    segundo y la cuenta en formato colapsado ("modulo:funcion;modulo:funcion ...").
+    Las muestras se agregan en cubetas de `bucket_seconds` dentro de una ventana móvil
+    de `window_seconds`; el código perfilado no paga nada por llamada.
+    """
+
+    def __init__(self, rate_hz: float = 100, window_seconds: float = 300,
+                 bucket_seconds: float = 10, max_depth: int = 64):
+        self.rate_hz = rate_hz
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.max_depth = max_depth
+
+        self._buckets: "deque[tuple]" = deque()  # (id de cubeta, Counter de pilas)
+        self._labels: Dict[Any, str] = {}        # code object -> etiqueta (se formatea una vez)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None):
+        """Empieza a muestrear `thread_id` (por defecto el hilo que llama, p. ej. el del event loop)"""
+        if self.running:
+            return
+        self._target_thread = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(1.0 / self.rate_hz):
+            self.sample()
+
+    def sample(self):
+        """Toma una muestra de la pila del hilo vigilado"""
+        frame = sys._current_frames().get(self._target_thread)
+        if frame is None:
+            return
+        stack = self._collapse(frame)
+        bucket = int(time.monotonic() // self.bucket_seconds)
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != bucket:
+                self._buckets.append((bucket, Counter()))
+                self._expire(bucket)
+            self._buckets[-1][1][stack] += 1
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            names.append(label)
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _expire(self, current_bucket: int):
+        oldest = current_bucket - int(self.window_seconds // self.bucket_seconds)
+        while self._buckets and self._buckets[0][0] <= oldest:
+            self._buckets.popleft()
+
+    def collapsed_stacks(self, limit: int = 200) -> List[str]:
+        """Pilas de la ventana en formato colapsado ("pila cuenta"), listas para flamegraph.pl o speedscope"""
+        totals = Counter()
+        with self._lock:
+            self._expire(int(time.monotonic() // self.bucket_seconds))
+            for _, stacks in self._buckets:
+                totals.update(stacks)
+        return [f"{stack} {count}" for stack, count in totals.most_common(limit)]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
 
 class APIProfiler:
-    def __init__(self, domain: str):
+    def __init__(self, domain: str, mode: str = None):
         self.domain = domain
         self.profiles = {}
         self.memory_profiles = {}
 
+        # sampling (por defecto, bajo overhead), cprofile (por llamada, para análisis puntual) u off
+        self.mode = mode or os.getenv("PROFILER_MODE", "sampling")
+        self.sampler = SamplingProfiler(
+            rate_hz=float(os.getenv("PROFILER_SAMPLE_RATE_HZ", 100)),
+            window_seconds=float(os.getenv("PROFILER_WINDOW_SECONDS", 300))
+        )
+
+        # Profiling de un request puntual con cabecera X-Profile firmada (sin secreto: deshabilitado)
+        self.profile_secret = os.getenv("PROFILER_SECRET") or None
+        self.max_request_profiles = int(os.getenv("PROFILER_MAX_REQUEST_PROFILES", 50))
+        self.request_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._request_profile_lock = threading.Lock()
+        self._active_request_profile: Optional["RequestProfile"] = None
+        self._requests_in_flight = 0
+
+    def set_mode(self, mode: str, rate_hz: float = None):
+        """Cambia el modo en caliente; en sampling arranca el muestreo sobre el hilo que llama"""
+        if mode not in PROFILER_MODES:
+            raise ValueError(f"Modo de profiling inválido: {mode}")
+        if rate_hz is not None:
+            try:
+                rate = float(rate_hz)
+            except (TypeError, ValueError):
+                raise ValueError(f"rate_hz debe ser numérico: {rate_hz!r}")
+            if not math.isfinite(rate) or not 0 < rate <= MAX_SAMPLE_RATE_HZ:
+                raise ValueError(f"rate_hz debe estar entre 0 y {MAX_SAMPLE_RATE_HZ:g}: {rate_hz!r}")
+            self.sampler.rate_hz = rate
+        self.mode = mode
+        if mode == "sampling":
+            self.sampler.start()
+        else:
+            self.sampler.stop()
+
     def profile_function(self, func_name: str = None):
         """Decorador para profiling de funciones"""
         def decorator(func):
             @wraps(func)
             async def wrapper(*args, **kwargs):
                 func_id = func_name or func.__name__
+                if self.mode != "cprofile":
+                    return await self._timed_call(func_id, func, *args, **kwargs)
 
                 # Profile CPU
                 pr = cProfile.Profile()
@@ -52,16 +191,203 @@ class APIProfiler:
             return wrapper
         return decorator
 
+    async def _timed_call(self, func_id: str, func, *args, **kwargs):
+        """Modo sampling/off: solo acumula tiempos por función (el detalle lo da el muestreo)"""
+        start_time = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                return await func(*args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            execution_time = time.perf_counter() - start_time
+            stats = self.profiles.get(func_id)
+            if stats is None or "calls" not in stats:
+                stats = self.profiles[func_id] = {"calls": 0, "total_time": 0.0, "max_time": 0.0}
+            stats["calls"] += 1
+            stats["total_time"] += execution_time
+            stats["max_time"] = max(stats["max_time"], execution_time)
+            stats["execution_time"] = execution_time
+            stats["timestamp"] = time.time()
+
     def get_profile_report(self, func_name: str = None) -> Dict[str, Any]:
         """Obtiene reporte de profiling"""
         if func_name:
             return self.profiles.get(func_name, {})
         return self.profiles
 
+    def get_sampling_report(self, limit: int = 200) -> Dict[str, Any]:
+        """Estado del profiler estadístico y pilas colapsadas de la ventana"""
+        return {
+            "mode": self.mode,
+            "running": self.sampler.running,
+            "rate_hz": self.sampler.rate_hz,
+            "window_seconds": self.sampler.window_seconds,
+            "collapsed_stacks": self.sampler.collapsed_stacks(limit)
+        }
+
+    def sign_profile_request(self, method: str, path: str, expires: int) -> str:
+        """Valor de X-Profile para `method path`, válido hasta el timestamp `expires`"""
+        message = f"{expires}:{method.upper()}:{path}".encode()
+        signature = hmac.new(self.profile_secret.encode(), message, hashlib.sha256).hexdigest()
+        return f"{expires}:{signature}"
+
+    def verify_profile_token(self, token: str, method: str, path: str) -> bool:
+        """Firma HMAC-SHA256 de PROFILER_SECRET sobre expiración, método y path; no reutilizable en otra ruta"""
+        if self.profile_secret is None:
+            return False
+        expires, _, signature = token.partition(":")
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        expected = self.sign_profile_request(method, path, int(expires)).partition(":")[2]
+        # En bytes: compare_digest con str falla (TypeError) si la cabecera trae caracteres no ASCII
+        return hmac.compare_digest(signature.encode(), expected.encode())
+
+    def begin_request_profile(self, method: str, path: str) -> Optional["RequestProfile"]:
+        """Arranca CPU (cProfile) y asignaciones (tracemalloc); None si ya hay otro request perfilándose"""
+        with self._request_profile_lock:
+            if self._active_request_profile is not None:
+                return None
+            try:
+                session = RequestProfile(method, path)
+            except Exception as e:  # p. ej. otro profiler de CPU activo en el mismo hilo
+                print(f"No se pudo perfilar {method} {path}: {e!r}")
+                return None
+            # Requests que ya estaban en curso (sin contar este) también quedan dentro del profile
+            session.concurrent_requests = max(self._requests_in_flight - 1, 0)
+            self._active_request_profile = session
+            return session
+
+    def end_request_profile(self, session: "RequestProfile", status_code: Optional[int]):
+        """Detiene el profiling y guarda el reporte bajo su ID (se conservan los últimos N)"""
+        try:
+            report = session.finish(status_code)
+        finally:
+            with self._request_profile_lock:
+                self._active_request_profile = None
+        self.request_profiles[session.profile_id] = report
+        while len(self.request_profiles) > self.max_request_profiles:
+            self.request_profiles.popitem(last=False)
+
+    def request_started(self):
+        """Cuenta un request en curso; si hay un profile activo, queda marcado como concurrente"""
+        with self._request_profile_lock:
+            self._requests_in_flight += 1
+            if self._active_request_profile is not None:
+                self._active_request_profile.concurrent_requests += 1
+
+    def request_finished(self):
+        with self._request_profile_lock:
+            self._requests_in_flight -= 1
+
     def clear_profiles(self):
         """Limpia los profiles almacenados"""
         self.profiles.clear()
         self.memory_profiles.clear()
+        self.sampler.clear()
+        self.request_profiles.clear()
+
+
+class RequestProfile:
+    """
+    CPU y asignaciones mientras se atiende un request, desde que entra hasta que termina la respuesta.
+    cProfile mide todo el hilo del event loop y tracemalloc todo el proceso: los requests
+    atendidos a la vez (`concurrent_requests` en el reporte) aparecen mezclados con el perfilado.
+    El reporte solo es exclusivo de este request cuando `isolated` es True.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.concurrent_requests = 0
+
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.take_snapshot()
+
+        self._cpu = cProfile.Profile()
+        self._cpu.enable()
+
+    def finish(self, status_code: Optional[int], top: int = 20) -> Dict[str, Any]:
+        self._cpu.disable()
+        duration = time.perf_counter() - self._start
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+        s = io.StringIO()
+        ps = pstats.Stats(self._cpu, stream=s)
+        ps.sort_stats('cumulative')
+        ps.print_stats(top)
+
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "duration": round(duration, 6),
+            "timestamp": self.started_at,
+            "concurrent_requests": self.concurrent_requests,
+            "isolated": self.concurrent_requests == 0,
+            "cpu_profile": s.getvalue(),
+            "peak_memory_bytes": peak,
+            "allocations": [str(stat) for stat in allocations[:top]],
+        }
+
+
+class RequestProfilerMiddleware:
+    """
+    Middleware ASGI: perfila solo los requests con X-Profile firmado y responde con
+    X-Profile-Id (el reporte se consulta en /profiler/requests/{id}). Sin secreto
+    configurado el request sigue sin ningún trabajo extra; con secreto, el resto de
+    requests solo actualiza el contador en curso que marca los reportes no aislados.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: APIProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or self.profiler.profile_secret is None:
+            await self.app(scope, receive, send)
+            return
+
+        self.profiler.request_started()
+        try:
+            await self._dispatch(scope, receive, send)
+        finally:
+            self.profiler.request_finished()
+
+    async def _dispatch(self, scope: Scope, receive: Receive, send: Send):
+        token = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+        if token is None or not self.profiler.verify_profile_token(
+                token.decode("latin-1"), scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        session = self.profiler.begin_request_profile(scope["method"], scope["path"])
+        if session is None:  # Otro request ya se está perfilando: se atiende sin profiling
+            await self.app(scope, receive, send)
+            return
+
+        status_code = None
+
+        async def send_with_profile_id(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = session.profile_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.profiler.end_request_profile(session, status_code)
 
 # Decorador específico para memoria
 def memory_profile_async(profiler: APIProfiler):
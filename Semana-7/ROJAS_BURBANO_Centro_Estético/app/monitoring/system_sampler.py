@@ -0,0 +1,131 @@
+# monitoring/system_sampler.py
+import asyncio
+import gc
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import psutil
+
+
+class GCPauseTracker:
+    """Mide las pausas del recolector de basura vía gc.callbacks (acumuladas hasta el siguiente take)"""
+
+    def __init__(self):
+        self._started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.collections = 0
+        self.total_pause = 0.0
+        self.max_pause = 0.0
+
+    def _callback(self, phase: str, info: Dict):
+        if phase == "start":
+            self._started_at = time.perf_counter()
+        elif self._started_at is not None:
+            pause = time.perf_counter() - self._started_at
+            self._started_at = None
+            with self._lock:
+                self.collections += 1
+                self.total_pause += pause
+                self.max_pause = max(self.max_pause, pause)
+
+    def install(self):
+        if self._callback not in gc.callbacks:
+            gc.callbacks.append(self._callback)
+
+    def uninstall(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+    def take(self) -> Dict[str, float]:
+        """Estadísticas desde la última llamada"""
+        with self._lock:
+            stats = {
+                "gc_collections": self.collections,
+                "gc_pause_total_seconds": self.total_pause,
+                "gc_pause_max_seconds": self.max_pause,
+            }
+            self._reset()
+        return stats
+
+
+class SystemMetricsSampler:
+    """
+    Muestrea métricas del proceso en un hilo propio, sin tocar el event loop:
+    RSS, CPU, descriptores abiertos, disco, pausas del GC y el retraso del loop
+    (tiempo que tarda en ejecutarse un callback programado desde este hilo).
+    """
+
+    def __init__(self, metrics, interval: Optional[float] = None, lag_timeout: float = 5.0):
+        self.metrics = metrics
+        self.interval = interval if interval is not None else float(os.getenv("SYSTEM_METRICS_INTERVAL", 15))
+        self.lag_timeout = lag_timeout
+        self.process = psutil.Process()
+        self.gc_tracker = GCPauseTracker()
+        self.last_sample: Dict[str, Optional[float]] = {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Arranca el hilo; `loop` es el event loop cuyo retraso se mide"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = loop
+        self._stop.clear()
+        self.process.cpu_percent(None)  # Primera lectura: referencia para el porcentaje
+        self.gc_tracker.install()
+        self._thread = threading.Thread(target=self._run, name="system-metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self.gc_tracker.uninstall()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error muestreando métricas del sistema: {e!r}")
+            self._stop.wait(self.interval)
+
+    def sample(self) -> Dict[str, Optional[float]]:
+        """Toma una muestra y actualiza los gauges de APIMetrics"""
+        with self.process.oneshot():
+            cpu_times = self.process.cpu_times()
+            sample = {
+                "cpu_usage": self.process.cpu_percent(None),
+                "cpu_seconds": cpu_times.user + cpu_times.system,
+                "memory_usage": self.process.memory_info().rss,
+                "open_fds": self.process.num_fds() if hasattr(self.process, "num_fds") else None,
+            }
+        sample["disk_usage"] = psutil.disk_usage("/").percent
+        sample["event_loop_lag"] = self.measure_loop_lag()
+        sample.update(self.gc_tracker.take())
+
+        self.metrics.update_system_metrics(sample)
+        self.last_sample = sample
+        return sample
+
+    def measure_loop_lag(self) -> Optional[float]:
+        """Segundos entre programar un callback en el loop y que se ejecute (acotado a lag_timeout)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return None
+        executed = threading.Event()
+        scheduled_at = time.perf_counter()
+        try:
+            loop.call_soon_threadsafe(executed.set)
+        except RuntimeError:  # Loop cerrado entre la comprobación y la llamada
+            return None
+        executed.wait(self.lag_timeout)
+        return time.perf_counter() - scheduled_at
@@ -8,9 +8,9 @@ router = APIRouter(prefix="/spa/monitoring", tags=["Centro Estético Monitoring"
 async def get_rate_limit_stats():
     """Obtiene estadísticas de rate limiting para reservas y tratamientos"""
     redis_client = redis.Redis(host='localhost', port=6379, db=0)
-    keys = redis_client.keys("spa_:rate_limit:*")
     stats = {}
-    for key in keys:
+    # SCAN incremental en lugar de KEYS para no bloquear Redis
+    for key in redis_client.scan_iter(match="spa_:rate_limit:*", count=500):
         key_str = key.decode() if isinstance(key, bytes) else key
         parts = key_str.split(":")
         if len(parts) >= 4:
@@ -0,0 +1,134 @@
+# app/services/accion_log_writer.py
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+_STOP = object()
+
+
+class BufferedAppendWriter:
+    """
+    Escritor de larga vida para logs de acciones: quien escribe solo encola la línea.
+    Un hilo dedicado agrupa las líneas y las escribe en un único descriptor abierto,
+    con flush al acumular `flush_bytes` o cada `flush_interval` segundos, y rota el
+    archivo por tamaño (`max_bytes`) o antigüedad (`rotate_interval`).
+    """
+
+    def __init__(self, path: str, flush_bytes: int = 64 * 1024, flush_interval: float = 1.0,
+                 max_bytes: int = 10 * 1024 * 1024, rotate_interval: Optional[float] = None,
+                 backup_count: int = 5, queue_size: int = 10000):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._opened_at = 0.0
+
+        self.written_lines = 0
+        self.dropped_lines = 0
+        self.rotations = 0
+
+    def start(self):
+        """Arranca el hilo escritor (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="accion-log-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, line: str) -> bool:
+        """Encola una línea sin tocar el disco; False si el buffer está lleno y se descarta"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped_lines += 1
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        """Vacía lo pendiente, hace flush y cierra el archivo"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        buffer = []
+        buffered_bytes = 0
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(buffer)
+                self._close()
+                return
+            if item is not None:
+                buffer.append(item)
+                buffered_bytes += len(item)
+
+            if buffered_bytes >= self.flush_bytes or time.monotonic() >= next_flush:
+                self._flush(buffer)
+                buffer, buffered_bytes = [], 0
+                next_flush = time.monotonic() + self.flush_interval
+
+    def _flush(self, buffer):
+        if not buffer:
+            return
+        data = "".join(buffer)
+        try:
+            if self._file is None:
+                self._open()
+            elif self._should_rotate(len(data)):
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self.written_lines += len(buffer)
+        except OSError as e:
+            print(f"Error escribiendo {self.path}: {e!r}")
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self.max_bytes and self._file.tell() + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        """Rota como RotatingFileHandler: path -> path.1 -> path.2 ... hasta backup_count"""
+        self._close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            open(self.path, "w").close()
+        self.rotations += 1
+        self._open()
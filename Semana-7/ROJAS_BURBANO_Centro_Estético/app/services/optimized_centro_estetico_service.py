@@ -2,12 +2,21 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.database.optimized_queries import DomainOptimizedQueries
+from app.cache.redis_config import async_cache_manager, NOT_FOUND
 from typing import List, Dict, Any, Optional
 
+# Entidad cuyos datos críticos consulta cada dominio (da nombre al tag de invalidación)
+CRITICAL_ENTITIES = {
+    "vet_": "mascota",
+    "edu_": "estudiante",
+    "spa_": "tratamiento",
+}
+
 class OptimizedDomainService:
-    def __init__(self, db: Session, domain_prefix: str):
+    def __init__(self, db: Session, domain_prefix: str, entity_type: Optional[str] = None):
         self.db = db
         self.domain_prefix = domain_prefix
+        self.entity_type = entity_type or CRITICAL_ENTITIES.get(domain_prefix, domain_prefix.rstrip("_"))
         self.queries = DomainOptimizedQueries.get_queries_for_domain(domain_prefix)
 
     async def execute_optimized_query(self, query_name: str, params: Dict[str, Any]) -> List[Dict]:
@@ -21,6 +30,33 @@ class OptimizedDomainService:
 
     # Métodos específicos por dominio - personaliza según tu contexto
     async def get_critical_data(self, entity_id: int, **filters) -> List[Dict]:
+        """
+        Obtiene datos críticos con cache-aside, bajo el tag de la entidad del dominio.
+        Una entidad existente sin filas se cachea como lista vacía; solo los IDs que no
+        existen se guardan como entrada negativa (TTL corto) para no repetir la consulta.
+        """
+        cache_key = f"{self.domain_prefix}critico:{entity_id}:{filters.get('limit', 10)}"
+        cached = await async_cache_manager.get_cache(cache_key, 'frequent_data')
+        if cached is NOT_FOUND:
+            return []
+        if cached is not None:
+            return cached
+
+        data = await self._query_critical_data(entity_id, **filters)
+        entity_tags = [async_cache_manager.entity_tag(self.entity_type, entity_id)]
+        if data or await self._entity_exists(entity_id):
+            await async_cache_manager.set_cache(cache_key, data, 'frequent_data', entity_tags)
+        else:
+            await async_cache_manager.set_not_found(cache_key, entity_tags)
+        return data
+
+    async def _entity_exists(self, entity_id: int) -> bool:
+        """Indica si la entidad existe aunque no tenga datos críticos (habilita el negative caching)"""
+        # Implementa la consulta de existencia de tu dominio; sin ella no se puede afirmar
+        # que el ID no exista y una lista vacía se cachea como resultado normal
+        return True
+
+    async def _query_critical_data(self, entity_id: int, **filters) -> List[Dict]:
         """Obtiene datos críticos específicos de tu dominio"""
         # Implementa la lógica específica de tu dominio
         # Ejemplo genérico:
@@ -1,7 +1,31 @@
 # tests/test_cache_domain.py
 import pytest
+import asyncio
+import gc
+import json
+import threading
+import time
+import weakref
+import httpx
+import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+from datetime import datetime
+from pydantic import BaseModel
+from prometheus_client import CollectorRegistry
 # tests/test_cache_centro_estetico.py
-from app.cache.redis_config import cache_manager
+from app.cache.redis_config import (
+    cache_manager, async_cache_manager, local_cache, NOT_FOUND, AsyncDomainCacheConfig, DomainCacheConfig
+)
+from app.cache.local_cache import LocalLRUCache
+from app.cache.l1_invalidation import L1InvalidationListener
+from app.cache.metrics import CacheMetrics
+from app.cache import cache_decorators
+from app.cache.cache_decorators import cache_result, _build_cache_key
+from app.cache.centro_estetico_strategies import DomainSpecificCaching, endpoint_cache_key
+from app.services.optimized_centro_estetico_service import OptimizedDomainService
+from app.main import app
+from app.cache.serializers import CacheCodec, CacheSerializer, JsonSerializer, COMPRESSION_NONE, COMPRESSION_ZLIB
 
 
 class TestCentroEsteticoCache:
@@ -41,3 +65,644 @@ class TestCentroEsteticoCache:
         cached_catalog = cache_manager.get_cache(catalog_key)
         assert cached_catalog == catalog_data
         cache_manager.invalidate_cache(catalog_key)
+
+class TestCentroEsteticoAsyncCache:
+    @pytest.mark.asyncio
+    async def test_async_cache_tratamientos_frecuentes(self):
+        """Verifica el backend asíncrono (misma API get/set/invalidate)"""
+        test_key = "tratamientos_frecuentes_async"
+        test_data = [{"id": 3, "nombre": "Hidratación Profunda"}]
+        assert await async_cache_manager.set_cache(test_key, test_data, 'frequent_data')
+        assert await async_cache_manager.get_cache(test_key) == test_data
+        await async_cache_manager.invalidate_cache(test_key)
+        assert await async_cache_manager.get_cache(test_key) is None
+
+    def test_un_pool_por_event_loop_sin_fugas(self):
+        """Cambiar de event loop no acumula clientes: se sueltan los de loops cerrados y close() libera el actual"""
+        manager = AsyncDomainCacheConfig(domain_prefix="spa_test_loops", local_cache=LocalLRUCache())
+        clientes = []
+
+        async def leer():
+            assert await manager.get_cache("tratamiento:1") is None
+            assert manager.redis_client is manager.redis_client  # Mismo cliente dentro del loop
+            clientes.append(weakref.ref(manager.redis_client))
+
+        # Dos loops vivos alternándose (p. ej. hilos distintos) reutilizan cada uno su cliente
+        loop_a, loop_b = asyncio.new_event_loop(), asyncio.new_event_loop()
+        try:
+            for loop in (loop_a, loop_b, loop_a, loop_b):
+                loop.run_until_complete(leer())
+            assert clientes[0]() is clientes[2]() and clientes[1]() is clientes[3]()
+            assert clientes[0]() is not clientes[1]()
+            for loop in (loop_a, loop_b):
+                loop.run_until_complete(manager.close())
+        finally:
+            loop_a.close()
+            loop_b.close()
+        del clientes[:]
+
+        for _ in range(3):
+            asyncio.run(leer())
+        gc.collect()
+        assert [ref() for ref in clientes[:-1]] == [None, None]
+        assert len(manager._clients) <= 1
+
+        async def leer_y_cerrar():
+            await leer()
+            await manager.close()
+        asyncio.run(leer_y_cerrar())
+        assert len(manager._clients) == 0
+
+
+class TestCentroEsteticoLocalCache:
+    def test_l1_lru_evicta_menos_usado(self):
+        """El L1 respeta el tamaño máximo expulsando la entrada menos usada"""
+        l1 = LocalLRUCache(max_entries=2)
+        l1.set("spa_:data:a", 1, ttl=60)
+        l1.set("spa_:data:b", 2, ttl=60)
+        assert l1.get("spa_:data:a") == 1  # 'a' pasa a ser la más reciente
+        l1.set("spa_:data:c", 3, ttl=60)
+        assert l1.get("spa_:data:b", None) is None
+        assert l1.get("spa_:data:a") == 1
+        assert l1.evictions == 1
+
+    def test_l1_ttl_por_entrada(self):
+        """Las entradas del L1 expiran según su propio TTL"""
+        l1 = LocalLRUCache()
+        l1.set("spa_:data:horarios", "9-18", ttl=0.01)
+        time.sleep(0.02)
+        assert l1.get("spa_:data:horarios", None) is None
+
+    def test_reference_data_servida_desde_l1(self):
+        """Los datos de referencia se sirven desde el proceso aunque Redis ya no los tenga"""
+        key = "referencia:tipos_de_piel"
+        data = ["Normal", "Grasa", "Mixta", "Seca"]
+        assert cache_manager.set_cache(key, data, 'reference_data')
+        cache_manager.redis_client.delete(cache_manager.get_cache_key("data", key))
+        hits_before = cache_manager.local_cache.hits
+        assert cache_manager.get_cache(key) == data
+        assert cache_manager.local_cache.hits == hits_before + 1
+        cache_manager.invalidate_cache(key)
+
+    @pytest.mark.asyncio
+    async def test_invalidacion_limpia_l1(self):
+        """La invalidación por patrón (la que usa on_configuration_change) limpia también el L1"""
+        key = "config:horarios"
+        assert cache_manager.set_cache(key, "Lunes a Viernes", 'stable_data')
+        cache_manager.invalidate_cache("*config*")
+        assert cache_manager.get_cache(key) is None
+        assert await async_cache_manager.get_cache(key) is None
+
+
+class TestCentroEsteticoCacheDecorator:
+    @pytest.mark.asyncio
+    async def test_decorador_async_cachea_resultado(self):
+        """En funciones async se cachea el resultado, no la corrutina"""
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_decorador')
+        async def get_catalogo():
+            return {"servicios": ["Masaje Relajante"]}
+
+        await async_cache_manager.invalidate_cache("spa_test_decorador:*")
+        assert await get_catalogo() == {"servicios": ["Masaje Relajante"]}
+        assert await get_catalogo() == {"servicios": ["Masaje Relajante"]}
+        await async_cache_manager.invalidate_cache("spa_test_decorador:*")
+
+    @pytest.mark.asyncio
+    async def test_single_flight_agrupa_misses_concurrentes(self):
+        """N misses concurrentes de la misma clave producen una sola consulta"""
+        llamadas = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_single_flight')
+        async def get_catalogo():
+            nonlocal llamadas
+            llamadas += 1
+            await asyncio.sleep(0.05)
+            return ["Peeling Químico", "Láser Diodo"]
+
+        await async_cache_manager.invalidate_cache("spa_test_single_flight:*")
+        resultados = await asyncio.gather(*[get_catalogo() for _ in range(10)])
+        assert llamadas == 1
+        assert all(r == ["Peeling Químico", "Láser Diodo"] for r in resultados)
+        await async_cache_manager.invalidate_cache("spa_test_single_flight:*")
+
+    @pytest.mark.asyncio
+    async def test_single_flight_lider_cancelado_reelige(self):
+        """Si el líder se cancela (cliente desconectado) los seguidores no se cancelan: otro recalcula"""
+        llamadas = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_single_flight_cancel')
+        async def get_catalogo():
+            nonlocal llamadas
+            llamadas += 1
+            await asyncio.sleep(0.1)
+            return ["Limpieza Facial"]
+
+        await async_cache_manager.invalidate_cache("spa_test_single_flight_cancel:*")
+        lider = asyncio.create_task(get_catalogo())
+        while llamadas == 0:  # Espera a que el líder esté calculando
+            await asyncio.sleep(0.005)
+        seguidores = [asyncio.create_task(get_catalogo()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        lider.cancel()
+
+        assert await asyncio.gather(*seguidores) == [["Limpieza Facial"]] * 3
+        assert lider.cancelled()
+        assert llamadas == 2
+        await async_cache_manager.invalidate_cache("spa_test_single_flight_cancel:*")
+
+    @pytest.mark.asyncio
+    async def test_invalidar_no_devuelve_el_resultado_anterior(self):
+        """Tras invalidar, la siguiente lectura recalcula aunque el líder anterior siga en su periodo de gracia"""
+        version = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_sf_invalidar', tags=["sf_invalidar"])
+        async def get_precio():
+            nonlocal version
+            version += 1
+            return {"v": version}
+
+        await async_cache_manager.invalidate_tag("sf_invalidar")
+        assert await get_precio() == {"v": 1}
+        await async_cache_manager.invalidate_tag("sf_invalidar")
+        assert await get_precio() == {"v": 2}
+        await async_cache_manager.invalidate_tag("sf_invalidar")
+
+    def test_invalidar_no_devuelve_el_resultado_anterior_sincrono(self):
+        """Lo mismo en funciones síncronas"""
+        version = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_sf_invalidar_sync', tags=["sf_invalidar_sync"])
+        def get_precio():
+            nonlocal version
+            version += 1
+            return {"v": version}
+
+        cache_manager.invalidate_tag("sf_invalidar_sync")
+        assert get_precio() == {"v": 1}
+        cache_manager.invalidate_tag("sf_invalidar_sync")
+        assert get_precio() == {"v": 2}
+        cache_manager.invalidate_tag("sf_invalidar_sync")
+
+    def test_seguidor_sincrono_no_espera_a_un_lider_colgado(self, monkeypatch):
+        """Si el líder no termina a tiempo, el seguidor calcula el valor por su cuenta"""
+        monkeypatch.setattr(cache_decorators, "SINGLE_FLIGHT_WAIT_SECONDS", 0.1)
+        liberar = threading.Event()
+        llamadas = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_sf_colgado')
+        def get_catalogo():
+            nonlocal llamadas
+            llamadas += 1
+            if llamadas == 1:
+                liberar.wait(5)  # El primer líder queda colgado
+            return ["Masaje Relax"]
+
+        cache_manager.invalidate_cache("spa_test_sf_colgado:*")
+        lider = threading.Thread(target=get_catalogo)
+        lider.start()
+        while llamadas == 0:
+            time.sleep(0.005)
+        try:
+            inicio = time.monotonic()
+            assert get_catalogo() == ["Masaje Relax"]
+            assert time.monotonic() - inicio < 2
+            assert llamadas == 2
+        finally:
+            liberar.set()
+            lider.join()
+            cache_manager.invalidate_cache("spa_test_sf_colgado:*")
+
+    def test_single_flight_sincrono_sin_l1(self):
+        """En funciones síncronas con temp_data (sin L1) los misses concurrentes también se agrupan"""
+        llamadas = 0
+
+        @cache_result(ttl_type='temp_data', key_prefix='spa_test_single_flight_sync')
+        def get_catalogo():
+            nonlocal llamadas
+            llamadas += 1
+            time.sleep(0.05)
+            return ["Depilación Láser"]
+
+        cache_manager.invalidate_cache("spa_test_single_flight_sync:*")
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(get_catalogo())) for _ in range(10)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert llamadas == 1
+        assert resultados == [["Depilación Láser"]] * 10
+        cache_manager.invalidate_cache("spa_test_single_flight_sync:*")
+
+
+class TestCentroEsteticoCacheInvalidation:
+    def test_invalidacion_por_tag_de_entidad(self):
+        """invalidate_tag borra exactamente las claves registradas en el tag"""
+        tag = cache_manager.entity_tag("tratamiento", 42)
+        cache_manager.set_cache("tratamiento:42:detalle", {"id": 42}, 'stable_data', tags=[tag])
+        cache_manager.set_cache("tratamiento:42:precio", 120, 'stable_data', tags=[tag])
+        cache_manager.set_cache("tratamiento:43:detalle", {"id": 43}, 'stable_data')
+
+        assert cache_manager.invalidate_tag(tag) == 2
+        assert cache_manager.get_cache("tratamiento:42:detalle") is None
+        assert cache_manager.get_cache("tratamiento:42:precio") is None
+        assert cache_manager.get_cache("tratamiento:43:detalle") == {"id": 43}
+        cache_manager.invalidate_cache("tratamiento:43:*")
+
+    @pytest.mark.asyncio
+    async def test_tags_automaticos_config_y_catalogo(self):
+        """Las claves de configuración y catálogo quedan etiquetadas sin pasar tags"""
+        await async_cache_manager.set_cache("spa_config:horarios", "9-18", 'stable_data')
+        await async_cache_manager.set_cache("spa_catalogo:equipos", ["Láser Diodo"], 'reference_data')
+
+        assert await async_cache_manager.invalidate_tag("config") >= 1
+        assert await async_cache_manager.get_cache("spa_config:horarios") is None
+        assert await async_cache_manager.get_cache("spa_catalogo:equipos") == ["Láser Diodo"]
+        assert await async_cache_manager.invalidate_tag("catalog") >= 1
+
+    def test_invalidacion_por_patron_usa_scan(self):
+        """El fallback por patrón recorre el keyspace con SCAN en lotes"""
+        cache_manager.scan_batch_size = 3
+        try:
+            for i in range(7):
+                cache_manager.set_cache(f"promo:{i}", i, 'temp_data')
+            assert cache_manager.invalidate_cache("promo:*") == 7
+            assert cache_manager.get_cache("promo:0") is None
+        finally:
+            cache_manager.scan_batch_size = 500
+
+
+    @pytest.mark.asyncio
+    async def test_invalidacion_llega_al_l1_de_otro_worker(self):
+        """Otro worker (su propio L1 + listener) descarta lo invalidado por tag o por patrón"""
+        otro_l1 = LocalLRUCache()
+        listener = L1InvalidationListener(cache_manager.redis_client, otro_l1, cache_manager.invalidation_channel)
+        listener.start()
+        try:
+            assert listener.subscribed.wait(2)
+            tag = async_cache_manager.entity_tag("tratamiento", 51)
+            await async_cache_manager.set_cache("tratamiento:51:detalle", {"id": 51}, 'reference_data', tags=[tag])
+            detalle_key = async_cache_manager.get_cache_key("data", "tratamiento:51:detalle")
+            precio_key = async_cache_manager.get_cache_key("data", "promo_l1:51")
+            otro_l1.set(detalle_key, {"id": 51}, 600)
+            otro_l1.set(precio_key, 90, 600)
+
+            await async_cache_manager.invalidate_tag(tag)
+            cache_manager.invalidate_cache("promo_l1:*")
+            inicio = time.monotonic()
+            while len(otro_l1) and time.monotonic() - inicio < 2:
+                await asyncio.sleep(0.02)
+            assert otro_l1.peek(detalle_key) is None
+            assert otro_l1.peek(precio_key) is None
+            assert listener.received == 2
+        finally:
+            await asyncio.to_thread(listener.stop)
+
+    def test_mensaje_invalido_no_detiene_el_listener(self, caplog):
+        """Un mensaje que no se puede aplicar se registra, vacía el L1 y la suscripción sigue activa"""
+        otro_l1 = LocalLRUCache()
+        listener = L1InvalidationListener(cache_manager.redis_client, otro_l1, cache_manager.invalidation_channel)
+        listener.start()
+        try:
+            assert listener.subscribed.wait(2)
+            otro_l1.set("spa_:data:tratamiento:52", {"id": 52}, 600)
+            with caplog.at_level("ERROR", logger="cache"):
+                cache_manager.redis_client.publish(cache_manager.invalidation_channel, b"keys:\xff\xfe")
+                inicio = time.monotonic()
+                while len(otro_l1) and time.monotonic() - inicio < 2:
+                    time.sleep(0.02)
+            assert "Mensaje de invalidación L1 inválido" in caplog.text
+            assert len(otro_l1) == 0
+
+            otro_l1.set("spa_:data:tratamiento:53", {"id": 53}, 600)
+            cache_manager.redis_client.publish(cache_manager.invalidation_channel, b"keys:spa_:data:tratamiento:53")
+            inicio = time.monotonic()
+            while len(otro_l1) and time.monotonic() - inicio < 2:
+                time.sleep(0.02)
+            assert otro_l1.peek("spa_:data:tratamiento:53") is None
+            assert listener.received == 2
+            assert listener.subscribed.is_set()
+        finally:
+            listener.stop()
+
+
+class TestCentroEsteticoStaleWhileRevalidate:
+    @pytest.mark.asyncio
+    async def test_valor_stale_se_sirve_y_refresca_en_segundo_plano(self):
+        """Pasado el TTL soft se devuelve el valor anterior y se recalcula una sola vez"""
+        version = 0
+
+        @cache_result(ttl_type='frequent_data', key_prefix='spa_test_swr')
+        async def get_tratamientos_frecuentes():
+            nonlocal version
+            version += 1
+            await asyncio.sleep(0.01)
+            return {"version": version}
+
+        await async_cache_manager.invalidate_cache("spa_test_swr:*")
+        assert await get_tratamientos_frecuentes() == {"version": 1}
+
+        # Simula que la clave entró en la ventana stale (PTTL menor que stale_ttl)
+        cache_key = _build_cache_key('spa_test_swr', 'get_tratamientos_frecuentes', (), {})
+        redis_key = async_cache_manager.get_cache_key("data", cache_key)
+        local_cache.delete(redis_key)
+        await async_cache_manager.redis_client.pexpire(redis_key, 10_000)
+
+        respuestas = await asyncio.gather(*[get_tratamientos_frecuentes() for _ in range(5)])
+        assert {"version": 1} in respuestas  # Nadie espera al recálculo
+        assert all(r in ({"version": 1}, {"version": 2}) for r in respuestas)
+        await asyncio.sleep(0.1)
+        assert version == 2
+        assert await get_tratamientos_frecuentes() == {"version": 2}
+        await async_cache_manager.invalidate_cache("spa_test_swr:*")
+
+    @pytest.mark.asyncio
+    async def test_lectores_simples_no_devuelven_valores_stale(self):
+        """get_cache y get_many tratan la ventana stale como miss; solo get_cache_with_state la expone"""
+        await async_cache_manager.set_cache("swr:tipos_de_piel", ["Grasa"], 'frequent_data')
+        redis_key = async_cache_manager.get_cache_key("data", "swr:tipos_de_piel")
+        await async_cache_manager.redis_client.pexpire(redis_key, 10_000)  # Dentro de los 60 s stale
+        try:
+            local_cache.clear()
+            assert await async_cache_manager.get_cache("swr:tipos_de_piel") is None
+            assert cache_manager.get_cache("swr:tipos_de_piel", 'frequent_data') is None
+            assert (await async_cache_manager.get_many(["swr:tipos_de_piel"]))[1] == ["swr:tipos_de_piel"]
+            assert cache_manager.get_many(["swr:tipos_de_piel"]) == ({}, ["swr:tipos_de_piel"])
+            assert local_cache.peek(redis_key) is None
+            assert await async_cache_manager.get_cache_with_state("swr:tipos_de_piel") == (["Grasa"], True)
+            # Con un ttl_type sin ventana stale el mismo PTTL sigue vigente
+            assert cache_manager.get_cache("swr:tipos_de_piel", 'temp_data') == ["Grasa"]
+        finally:
+            await async_cache_manager.invalidate_cache("swr:*")
+
+
+class TestCentroEsteticoCacheSerializers:
+    def test_codec_soporta_datetime_y_pydantic(self):
+        """Los valores con datetime o modelos Pydantic se serializan sin error"""
+        class Reserva(BaseModel):
+            cliente_id: int
+            fecha: datetime
+
+        codec = CacheCodec(serializer=JsonSerializer())
+        reserva = Reserva(cliente_id=1, fecha=datetime(2025, 9, 25, 10, 0))
+        decoded = codec.decode(codec.encode({"reserva": reserva, "creada": datetime(2025, 9, 1)}))
+        assert decoded == {
+            "reserva": {"cliente_id": 1, "fecha": "2025-09-25T10:00:00"},
+            "creada": "2025-09-01T00:00:00",
+        }
+
+    def test_compresion_por_encima_del_umbral(self):
+        """Los payloads grandes se comprimen y se marcan en la cabecera"""
+        codec = CacheCodec(serializer=JsonSerializer(), compression="zlib", compression_threshold=256)
+        catalogo = [{"id": i, "nombre": "Tratamiento Facial Rejuvenecedor"} for i in range(200)]
+        encoded = codec.encode(catalogo)
+        assert encoded[3] == COMPRESSION_ZLIB
+        assert len(encoded) < len(JsonSerializer().dumps(catalogo))
+        assert codec.decode(encoded) == catalogo
+        assert codec.encode({"id": 1})[3] == COMPRESSION_NONE
+
+    def test_compresion_desconocida_no_rompe_el_arranque(self, caplog):
+        """CACHE_COMPRESSION con un nombre desconocido (p. ej. gzip) avisa por el logger del cache y guarda sin comprimir"""
+        with caplog.at_level("WARNING", logger="cache"):
+            codec = CacheCodec(serializer=JsonSerializer(), compression="gzip", compression_threshold=0)
+        assert "Compresión de cache desconocida 'gzip'" in caplog.text
+        assert codec.compression == COMPRESSION_NONE
+        assert codec.decode(codec.encode({"id": 1})) == {"id": 1}
+
+    def test_serializador_incompleto_no_se_instancia(self):
+        """CacheSerializer es abstracto: una subclase sin dumps/loads falla al crearse"""
+        class SoloDumps(CacheSerializer):
+            def dumps(self, value):
+                return b""
+
+        with pytest.raises(TypeError):
+            SoloDumps()
+
+    def test_entradas_antiguas_siguen_legibles(self):
+        """Un cambio de codec no invalida lo ya guardado (JSON sin cabecera o de otro codec)"""
+        key = "referencia:legacy"
+        redis_key = cache_manager.get_cache_key("data", key)
+        cache_manager.redis_client.set(redis_key, json.dumps(["Normal", "Seca"]), ex=3600)
+        local_cache.delete(redis_key)
+        assert cache_manager.get_cache(key) == ["Normal", "Seca"]
+
+        otro_codec = CacheCodec(serializer=JsonSerializer())
+        cache_manager.redis_client.set(redis_key, otro_codec.encode({"codec": "json"}), ex=3600)
+        local_cache.delete(redis_key)
+        assert cache_manager.get_cache(key) == {"codec": "json"}
+        cache_manager.invalidate_cache(key)
+
+
+class TestCentroEsteticoCacheBatch:
+    def test_get_many_reporta_faltantes(self):
+        """get_many devuelve lo encontrado en un MGET y la lista de claves faltantes"""
+        assert cache_manager.set_many({
+            "pagina:config": {"horario": "9-18"},
+            "pagina:catalogo": ["Masaje Relajante"],
+        }, 'stable_data')
+        local_cache.delete(cache_manager.get_cache_key("data", "pagina:config"))
+
+        found, missing = cache_manager.get_many(["pagina:config", "pagina:catalogo", "pagina:frecuentes"])
+        assert found == {"pagina:config": {"horario": "9-18"}, "pagina:catalogo": ["Masaje Relajante"]}
+        assert missing == ["pagina:frecuentes"]
+        cache_manager.invalidate_cache("pagina:*")
+
+    @pytest.mark.asyncio
+    async def test_estrategia_tipo_a_omite_endpoints_sin_loader(self):
+        """Si el router de los endpoints no se puede importar sus claves se omiten, sin datos inventados"""
+        keys = [endpoint_cache_key(key_prefix, endpoint.rpartition(":")[2])
+                for endpoint, key_prefix, _ in DomainSpecificCaching.endpoint_hot_keys["spa_tratamientos"]]
+        await async_cache_manager.invalidate_cache("spa_config:*")
+        report = await DomainSpecificCaching.implement_domain_cache("spa_tratamientos")
+        assert report["keys_skipped"] == sorted(keys)
+        assert report["keys_loaded"] == 0
+        local_cache.clear()
+        _, missing = await async_cache_manager.get_many(keys)
+        assert endpoint_cache_key('spa_config', 'get_configuracion_dominio') in missing
+
+    @pytest.mark.asyncio
+    async def test_warm_up_precarga_la_clave_del_endpoint(self):
+        """El warm-up ejecuta la consulta del endpoint una vez y el endpoint cacheado encuentra su respuesta"""
+        llamadas = 0
+
+        @cache_result(ttl_type='reference_data', key_prefix='spa_test_catalogo')
+        async def get_catalogo_tratamientos():
+            nonlocal llamadas
+            llamadas += 1
+            return {"tipos_de_piel": ['Normal', 'Grasa', 'Mixta', 'Seca']}
+
+        DomainSpecificCaching.register_endpoint_hot_key(
+            "spa_test_endpoints", get_catalogo_tratamientos, 'spa_test_catalogo', 'reference_data')
+        try:
+            report = await DomainSpecificCaching.warm_up("spa_test_endpoints")
+            assert report["keys_loaded"] == 1
+            assert llamadas == 1
+            local_cache.clear()
+            catalogo = await get_catalogo_tratamientos()
+            assert catalogo["tipos_de_piel"] == ['Normal', 'Grasa', 'Mixta', 'Seca']
+            assert llamadas == 1
+        finally:
+            DomainSpecificCaching.endpoint_hot_keys.pop("spa_test_endpoints", None)
+            await async_cache_manager.invalidate_cache("spa_test_catalogo:*")
+
+    @pytest.mark.asyncio
+    async def test_warm_up_paralelismo_acotado_y_reporte(self):
+        """El warm-up respeta la concurrencia máxima y reporta claves cargadas y duración"""
+        activos = 0
+        max_activos = 0
+
+        def loader(valor):
+            async def _load():
+                nonlocal activos, max_activos
+                activos += 1
+                max_activos = max(max_activos, activos)
+                await asyncio.sleep(0.01)
+                activos -= 1
+                return valor
+            return _load
+
+        async def loader_con_error():
+            raise RuntimeError("BD no disponible")
+
+        for i in range(6):
+            DomainSpecificCaching.register_hot_key("spa_test_warmup", f"warmup:{i}", loader(i), 'stable_data')
+        DomainSpecificCaching.register_hot_key("spa_test_warmup", "warmup:error", loader_con_error)
+        try:
+            report = await DomainSpecificCaching.warm_up("spa_test_warmup", concurrency=2)
+            assert max_activos <= 2
+            assert report["keys_loaded"] == 6
+            assert report["keys_failed"] == ["warmup:error"]
+            assert report["duration_seconds"] > 0
+            assert await async_cache_manager.get_cache("warmup:5") == 5
+        finally:
+            DomainSpecificCaching.hot_keys.pop("spa_test_warmup", None)
+            await async_cache_manager.invalidate_cache("warmup:*")
+
+
+class TestCentroEsteticoCacheMetrics:
+    def test_metricas_reales_de_hits_misses_y_payload(self):
+        """La capa de cache registra hits por capa, misses, latencias y tamaños por ttl_type y prefijo"""
+        registry = CollectorRegistry()
+        metricas = CacheMetrics("spa_test", registry=registry)
+        anteriores = cache_manager.metrics, local_cache.on_evict
+        cache_manager.instrument(metricas)
+        try:
+            assert cache_manager.get_cache("metricas:inexistente", 'stable_data') is None
+            cache_manager.set_cache("metricas:valor", {"precio": 100}, 'stable_data')
+            assert cache_manager.get_cache("metricas:valor", 'stable_data') == {"precio": 100}
+            local_cache.delete(cache_manager.get_cache_key("data", "metricas:valor"))
+            assert cache_manager.get_cache("metricas:valor", 'stable_data') == {"precio": 100}
+
+            labels = {"ttl_type": "stable_data", "prefix": "metricas"}
+            assert registry.get_sample_value("spa_test_cache_misses_total", labels) == 1
+            assert registry.get_sample_value("spa_test_cache_hits_total", {**labels, "layer": "l1"}) == 1
+            assert registry.get_sample_value("spa_test_cache_hits_total", {**labels, "layer": "l2"}) == 1
+            assert registry.get_sample_value(
+                "spa_test_cache_operation_duration_seconds_count",
+                {"operation": "get", "ttl_type": "stable_data"}) == 3
+            assert registry.get_sample_value(
+                "spa_test_cache_payload_bytes_count",
+                {"operation": "set", "ttl_type": "stable_data"}) == 1
+        finally:
+            cache_manager.metrics, local_cache.on_evict = anteriores
+            cache_manager.invalidate_cache("metricas:*")
+
+    def test_errores_etiquetados_por_ttl_type(self):
+        """Los errores de Redis se cuentan por operación, ttl_type y prefijo"""
+        registry = CollectorRegistry()
+        manager = DomainCacheConfig(domain_prefix="spa_test_errores", local_cache=LocalLRUCache())
+        manager.redis_client = redis.Redis(host="127.0.0.1", port=1, socket_connect_timeout=0.05,
+                                           retry=Retry(NoBackoff(), 0))
+        manager.instrument(CacheMetrics("spa_test", registry=registry))
+
+        assert manager.get_cache("metricas:precio", 'stable_data') is None
+        assert not manager.set_cache("metricas:precio", 100, 'reference_data')
+        assert manager.get_many(["metricas:a"], 'temp_data') == ({}, ["metricas:a"])
+        assert registry.get_sample_value(
+            "spa_test_cache_errors_total", {"operation": "get", "ttl_type": "stable_data", "prefix": "metricas"}) == 1
+        assert registry.get_sample_value(
+            "spa_test_cache_errors_total", {"operation": "set", "ttl_type": "reference_data", "prefix": "metricas"}) == 1
+        assert registry.get_sample_value(
+            "spa_test_cache_errors_total", {"operation": "get_many", "ttl_type": "temp_data", "prefix": "none"}) == 1
+
+
+class TestCentroEsteticoNegativeCache:
+    def test_entrada_negativa_con_ttl_corto_y_sobrescribible(self):
+        """Un 'no encontrado' se cachea con negative_ttl y el alta posterior lo reemplaza"""
+        key = "tratamiento:inexistente:99"
+        assert cache_manager.set_not_found(key)
+        ttl = cache_manager.redis_client.ttl(cache_manager.get_cache_key("data", key))
+        assert 0 < ttl <= cache_manager.negative_ttl
+        local_cache.delete(cache_manager.get_cache_key("data", key))
+        assert cache_manager.get_cache(key) is NOT_FOUND
+
+        cache_manager.set_cache(key, {"nombre": "Peeling"}, 'stable_data')
+        assert cache_manager.get_cache(key) == {"nombre": "Peeling"}
+        cache_manager.invalidate_cache(key)
+
+    @pytest.mark.asyncio
+    async def test_decorador_cachea_resultados_none(self):
+        """Con cache_not_found los sondeos repetidos a un ID inexistente no recalculan"""
+        llamadas = 0
+
+        @cache_result(ttl_type='frequent_data', key_prefix='spa_test_negativo', cache_not_found=True)
+        async def buscar_tratamiento(tratamiento_id: int):
+            nonlocal llamadas
+            llamadas += 1
+            return None
+
+        assert await buscar_tratamiento(404) is None
+        local_cache.clear()
+        assert await buscar_tratamiento(404) is None
+        assert llamadas == 1
+        await async_cache_manager.invalidate_cache("spa_test_negativo:*")
+
+    @pytest.mark.asyncio
+    async def test_servicio_descarta_negativo_al_crear_entidad(self):
+        """get_critical_data guarda el negativo bajo el tag de la entidad; crear la entidad vuelve a consultar"""
+        service = OptimizedDomainService(None, "spa_")
+        consultas = []
+
+        async def consulta(entity_id, **filters):
+            consultas.append(entity_id)
+            return [{"tratamiento_id": entity_id}] if len(consultas) > 1 else []
+
+        async def existe(entity_id):
+            return len(consultas) > 1
+        service._query_critical_data = consulta
+        service._entity_exists = existe
+        await async_cache_manager.invalidate_tag(async_cache_manager.entity_tag("tratamiento", 777))
+
+        assert await service.get_critical_data(777) == []
+        assert await service.get_critical_data(777) == []
+        assert consultas == [777]
+
+        # Alta de la entidad por la API: POST /tratamiento/ invalida su tag (on_entity_create)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.post("/tratamiento/", json={"id": 777, "nombre": "Peeling"})
+        assert response.status_code == 200
+        assert await service.get_critical_data(777) == [{"tratamiento_id": 777}]
+        assert consultas == [777, 777]
+        await async_cache_manager.invalidate_tag(async_cache_manager.entity_tag("tratamiento", 777))
+
+    @pytest.mark.asyncio
+    async def test_servicio_cachea_lista_vacia_de_entidad_existente(self):
+        """Sin filas pero con la entidad existente se cachea [] (no NOT_FOUND), con el tag de la entidad del dominio"""
+        service = OptimizedDomainService(None, "vet_")
+        assert service.entity_type == "mascota"
+        consultas = []
+
+        async def consulta(entity_id, **filters):
+            consultas.append(entity_id)
+            return []
+        service._query_critical_data = consulta
+        tag = async_cache_manager.entity_tag("mascota", 778)
+        await async_cache_manager.invalidate_tag(tag)
+
+        assert await service.get_critical_data(778) == []
+        assert await service.get_critical_data(778) == []
+        assert consultas == [778]
+        assert await async_cache_manager.get_cache("vet_critico:778:10") == []
+        assert await async_cache_manager.invalidate_tag(tag) == 1
+        assert await async_cache_manager.invalidate_tag(async_cache_manager.entity_tag("tratamiento", 778)) == 0
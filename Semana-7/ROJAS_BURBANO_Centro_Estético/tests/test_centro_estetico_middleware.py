@@ -1,9 +1,41 @@
 import pytest
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+import httpx
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from fastapi.responses import JSONResponse
+from app import main as main_module
 from app.main import app
+from app.cache.redis_config import cache_manager, async_cache_manager
+import redis.asyncio as aioredis
+from redis.backoff import NoBackoff
+from redis.asyncio.retry import Retry as AsyncRetry
+from app.middleware.centro_estetico_rate_limiter import (
+    DomainRateLimiter, BaseHTTPDomainRateLimiter, GCRA, FixedWindowCounter, LocalPreCheck, RateLimitAlgorithm
+)
+from app.middleware.centro_estetico_logger import DomainLogger, BaseHTTPDomainLogger, BoundedQueueHandler, LogSampler
+from app.middleware.centro_estetico_validator import DomainValidator, BaseHTTPDomainValidator
+from app.middleware.centro_estetico_route_matcher import DomainRouteMatcher, SCOPE_KEY
+from app.middleware.centro_estetico_schedule import BusinessSchedule
+from app.services.accion_log_writer import BufferedAppendWriter
+from app.monitoring.metrics import APIMetrics, route_template, UNMATCHED_ENDPOINT, OVERFLOW_ENDPOINT
 
 client = TestClient(app)
 
+# Los benchmarks dependen de la carga de la máquina: solo se ejecutan a pedido
+RUN_BENCHMARKS = pytest.mark.skipif(os.getenv("RUN_BENCHMARKS") != "1",
+                                    reason="benchmark: ejecutar con RUN_BENCHMARKS=1")
+
+# Cliente asyncio de Redis del loop en curso (cada test async y cada TestClient tiene el suyo)
+ASYNC_REDIS = lambda: async_cache_manager.redis_client
+
 
 class TestCentroEsteticoMiddleware:
     def test_rate_limiting_reservas(self):
@@ -21,16 +53,645 @@ class TestCentroEsteticoMiddleware:
         response = client.get("/spa/horario-restringido")
         assert response.status_code in [200, 403]
 
-    def test_logging_acciones(self):
-        """Verifica que el logging de acciones relevantes funcione"""
+    def test_logging_acciones(self, tmp_path, monkeypatch):
+        """La acción registrada por /spa/accion-log queda escrita en el log al hacer flush"""
+        writer = BufferedAppendWriter(str(tmp_path / "logs" / "spa_domain.log"), flush_interval=60)
+        monkeypatch.setattr(main_module, "accion_log_writer", writer)
         response = client.post("/spa/accion-log", json={"empleado_id": 1, "accion": "registro_reserva"})
         assert response.status_code == 200
-        import os
-        assert os.path.exists("logs/spa_domain.log")
+        writer.stop()
+        assert (tmp_path / "logs" / "spa_domain.log").read_text(encoding="utf-8") == \
+            "Acción: registro_reserva Empleado: 1\n"
 
     def test_headers_cliente_empleado(self):
         """Verifica validación de headers requeridos para clientes y empleados"""
         response = client.get("/spa/cliente-protegido")
         headers = {"X-Cliente-Token": "token123", "X-Empleado-Token": "token456"}
         response_with_headers = client.get("/spa/cliente-protegido", headers=headers)
-        assert response.status_code == 400 or response_with_headers.status_code == 200
\ No newline at end of file
+        assert response.status_code == 400 or response_with_headers.status_code == 200
+
+
+class TestCentroEsteticoRateLimiter:
+    def _limiter(self, requests: int, window: int = 60) -> DomainRateLimiter:
+        limiter = DomainRateLimiter(None, "spa_", ASYNC_REDIS)
+        limiter.rate_limits = {"general": {"requests": requests, "window": window}}
+        return limiter
+
+    @pytest.mark.asyncio
+    async def test_ventana_deslizante_informa_cupo_y_reset(self):
+        """El script devuelve el cupo restante y el tiempo hasta liberar la ventana"""
+        limiter = self._limiter(2)
+        cache_manager.redis_client.delete("spa_:rate_limit:general:10.0.0.1")
+        config = limiter.rate_limits["general"]
+        resultados = [await limiter._check_rate_limit("10.0.0.1", "general", config) for _ in range(3)]
+        assert [r.allowed for r in resultados] == [True, True, False]
+        assert [r.remaining for r in resultados] == [1, 0, 0]
+        assert 0 < resultados[-1].reset_after <= 60
+        cache_manager.redis_client.delete("spa_:rate_limit:general:10.0.0.1")
+
+    async def _calentar_pool(self):
+        """Abre de a una todas las conexiones del pool: la ráfaga no debe pagar 20 conexiones simultáneas"""
+        pool = ASYNC_REDIS().connection_pool
+        conexiones = [await pool.get_connection() for _ in range(pool.max_connections)]
+        for conexion in conexiones:
+            await pool.release(conexion)
+
+    @pytest.mark.asyncio
+    async def test_ventana_deslizante_atomica_con_concurrencia(self):
+        """Con requests concurrentes nunca se admiten más que el límite"""
+        limiter = self._limiter(10)
+        # Lo que se prueba es la atomicidad, no la latencia: una consulta lenta no debe contar como Redis caído
+        limiter.redis_timeout = 5.0
+        cache_manager.redis_client.delete("spa_:rate_limit:general:10.0.0.2")
+        await self._calentar_pool()
+        config = limiter.rate_limits["general"]
+        resultados = await asyncio.gather(*[
+            limiter._check_rate_limit("10.0.0.2", "general", config) for _ in range(25)
+        ])
+        assert [r.allowed for r in resultados].count(True) == 10
+        cache_manager.redis_client.delete("spa_:rate_limit:general:10.0.0.2")
+
+    def test_respuesta_429_con_cabeceras(self):
+        """Al superar el límite responde 429 con Retry-After (no lanza desde el middleware)"""
+        spa_app = FastAPI()
+        spa_app.add_middleware(DomainRateLimiter, domain_prefix="spa_", redis_client=ASYNC_REDIS)
+
+        @spa_app.get("/spa/tratamientos")
+        async def tratamientos():
+            return {"ok": True}
+
+        cache_manager.redis_client.delete("spa_:rate_limit:general:testclient")
+        with TestClient(spa_app) as limited_client:
+            responses = [limited_client.get("/spa/tratamientos") for _ in range(121)]
+        assert responses[0].headers["X-RateLimit-Remaining"] == "119"
+        assert responses[-1].status_code == 429
+        assert "Retry-After" in responses[-1].headers
+        cache_manager.redis_client.delete("spa_:rate_limit:general:testclient")
+
+    @pytest.mark.asyncio
+    async def test_gcra_rafaga_y_reposicion_con_una_clave(self):
+        """GCRA admite la ráfaga completa, repone un cupo por intervalo y usa una sola clave"""
+        redis_client = cache_manager.redis_client
+        gcra = GCRA(ASYNC_REDIS())
+        config = {"requests": 4, "window": 60}  # Un cupo cada 15 s
+        redis_client.delete("spa_:rate_limit:inventario:10.0.0.3:gcra")
+        now_ms = 1_700_000_000_000
+        resultados = [await gcra.check("spa_:rate_limit:inventario:10.0.0.3", config, now_ms) for _ in range(5)]
+        assert [r.allowed for r in resultados] == [True, True, True, True, False]
+        assert [r.remaining for r in resultados[:4]] == [3, 2, 1, 0]
+        assert resultados[-1].reset_after == 15
+        assert (await gcra.check("spa_:rate_limit:inventario:10.0.0.3", config, now_ms + 15_000)).allowed
+        assert redis_client.type("spa_:rate_limit:inventario:10.0.0.3:gcra") == b"string"
+        redis_client.delete("spa_:rate_limit:inventario:10.0.0.3:gcra")
+
+    @pytest.mark.asyncio
+    async def test_gcra_rechazo_registra_el_lote(self):
+        """Aunque el request actual se rechace, los admitidos en local quedan registrados en el TAT"""
+        redis_client = cache_manager.redis_client
+        gcra = GCRA(ASYNC_REDIS())
+        config = {"requests": 4, "window": 60}
+        clave = "spa_:rate_limit:inventario:10.0.0.5"
+        redis_client.delete(f"{clave}:gcra")
+        now_ms = 1_700_000_000_000
+        assert (await gcra.check(clave, config, now_ms)).allowed
+        rechazo = await gcra.check(clave, config, now_ms, batched=3)
+        assert not rechazo.allowed
+        # Al reponerse un cupo solo cabe uno: los 3 del lote siguen contando
+        assert (await gcra.check(clave, config, now_ms + 15_000)).allowed
+        assert not (await gcra.check(clave, config, now_ms + 15_000)).allowed
+        redis_client.delete(f"{clave}:gcra")
+
+    def test_algoritmo_sin_check_no_se_instancia(self):
+        """Un algoritmo que no implementa check falla al crearlo, no en el primer request"""
+        class SinCheck(RateLimitAlgorithm):
+            name = "sin_check"
+            script = "return 1"
+
+        with pytest.raises(TypeError):
+            SinCheck(None)
+
+    @pytest.mark.asyncio
+    async def test_ventana_fija_por_categoria(self):
+        """Cada categoría usa su algoritmo; la ventana fija reinicia el contador al cambiar de ventana"""
+        limiter = DomainRateLimiter(None, "pharma_", ASYNC_REDIS)
+        assert limiter.rate_limits["inventory"]["algorithm"] == "gcra"
+        assert limiter.rate_limits["admin"]["algorithm"] == "fixed_window"
+
+        ventana_fija = FixedWindowCounter(ASYNC_REDIS())
+        config = {"requests": 2, "window": 60}
+        inicio = 1_700_000_040_000  # Múltiplo de 60 s
+        claves = [f"spa_:rate_limit:admin:10.0.0.4:fw:{inicio // 60_000 + i}" for i in range(2)]
+        cache_manager.redis_client.delete(*claves)
+        resultados = [await ventana_fija.check("spa_:rate_limit:admin:10.0.0.4", config, inicio + i) for i in range(3)]
+        assert [r.allowed for r in resultados] == [True, True, False]
+        assert resultados[-1].reset_after == pytest.approx(60, abs=0.01)
+        assert (await ventana_fija.check("spa_:rate_limit:admin:10.0.0.4", config, inicio + 60_000)).allowed
+        cache_manager.redis_client.delete(*claves)
+
+    @pytest.mark.asyncio
+    async def test_tier_local_evita_round_trips_y_registra_en_lote(self):
+        """Lejos del límite se admite con créditos locales; se informan a Redis en la siguiente consulta"""
+        limiter = DomainRateLimiter(None, "spa_", ASYNC_REDIS,
+                                    local_tier=LocalPreCheck(share=0.5, lease_seconds=60))
+        config = {"requests": 10, "window": 60}
+        key = "spa_:rate_limit:general:10.0.0.5"
+        cache_manager.redis_client.delete(key)
+
+        resultados = [await limiter._check_rate_limit("10.0.0.5", "general", config) for _ in range(5)]
+        assert [r.remaining for r in resultados] == [9, 8, 7, 6, 5]
+        assert cache_manager.redis_client.zcard(key) == 1  # Solo el primero fue a Redis
+
+        resultados = [await limiter._check_rate_limit("10.0.0.5", "general", config) for _ in range(6)]
+        assert cache_manager.redis_client.zcard(key) == 10
+        assert [r.allowed for r in resultados] == [True] * 5 + [False]
+        cache_manager.redis_client.delete(key)
+
+    @pytest.mark.asyncio
+    async def test_breaker_abre_tras_fallos_consecutivos_y_conserva_pendientes(self):
+        """Un error aislado no corta Redis; los admitidos en local que no se registraron se reintentan"""
+        caido = aioredis.Redis(host="127.0.0.1", port=1, socket_connect_timeout=0.05, retry=AsyncRetry(NoBackoff(), 0))
+        limiter = DomainRateLimiter(None, "spa_", ASYNC_REDIS,
+                                    local_tier=LocalPreCheck(share=0.5, lease_seconds=60))
+        limiter.redis_failure_threshold = 3
+        config = {"requests": 10, "window": 60}
+        key = "spa_:rate_limit:general:10.0.0.6"
+        cache_manager.redis_client.delete(key)
+
+        for _ in range(3):  # 1 en Redis + 2 con créditos locales
+            await limiter._check_rate_limit("10.0.0.6", "general", config)
+        limiter.local_tier._leases[key].credits = 0  # El siguiente consulta Redis
+        limiter._redis_source = lambda: caido
+        with pytest.raises(aioredis.ConnectionError):
+            await limiter._check_rate_limit("10.0.0.6", "general", config)
+        assert limiter._redis_down_until == 0.0  # Un solo fallo no abre el circuito
+
+        limiter._redis_source = ASYNC_REDIS
+        resultado = await limiter._check_rate_limit("10.0.0.6", "general", config)
+        assert cache_manager.redis_client.zcard(key) == 4  # Los 2 locales no se perdieron
+        assert resultado.remaining == 6
+        assert limiter._redis_failures == 0
+
+        limiter._redis_source = lambda: caido
+        for _ in range(3):
+            limiter.local_tier._leases.pop(key, None)
+            with pytest.raises(aioredis.ConnectionError):
+                await limiter._check_rate_limit("10.0.0.6", "general", config)
+        assert limiter._redis_down_until > time.monotonic()
+        cache_manager.redis_client.delete(key)
+        await caido.aclose()
+
+    @pytest.mark.asyncio
+    async def test_pendientes_de_clientes_desalojados_o_inactivos_se_registran(self):
+        """Los admitidos en local se registran en Redis aunque la concesión se desaloje o el cliente no vuelva"""
+        limiter = DomainRateLimiter(None, "spa_", ASYNC_REDIS,
+                                    local_tier=LocalPreCheck(share=0.5, lease_seconds=60, max_clients=1))
+        config = {"requests": 10, "window": 60}
+        claves = [f"spa_:rate_limit:general:10.0.0.{i}" for i in (7, 8)]
+        cache_manager.redis_client.delete(*claves)
+
+        for _ in range(3):
+            await limiter._check_rate_limit("10.0.0.7", "general", config)
+        for _ in range(2):
+            await limiter._check_rate_limit("10.0.0.8", "general", config)  # Desaloja la concesión de .7
+        assert cache_manager.redis_client.zcard(claves[0]) == 1
+        assert await limiter.flush_pending() == 2
+        assert cache_manager.redis_client.zcard(claves[0]) == 3
+
+        limiter.local_tier._leases[claves[1]].expires_at = 0  # .8 deja de enviar requests
+        assert await limiter.flush_pending() == 1
+        assert cache_manager.redis_client.zcard(claves[1]) == 2
+        assert limiter.local_tier._leases == {}
+        assert await limiter.flush_pending() == 0
+        cache_manager.redis_client.delete(*claves)
+
+    @pytest.mark.parametrize("fail_open,status_code", [(True, 200), (False, 503)])
+    def test_sin_redis_fail_open_o_closed(self, fail_open, status_code):
+        """Si Redis no responde el middleware no lanza: deja pasar o responde 503 según configuración"""
+        caido = aioredis.Redis(host="127.0.0.1", port=1, socket_connect_timeout=0.05, retry=AsyncRetry(NoBackoff(), 0))
+        spa_app = FastAPI()
+        spa_app.add_middleware(DomainRateLimiter, domain_prefix="spa_", redis_client=caido, fail_open=fail_open)
+
+        @spa_app.get("/spa/tratamientos")
+        async def tratamientos():
+            return {"ok": True}
+
+        with TestClient(spa_app) as limited_client:
+            assert limited_client.get("/spa/tratamientos").status_code == status_code
+            # Durante la ventana de reintento no se vuelve a bloquear intentando conectar
+            assert limited_client.get("/spa/tratamientos").status_code == status_code
+
+
+    def _reservas_limiter(self, requests: int, window: int) -> DomainRateLimiter:
+        """Limiter de spa_ sobre un endpoint de reservas, con cupo pequeño y sin créditos locales"""
+        spa_app = FastAPI()
+
+        @spa_app.post("/spa/reservas")
+        async def crear_reserva():
+            return {"msg": "Reserva creada"}
+
+        limiter = DomainRateLimiter(spa_app, domain_prefix="spa_", redis_client=ASYNC_REDIS,
+                                    local_tier=LocalPreCheck(share=0))
+        limiter.rate_limits["booking"] = {"requests": requests, "window": window, "algorithm": "sliding_window"}
+        return limiter
+
+    @pytest.mark.asyncio
+    async def test_reservas_cupo_por_cliente_y_la_ventana_se_reinicia(self):
+        """Cada cliente tiene su propio cupo en reservas y vuelve a tenerlo al pasar la ventana"""
+        limiter = self._reservas_limiter(requests=3, window=1)
+        claves = [f"spa_:rate_limit:booking:10.0.1.{i}" for i in (1, 2)]
+        cache_manager.redis_client.delete(*claves)
+
+        def cliente(ip):
+            transport = httpx.ASGITransport(app=limiter, client=(ip, 5000))
+            return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+        async with cliente("10.0.1.1") as primero, cliente("10.0.1.2") as segundo:
+            codigos = [(await primero.post("/spa/reservas")).status_code for _ in range(4)]
+            assert codigos == [200, 200, 200, 429]
+            assert (await segundo.post("/spa/reservas")).status_code == 200  # Otro cliente no se ve afectado
+
+            await asyncio.sleep(1.1)
+            assert (await primero.post("/spa/reservas")).status_code == 200
+        cache_manager.redis_client.delete(*claves)
+
+    @pytest.mark.asyncio
+    async def test_reservas_cupo_compartido_entre_workers(self):
+        """Dos instancias (workers) con el mismo Redis comparten el cupo del cliente"""
+        workers = [self._reservas_limiter(requests=4, window=60) for _ in range(2)]
+        key = "spa_:rate_limit:booking:10.0.1.3"
+        cache_manager.redis_client.delete(key)
+        config = workers[0].rate_limits["booking"]
+
+        admitidos = [(await workers[i % 2]._check_rate_limit("10.0.1.3", "booking", config)).allowed
+                     for i in range(6)]
+        assert admitidos == [True] * 4 + [False] * 2
+        cache_manager.redis_client.delete(key)
+
+    def test_reservas_de_la_app_usan_la_categoria_booking(self):
+        """/spa/reservas de la app pasa por DomainRateLimiter con su cupo de reservas"""
+        cache_manager.redis_client.delete("spa_:rate_limit:booking:testclient")
+        response = client.post("/spa/reservas", json={"cliente_id": 1})
+        assert response.status_code == 200
+        assert response.headers["X-RateLimit-Limit"] == "100"
+        cache_manager.redis_client.delete("spa_:rate_limit:booking:testclient")
+
+class TestCentroEsteticoMiddlewareBenchmark:
+    def _stack(self, logger_cls, validator_cls, limiter_cls, requests: int = 1_000_000):
+        """Las tres capas de /spa apiladas sobre un endpoint trivial"""
+        spa_app = FastAPI()
+
+        @spa_app.get("/spa/tratamientos")
+        async def tratamientos():
+            return {"ok": True}
+
+        limiter = limiter_cls(spa_app, domain_prefix="spa_", redis_client=ASYNC_REDIS,
+                              local_tier=LocalPreCheck(share=0.5, lease_seconds=60))
+        getattr(limiter, "limiter", limiter).rate_limits = {
+            "general": {"requests": requests, "window": 60, "algorithm": "gcra"}
+        }
+        return logger_cls(validator_cls(limiter, domain_prefix="spa_"), domain_prefix="spa_")
+
+    async def _requests_per_second(self, app, total: int = 300, rounds: int = 3) -> float:
+        best = 0.0
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(total):
+                    response = await http.get("/spa/tratamientos")
+                    assert response.status_code == 200
+                best = max(best, total / (time.perf_counter() - start))
+        return best
+
+    async def _responses(self, app, paths):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            responses = [await http.get(path) for path in paths]
+        return [(r.status_code, r.text, sorted(r.headers)) for r in responses]
+
+    @pytest.mark.asyncio
+    async def test_pila_asgi_equivale_a_base_http(self):
+        """Las dos pilas responden igual: estado, cuerpo y cabeceras de rate limit, incluido el 429"""
+        paths = ["/spa/tratamientos"] * 3 + ["/spa/no-existe"]
+        resultados = []
+        for clases in [(BaseHTTPDomainLogger, BaseHTTPDomainValidator, BaseHTTPDomainRateLimiter),
+                       (DomainLogger, DomainValidator, DomainRateLimiter)]:
+            cache_manager.redis_client.delete("spa_:rate_limit:general:127.0.0.1:gcra")
+            resultados.append(await self._responses(self._stack(*clases, requests=2), paths))
+        cache_manager.redis_client.delete("spa_:rate_limit:general:127.0.0.1:gcra")
+        assert resultados[0] == resultados[1]
+        assert [estado for estado, _, _ in resultados[1]] == [200, 200, 429, 429]
+
+    @RUN_BENCHMARKS
+    @pytest.mark.asyncio
+    async def test_benchmark_asgi_vs_base_http(self):
+        """Benchmark req/s (solo con RUN_BENCHMARKS=1): la pila ASGI pura frente a BaseHTTPMiddleware"""
+        cache_manager.redis_client.delete("spa_:rate_limit:general:127.0.0.1:gcra")
+        base_http = await self._requests_per_second(
+            self._stack(BaseHTTPDomainLogger, BaseHTTPDomainValidator, BaseHTTPDomainRateLimiter))
+        asgi = await self._requests_per_second(self._stack(DomainLogger, DomainValidator, DomainRateLimiter))
+        cache_manager.redis_client.delete("spa_:rate_limit:general:127.0.0.1:gcra")
+        assert asgi > base_http, f"BaseHTTPMiddleware {base_http:.0f} req/s, ASGI puro {asgi:.0f} req/s"
+
+
+class TestCentroEsteticoEndpointLabels:
+    def test_label_es_la_plantilla_de_ruta(self):
+        """El endpoint se etiqueta con la plantilla de la ruta; los paths sin ruta van a un solo bucket"""
+        spa_app = FastAPI()
+        etiquetas = []
+
+        @spa_app.middleware("http")
+        async def capturar(request, call_next):
+            response = await call_next(request)
+            etiquetas.append(route_template(request.scope))
+            return response
+
+        @spa_app.get("/spa/optimized/tratamiento-critico/{tratamiento_id}")
+        async def tratamiento(tratamiento_id: int):
+            return {"id": tratamiento_id}
+
+        with TestClient(spa_app) as labeled_client:
+            for tratamiento_id in (987, 988):
+                labeled_client.get(f"/spa/optimized/tratamiento-critico/{tratamiento_id}")
+            labeled_client.get("/psych_consultas/123")
+        assert etiquetas == ["/spa/optimized/tratamiento-critico/{tratamiento_id}"] * 2 + [UNMATCHED_ENDPOINT]
+
+    def test_respuesta_cortada_antes_del_router(self):
+        """Un 429 emitido por un middleware (sin pasar por el router) conserva la plantilla de su ruta"""
+        spa_app = FastAPI()
+        etiquetas = []
+
+        @spa_app.middleware("http")
+        async def limitar(request, call_next):
+            if request.headers.get("x-limitar"):
+                return JSONResponse({"error": "Rate limit exceeded"}, status_code=429)
+            return await call_next(request)
+
+        @spa_app.middleware("http")
+        async def capturar(request, call_next):
+            response = await call_next(request)
+            etiquetas.append((route_template(request.scope), response.status_code))
+            return response
+
+        @spa_app.get("/spa/tratamientos/{tratamiento_id}")
+        async def tratamiento(tratamiento_id: int):
+            return {"id": tratamiento_id}
+
+        with TestClient(spa_app) as labeled_client:
+            labeled_client.get("/spa/tratamientos/5", headers={"x-limitar": "1"})
+            labeled_client.get("/spa/no-existe/5", headers={"x-limitar": "1"})
+        assert etiquetas == [("/spa/tratamientos/{tratamiento_id}", 429), (UNMATCHED_ENDPOINT, 429)]
+
+    def test_limite_de_cardinalidad(self):
+        """Con el límite alcanzado los endpoints nuevos se agrupan en __overflow__"""
+        metrics = APIMetrics("test_app", "test_cardinalidad", max_endpoints=2)
+        for endpoint in ["/a", "/b", "/c", "/d", "/a", UNMATCHED_ENDPOINT]:
+            metrics.record_request("GET", endpoint, 200, 0.01)
+
+        endpoints = {sample.labels["endpoint"] for sample in metrics.request_counter.collect()[0].samples}
+        assert endpoints == {"/a", "/b", OVERFLOW_ENDPOINT, UNMATCHED_ENDPOINT}
+        assert metrics.endpoint_overflow._value.get() == 2
+
+    def test_app_registra_la_plantilla(self):
+        """metrics_middleware de la app ya no usa el path crudo"""
+        from app.main import metrics
+        client.get("/spa/no-existe/123")
+        endpoints = {sample.labels["endpoint"] for sample in metrics.request_counter.collect()[0].samples}
+        assert "/spa/no-existe/123" not in endpoints
+        assert UNMATCHED_ENDPOINT in endpoints
+
+class TestCentroEsteticoRouteMatcher:
+    def test_prioridad_y_subcadenas_como_antes(self):
+        """El matcher compilado respeta el orden de prioridad y la búsqueda por subcadena"""
+        vet = DomainRouteMatcher("vet_")
+        assert vet.match("/vet/admin/emergency").category == "emergency"
+        assert vet.match("/vet/consultas/3").category == "consultation"
+        assert vet.match("/vet/mascotas").category == "general"
+        assert vet.match("/vet/historial/emergency").log_level == "CRITICAL"
+        assert "business_hours_exempt" in vet.match("/vet/emergency").validations
+
+        pharma = DomainRouteMatcher("pharma_", rules={
+            "categories": [(("/admin",), "admin"), (("/administracion",), "back_office")],
+            "log_levels": [],
+            "validations": [(("controlled",), "prescription_required")],
+        })
+        # "/admin" es prefijo de "/administracion": ambos cuentan como presentes
+        assert pharma.match("/pharma/administracion").category == "admin"
+        assert pharma.match("/pharma/uncontrolled").validations == {"prescription_required"}
+
+    def test_resultado_compartido_entre_capas(self):
+        """Las capas apiladas reutilizan el resultado guardado en el scope"""
+        matcher = DomainRouteMatcher.for_domain("spa_")
+        assert DomainRouteMatcher.for_domain("spa_") is matcher
+        scope = {"type": "http", "path": "/spa/tratamientos/update"}
+        primero = matcher.match_scope(scope)
+        assert scope[SCOPE_KEY] is primero
+        assert matcher.match_scope(scope) is primero
+        assert primero.log_level == "WARNING"
+        assert primero.category == "general"
+
+
+class TestCentroEsteticoBusinessSchedule:
+    TZ = timezone(timedelta(hours=-5))  # Hora de Ecuador, sin cambio de horario
+
+    def _ts(self, *args) -> float:
+        return datetime(*args, tzinfo=self.TZ).timestamp()
+
+    def test_limites_de_apertura_y_cierre_inclusivo(self):
+        """Abre a la hora de inicio y admite toda la hora de cierre, en la zona del dominio"""
+        horario = BusinessSchedule(8, 20, tz=self.TZ)
+        assert not horario.is_open(self._ts(2025, 9, 24, 7, 59))
+        assert horario.is_open(self._ts(2025, 9, 24, 8, 0))
+        assert horario.is_open(self._ts(2025, 9, 24, 20, 59))
+        assert not horario.is_open(self._ts(2025, 9, 24, 21, 0))
+        # 13:30 UTC son las 8:30 en Ecuador
+        assert horario.is_open(datetime(2025, 9, 25, 13, 30, tzinfo=timezone.utc).timestamp())
+
+    def test_decision_cacheada_hasta_el_proximo_limite(self):
+        """Dentro del mismo tramo no se recalcula la fecha; solo al cruzar apertura/cierre"""
+        horario = BusinessSchedule(8, 20, tz=self.TZ)
+        calculos = []
+        compute = horario._compute
+        horario._compute = lambda now: calculos.append(now) or compute(now)
+
+        for minuto in range(0, 600, 5):  # De 9:00 a 18:55
+            assert horario.is_open(self._ts(2025, 9, 24, 9) + minuto * 60)
+        assert len(calculos) == 1
+        assert horario._state == (True, self._ts(2025, 9, 24, 21))
+
+        assert not horario.is_open(self._ts(2025, 9, 24, 21, 30))
+        assert horario._state == (False, self._ts(2025, 9, 25, 0))
+        assert len(calculos) == 2
+
+    def test_feriados_y_fin_de_semana_cerrados(self):
+        """Feriados y días cerrados no abren en todo el día"""
+        horario = BusinessSchedule(0, 24, tz=self.TZ, holidays=[date(2025, 12, 25)], closed_weekdays=(5, 6))
+        assert not horario.is_open(self._ts(2025, 12, 25, 12))
+        assert horario.is_open(self._ts(2025, 12, 26, 12))   # Viernes
+        assert not horario.is_open(self._ts(2025, 12, 27, 12))  # Sábado
+        assert horario.is_open(self._ts(2025, 12, 29, 0))    # Lunes
+
+    def test_validador_usa_los_horarios_precalculados(self):
+        """DomainValidator consulta los horarios precalculados para horario y fin de semana"""
+        validator = DomainValidator(None, "edu_")
+        sabado = self._ts(2025, 9, 27, 10)
+        validator.business_schedule.clock = lambda: sabado
+        validator.weekday_schedule = BusinessSchedule(tz=self.TZ, closed_weekdays=(5, 6), clock=lambda: sabado)
+
+        reserva = validator.routes.match("/edu/booking")
+        assert validator._validate_domain_specific_rules(None, reserva) == (
+            False, "Reservas no disponibles en fin de semana")
+        validator.business_schedule = BusinessSchedule(6, 22, tz=self.TZ, clock=lambda: self._ts(2025, 9, 27, 23))
+        assert not validator._validate_business_hours(reserva)
+
+class TestCentroEsteticoQueuedLogger:
+    def test_registro_encolado_y_serializado_una_vez(self, tmp_path):
+        """Las líneas se escriben desde el listener; REQUEST_END es el JSON del request más status y tiempo"""
+        log_file = tmp_path / "test_domain.log"
+        spa_app = FastAPI()
+
+        @spa_app.post("/test/tratamientos/create")
+        async def crear():
+            return {"ok": True}
+
+        domain_logger = DomainLogger(spa_app, domain_prefix="test_", log_file=str(log_file),
+                                     sampler=LogSampler(rates={}))
+        with TestClient(domain_logger) as logged_client:
+            assert logged_client.post("/test/tratamientos/create").status_code == 200
+        domain_logger.logger.handlers[0].queue.join()
+
+        lines = log_file.read_text().splitlines()
+        assert "REQUEST_START" in lines[0]
+        end = json.loads(lines[1].split("REQUEST_END: ", 1)[1])
+        assert end["path"] == "/test/tratamientos/create"
+        assert end["status_code"] == 200
+        assert end["process_time"] >= 0
+
+    def test_mismo_logger_con_otro_archivo_falla(self, tmp_path):
+        """Reusar el nombre de un logger con otro log_file se rechaza en vez de ignorar el archivo"""
+        spa_app = FastAPI()
+        primero = DomainLogger(spa_app, domain_prefix="conflicto_", log_file=str(tmp_path / "a.log"))
+        assert DomainLogger(spa_app, domain_prefix="conflicto_", log_file=str(tmp_path / "a.log")).logger is primero.logger
+        with pytest.raises(ValueError):
+            DomainLogger(spa_app, domain_prefix="conflicto_", log_file=str(tmp_path / "b.log"))
+
+    def test_cola_llena_descarta_sin_bloquear(self):
+        """Con la cola llena y política drop se descartan registros y se cuentan"""
+        handler = BoundedQueueHandler(queue.Queue(maxsize=1), full_policy="drop")
+        logger = logging.getLogger("test_cola_llena")
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            for i in range(3):
+                logger.warning(f"registro {i}")
+            assert handler.queue.qsize() == 1
+            assert handler.dropped_records == 2
+        finally:
+            logger.removeHandler(handler)
+
+    def test_muestreo_siempre_errores_y_resumen_de_omitidos(self):
+        """En rutas INFO se muestrea el 2xx, los 4xx/5xx se loggean siempre y lo omitido se resume"""
+        tiradas = iter([0.5, 0.005, 0.5, 0.5])
+        sampler = LogSampler({"INFO": {"2xx": 0.01, "4xx": 1.0, "5xx": 1.0}},
+                             summary_interval=0, rng=lambda: next(tiradas))
+        assert not sampler.head("INFO", 0.0)
+        assert sampler.head("INFO", 0.0)
+        assert sampler.keep("INFO", 500, head_sampled=False)
+        assert not sampler.keep("INFO", 200, head_sampled=False)
+        assert sampler.head("WARNING", 0.0)  # Sin tasa configurada: siempre
+
+        sampler.record_skipped(200, 0.01)
+        sampler.record_skipped(200, 0.03)
+        summary = sampler.take_summary(time.monotonic())
+        assert summary["skipped"] == 2
+        assert summary["by_status"] == {"200": 2}
+        assert summary["avg_process_time"] == 0.02
+        assert sampler.take_summary(time.monotonic()) is None
+
+    def test_omitidos_sin_extraccion_y_resumen_al_apagar(self, tmp_path):
+        """Fuera de la muestra no se extraen datos (salvo que el status obligue a loggear) y el resumen se escribe al apagar"""
+        log_file = tmp_path / "muestreo_domain.log"
+        spa_app = FastAPI()
+
+        @spa_app.get("/muestreo/tratamientos/create/{tratamiento_id}")
+        async def tratamiento(tratamiento_id: int):
+            if tratamiento_id == 0:
+                return JSONResponse({"error": "fallo"}, status_code=500)
+            return {"id": tratamiento_id}
+
+        sampler = LogSampler({"INFO": {"2xx": 0.01, "5xx": 1.0}}, summary_interval=3600, rng=lambda: 1.0)
+        domain_logger = DomainLogger(spa_app, domain_prefix="muestreo_", log_file=str(log_file), sampler=sampler)
+        extracciones = []
+        extraer = domain_logger._extract_domain_specific_data
+        domain_logger._extract_domain_specific_data = lambda request, path: extracciones.append(path) or extraer(request, path)
+
+        with TestClient(domain_logger) as logged_client:
+            for tratamiento_id in (1, 2, 0):
+                logged_client.get(f"/muestreo/tratamientos/create/{tratamiento_id}")
+            assert extracciones == ["/muestreo/tratamientos/create/0"]
+        domain_logger.logger.handlers[0].queue.join()
+
+        lines = log_file.read_text().splitlines()
+        assert "REQUEST_END" in lines[0] and '"status_code": 500' in lines[0]
+        summary = json.loads(lines[1].split("REQUEST_SUMMARY: ", 1)[1])
+        assert summary["skipped"] == 2
+        assert summary["by_status"] == {"200": 2}
+
+    def test_muestreo_adaptativo_baja_la_tasa_con_el_volumen(self):
+        """Con más volumen que el objetivo la tasa efectiva se reduce proporcionalmente"""
+        sampler = LogSampler({"INFO": {"2xx": 0.5}}, adaptive=True, target_per_second=10, rng=lambda: 1.0)
+        inicio = sampler._window_start
+        for i in range(200):  # 200 req/s con tasa 0.5 -> 100 líneas/s esperadas
+            sampler.head("INFO", inicio + i / 200)
+        sampler.head("INFO", inicio + 1.0)
+        assert sampler.scale == pytest.approx(0.1, rel=0.05)
+        assert sampler._rate("INFO", "2xx") == pytest.approx(0.05, rel=0.05)
+        assert sampler._rate("INFO", "5xx") == 1.0
+
+
+class TestCentroEsteticoAccionLogWriter:
+    def test_escritura_por_lotes_y_flush_al_cerrar(self, tmp_path):
+        """Las líneas encoladas se escriben en orden en un único archivo y stop hace flush"""
+        log_file = tmp_path / "acciones.log"
+        writer = BufferedAppendWriter(str(log_file), flush_bytes=1024 * 1024, flush_interval=60)
+        for i in range(100):
+            assert writer.write(f"Acción: reserva_{i} Empleado: 1\n")
+        writer.stop()
+
+        lines = log_file.read_text(encoding="utf-8").splitlines()
+        assert lines == [f"Acción: reserva_{i} Empleado: 1" for i in range(100)]
+        assert writer.written_lines == 100
+
+    def test_flush_por_intervalo(self, tmp_path):
+        """Sin llegar a flush_bytes las líneas se escriben al vencer el intervalo"""
+        log_file = tmp_path / "acciones.log"
+        writer = BufferedAppendWriter(str(log_file), flush_bytes=1024 * 1024, flush_interval=0.05)
+        try:
+            writer.write("Acción: registro Empleado: 7\n")
+            deadline = time.monotonic() + 2
+            while writer.written_lines == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert log_file.read_text(encoding="utf-8") == "Acción: registro Empleado: 7\n"
+        finally:
+            writer.stop()
+
+    def test_rotacion_por_tamano(self, tmp_path):
+        """Al superar max_bytes el archivo rota a .1, .2 ... respetando backup_count"""
+        log_file = tmp_path / "acciones.log"
+        writer = BufferedAppendWriter(str(log_file), flush_bytes=1, max_bytes=100, backup_count=2)
+        for i in range(20):
+            writer.write(f"Acción: linea_{i:02d} Empleado: 1\n")  # 30 bytes por línea
+        writer.stop()
+
+        assert writer.rotations >= 2
+        assert (tmp_path / "acciones.log.1").exists()
+        assert (tmp_path / "acciones.log.2").exists()
+        assert not (tmp_path / "acciones.log.3").exists()
+        assert log_file.stat().st_size <= 100
+        assert log_file.read_text(encoding="utf-8").splitlines()[-1] == "Acción: linea_19 Empleado: 1"
+
+    def test_buffer_lleno_descarta(self, tmp_path):
+        """Con la cola llena write devuelve False sin bloquear y cuenta la línea descartada"""
+        writer = BufferedAppendWriter(str(tmp_path / "acciones.log"), queue_size=1)
+        writer._thread = threading.Thread(target=lambda: None)  # Sin consumidor
+        assert writer.write("uno\n")
+        assert not writer.write("dos\n")
+        assert writer.dropped_lines == 1
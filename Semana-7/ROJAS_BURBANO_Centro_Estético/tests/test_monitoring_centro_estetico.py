@@ -0,0 +1,294 @@
+import pytest
+import asyncio
+import gc
+import threading
+import time
+import tracemalloc
+from collections import Counter
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
+from app.monitoring.system_sampler import GCPauseTracker, SystemMetricsSampler
+from app.monitoring.loop_monitor import EventLoopMonitor
+from app.monitoring.profiler import APIProfiler, RequestProfilerMiddleware, SamplingProfiler
+
+
+class _MetricsFalsas:
+    def __init__(self):
+        self.muestras = []
+
+    def update_system_metrics(self, sample):
+        self.muestras.append(sample)
+
+
+class TestCentroEsteticoSystemSampler:
+    def test_muestra_del_proceso(self):
+        """La muestra trae RSS y CPU del proceso (no del host) y se vuelca en las métricas"""
+        metrics = _MetricsFalsas()
+        sampler = SystemMetricsSampler(metrics, interval=60)
+        sample = sampler.sample()
+        assert metrics.muestras == [sample]
+        assert sample["memory_usage"] > 0
+        assert sample["cpu_seconds"] > 0
+        assert sample["open_fds"] is None or sample["open_fds"] > 0
+        assert sample["event_loop_lag"] is None  # Sin loop asociado
+
+    @pytest.mark.asyncio
+    async def test_hilo_muestrea_sin_bloquear_el_loop(self):
+        """El hilo toma muestras periódicas y mide el retraso del loop en marcha"""
+        metrics = _MetricsFalsas()
+        sampler = SystemMetricsSampler(metrics, interval=0.05)
+        sampler.start(asyncio.get_running_loop())
+        try:
+            inicio = time.monotonic()
+            while len(metrics.muestras) < 2 and time.monotonic() - inicio < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+        assert len(metrics.muestras) >= 2
+        assert all(m["event_loop_lag"] is not None for m in metrics.muestras)
+
+    @pytest.mark.asyncio
+    async def test_retraso_del_loop_bloqueado(self):
+        """Un handler que bloquea el loop se refleja en event_loop_lag"""
+        loop = asyncio.get_running_loop()
+        sampler = SystemMetricsSampler(_MetricsFalsas(), interval=60)
+        sampler._loop = loop
+        medicion = loop.run_in_executor(None, sampler.measure_loop_lag)
+        time.sleep(0.2)  # Bloquea el loop como lo haría una llamada síncrona
+        assert await medicion >= 0.15
+
+    def test_pausas_del_gc(self):
+        """Las recolecciones se cuentan con su pausa y se reinician al leerlas"""
+        tracker = GCPauseTracker()
+        tracker.install()
+        try:
+            gc.collect()
+        finally:
+            tracker.uninstall()
+        stats = tracker.take()
+        assert stats["gc_collections"] >= 1
+        assert stats["gc_pause_max_seconds"] > 0
+        assert stats["gc_pause_total_seconds"] >= stats["gc_pause_max_seconds"]
+        assert tracker.take()["gc_collections"] == 0
+
+
+class TestCentroEsteticoEventLoopMonitor:
+    def _monitor(self) -> EventLoopMonitor:
+        return EventLoopMonitor("test", interval=0.02, threshold=0.1, registry=CollectorRegistry())
+
+    @pytest.mark.asyncio
+    async def test_bloqueo_capturado_con_pila_y_path(self):
+        """Un handler síncrono que bloquea el loop queda registrado con su pila y el path del request"""
+        monitor = self._monitor()
+
+        def consulta_sincrona_lenta():
+            time.sleep(0.3)
+
+        async def handler_bloqueante(scope):
+            consulta_sincrona_lenta()
+
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            await handler_bloqueante({"type": "http", "path": "/spa/tratamientos/42"})
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+
+        stalls = monitor.recent_stalls()
+        assert len(stalls) == 1
+        assert stalls[0]["path"] == "/spa/tratamientos/42"
+        assert any("consulta_sincrona_lenta" in linea for linea in stalls[0]["stack"])
+        assert stalls[0]["blocked_for"] >= 0.25  # Duración final, actualizada al volver a latir
+        assert monitor.stall_counter._value.get() == 1
+
+    @pytest.mark.asyncio
+    async def test_loop_libre_sin_bloqueos(self):
+        """Sin bloqueos el heartbeat solo alimenta el histograma de lag"""
+        monitor = self._monitor()
+        monitor.start()
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            await monitor.stop()
+        assert monitor.recent_stalls() == []
+        assert monitor._beat >= 3
+
+
+class TestCentroEsteticoSamplingProfiler:
+    def test_pilas_colapsadas_agregadas(self):
+        """Las muestras se agregan por pila en formato colapsado (raíz primero)"""
+        sampler = SamplingProfiler()
+        sampler._target_thread = threading.get_ident()
+
+        def calcular_precio():
+            for _ in range(3):
+                sampler.sample()
+
+        calcular_precio()
+        stacks = sampler.collapsed_stacks()
+        assert len(stacks) == 1
+        stack, count = stacks[0].rsplit(" ", 1)
+        assert count == "3"
+        assert stack.endswith("test_monitoring_centro_estetico.py:calcular_precio;profiler.py:sample")
+
+    def test_ventana_movil_descarta_muestras_viejas(self):
+        """Las cubetas fuera de la ventana ya no cuentan"""
+        sampler = SamplingProfiler(window_seconds=20, bucket_seconds=10)
+        sampler._buckets.append((int(time.monotonic() // 10) - 5, Counter({"vieja": 7})))
+        sampler._buckets.append((int(time.monotonic() // 10), Counter({"nueva": 2})))
+        assert sampler.collapsed_stacks() == ["nueva 2"]
+
+    @pytest.mark.asyncio
+    async def test_modo_sampling_en_caliente(self):
+        """En modo sampling el decorador solo acumula tiempos y el hilo muestrea el loop"""
+        profiler = APIProfiler("test", mode="off")
+
+        @profiler.profile_function("crear")
+        async def crear():
+            time.sleep(0.05)  # Trabajo síncrono que el muestreo debe ver
+            return "ok"
+
+        profiler.set_mode("sampling", rate_hz=500)
+        try:
+            assert await crear() == "ok"
+            assert await crear() == "ok"
+        finally:
+            profiler.set_mode("off")
+        assert not profiler.sampler.running
+        assert profiler.profiles["crear"]["calls"] == 2
+        report = profiler.get_sampling_report()
+        assert any(stack.rsplit(" ", 1)[0].endswith(":crear") for stack in report["collapsed_stacks"])
+        with pytest.raises(ValueError):
+            profiler.set_mode("tracing")
+
+    @pytest.mark.parametrize("rate_hz", ["abc", [100], float("nan"), float("inf"), 0, -5, 1e9])
+    def test_rate_hz_invalido_se_rechaza(self, rate_hz):
+        """rate_hz no numérico, no finito, no positivo o excesivo no se aplica al muestreo"""
+        profiler = APIProfiler("test", mode="off")
+        with pytest.raises(ValueError):
+            profiler.set_mode("sampling", rate_hz=rate_hz)
+        assert profiler.mode == "off"
+        assert not profiler.sampler.running
+        assert profiler.sampler.rate_hz == 100
+
+    def test_rate_hz_como_texto_se_convierte(self):
+        """Un rate_hz numérico enviado como texto (JSON) se acepta como float"""
+        profiler = APIProfiler("test", mode="off")
+        profiler.set_mode("off", rate_hz="250")
+        assert profiler.sampler.rate_hz == 250.0
+
+    def test_endpoint_de_modo_requiere_firma_y_valida(self, monkeypatch):
+        """/profiler/mode exige X-Profile firmado y responde 400 ante un rate_hz inválido"""
+        from app.main import app, profiler
+        monkeypatch.setattr(profiler, "profile_secret", "secreto")
+        monkeypatch.setattr(profiler, "mode", profiler.mode)
+        monkeypatch.setattr(profiler.sampler, "rate_hz", profiler.sampler.rate_hz)
+        token = profiler.sign_profile_request("POST", "/profiler/mode", int(time.time()) + 60)
+        http = TestClient(app)
+        assert http.post("/profiler/mode", json={"mode": "off"}).status_code == 403
+        assert http.post("/profiler/mode", json={"mode": "off"}, headers={"X-Profile": "1:abc"}).status_code == 403
+        for rate_hz in ("100x", 1e9):
+            response = http.post("/profiler/mode", json={"mode": "off", "rate_hz": rate_hz},
+                                 headers={"X-Profile": token})
+            assert response.status_code == 400
+        response = http.post("/profiler/mode", json={"mode": "off", "rate_hz": "50"}, headers={"X-Profile": token})
+        assert response.status_code == 200
+        assert response.json()["rate_hz"] == 50.0
+        monkeypatch.setattr(profiler, "profile_secret", None)
+        assert http.post("/profiler/mode", json={"mode": "off"}, headers={"X-Profile": token}).status_code == 403
+
+
+class TestCentroEsteticoRequestProfiling:
+    def _app(self, secret="secreto"):
+        profiler = APIProfiler("test", mode="off")
+        profiler.profile_secret = secret
+        spa_app = FastAPI()
+
+        @spa_app.get("/spa/tratamientos/{tratamiento_id}")
+        async def tratamiento(tratamiento_id: int):
+            datos = [{"id": i, "nombre": f"tratamiento {i}"} for i in range(2000)]
+            return {"id": tratamiento_id, "total": len(datos)}
+
+        @spa_app.get("/spa/agenda")
+        async def agenda():
+            await asyncio.sleep(0.2)
+            return {"citas": []}
+
+        return profiler, RequestProfilerMiddleware(spa_app, profiler=profiler)
+
+    def test_request_firmado_se_perfila(self):
+        """Con X-Profile válido se guarda el reporte de CPU y asignaciones bajo el ID devuelto"""
+        profiler, spa_app = self._app()
+        token = profiler.sign_profile_request("GET", "/spa/tratamientos/7", int(time.time()) + 60)
+        with TestClient(spa_app) as profiled_client:
+            profiled_client.get("/spa/tratamientos/7")  # Calienta la ruta: el primer request de FastAPI inspecciona el endpoint
+            response = profiled_client.get("/spa/tratamientos/7", headers={"X-Profile": token})
+        assert response.status_code == 200
+        report = profiler.request_profiles[response.headers["X-Profile-Id"]]
+        assert report["path"] == "/spa/tratamientos/7"
+        assert report["status_code"] == 200
+        assert "tratamiento" in report["cpu_profile"]
+        assert report["concurrent_requests"] == 0
+        assert report["isolated"]
+        assert report["peak_memory_bytes"] > 0
+        assert report["allocations"]
+        assert not tracemalloc.is_tracing()
+
+    @pytest.mark.asyncio
+    async def test_reporte_marca_trafico_concurrente(self):
+        """Un request atendido durante el profile queda contado: el reporte no es exclusivo"""
+        profiler, spa_app = self._app()
+        token = profiler.sign_profile_request("GET", "/spa/agenda", int(time.time()) + 60)
+        transport = httpx.ASGITransport(app=spa_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            perfilado = asyncio.create_task(http.get("/spa/agenda", headers={"X-Profile": token}))
+            await asyncio.sleep(0.05)
+            otro = await http.get("/spa/tratamientos/3")
+            response = await perfilado
+        assert otro.status_code == 200
+        report = profiler.request_profiles[response.headers["X-Profile-Id"]]
+        assert report["concurrent_requests"] == 1
+        assert not report["isolated"]
+        assert profiler._requests_in_flight == 0
+
+    @pytest.mark.parametrize("cabecera", [
+        None,
+        "firma-invalida",
+        "{expirado}",
+        "{otra_ruta}",
+    ])
+    def test_sin_firma_valida_no_se_perfila(self, cabecera):
+        """Sin cabecera, con firma inválida, expirada o de otra ruta el request no se perfila"""
+        profiler, spa_app = self._app()
+        ahora = int(time.time())
+        valores = {
+            "{expirado}": profiler.sign_profile_request("GET", "/spa/tratamientos/7", ahora - 1),
+            "{otra_ruta}": profiler.sign_profile_request("GET", "/spa/tratamientos/8", ahora + 60),
+        }
+        headers = {"X-Profile": valores.get(cabecera, cabecera)} if cabecera else {}
+        with TestClient(spa_app) as profiled_client:
+            response = profiled_client.get("/spa/tratamientos/7", headers=headers)
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+        assert profiler.request_profiles == {}
+
+    def test_cabecera_no_ascii_no_rompe_el_request(self):
+        """Una cabecera X-Profile con bytes no ASCII se rechaza sin error 500"""
+        profiler, spa_app = self._app()
+        token = f"{int(time.time()) + 60}:firmañ".encode("latin-1")
+        assert not profiler.verify_profile_token(token.decode("latin-1"), "GET", "/spa/tratamientos/7")
+        with TestClient(spa_app) as profiled_client:
+            response = profiled_client.get("/spa/tratamientos/7", headers={"X-Profile": token})
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+
+    def test_sin_secreto_deshabilitado(self):
+        """Sin PROFILER_SECRET ninguna cabecera activa el profiling"""
+        profiler, spa_app = self._app(secret=None)
+        assert not profiler.verify_profile_token(f"{int(time.time()) + 60}:abc", "GET", "/spa/tratamientos/7")
+        with TestClient(spa_app) as profiled_client:
+            response = profiled_client.get("/spa/tratamientos/7", headers={"X-Profile": "x"})
+        assert "X-Profile-Id" not in response.headers